@@ -0,0 +1,146 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Persistent catalog of media files with probed metadata.
+
+Files are keyed by path, size and modification time in a small sqlite
+database.  Only new or changed files are probed with ffprobe, in the
+background by a bounded pool of worker threads at low priority, so playback
+starts with the scanned files right away.  Files that can't be decoded are
+quarantined: they are left out of the playlists built after their probe.
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .copy_scheduler import lower_thread_priority
+
+
+class MediaCatalog:
+
+    def __init__(self, path, workers=2, probe_timeout=10, on_quarantined=None):
+        """Open (or create) the catalog database at path.  Workers is the
+        maximum number of ffprobe processes running at the same time.
+        On_quarantined is called (on the probe thread) when probes found
+        files that can't be decoded.
+        """
+        self._workers = workers
+        self._probe_timeout = probe_timeout
+        self._on_quarantined = on_quarantined
+        self._lock = threading.Lock()
+        # Files waiting for their probe and being probed, path -> (size, mtime).
+        self._pending = OrderedDict()
+        self._probing = {}
+        self._pending_cond = threading.Condition(self._lock)
+        self._has_ffprobe = True
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS media ('
+                         'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                         'duration REAL, codec TEXT, width INTEGER, height INTEGER, '
+                         'decodable INTEGER)')
+        self._db.commit()
+
+    def _probe(self, path):
+        """Run ffprobe on path and return a (duration, codec, width, height,
+        decodable) tuple.  Returns None if ffprobe is not installed, the file
+        is then assumed to be decodable but not stored in the catalog.
+        """
+        args = ['ffprobe', '-v', 'error', '-print_format', 'json',
+                '-show_entries', 'format=duration:stream=codec_type,codec_name,width,height',
+                path]
+        try:
+            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    timeout=self._probe_timeout)
+        except FileNotFoundError:
+            return None
+        except subprocess.TimeoutExpired:
+            return (None, None, None, None, False)
+        if result.returncode != 0:
+            return (None, None, None, None, False)
+        try:
+            info = json.loads(result.stdout.decode('utf-8', 'replace'))
+        except ValueError:
+            return (None, None, None, None, False)
+        # Audio only files play too, the video stream is preferred for the
+        # codec and size.
+        streams = [s for s in info.get('streams', []) if s.get('codec_type') in ('video', 'audio')]
+        if not streams:
+            return (None, None, None, None, False)
+        stream = min(streams, key=lambda s: s.get('codec_type') != 'video')
+        try:
+            duration = float(info.get('format', {}).get('duration'))
+        except (TypeError, ValueError):
+            duration = None
+        return (duration, stream.get('codec_name'), stream.get('width'), stream.get('height'), True)
+
+    def update(self, files, roots=()):
+        """Bring the catalog up to date for the given list of (path, size,
+        mtime) tuples and return the set of paths that are decodable, or not
+        probed yet.  Only entries that are new or whose size or mtime changed
+        get probed, in the background.  Entries below one of the roots that
+        are not in files are removed.
+        """
+        with self._lock:
+            paths = set(path for path, _, _ in files)
+            roots = tuple(root.rstrip('/') + '/' for root in roots)
+            known = {}
+            gone = []
+            for path, size, mtime, decodable in self._db.execute(
+                    'SELECT path, size, mtime, decodable FROM media'):
+                if path not in paths and path.startswith(roots):
+                    gone.append((path,))
+                else:
+                    known[path] = (size, mtime, decodable)
+            self._db.executemany('DELETE FROM media WHERE path = ?', gone)
+            self._db.commit()
+            decodable = set()
+            for path, size, mtime in files:
+                if known.get(path, (None, None))[:2] == (size, int(mtime)):
+                    if known[path][2]:
+                        decodable.add(path)
+                    continue
+                decodable.add(path)
+                if self._has_ffprobe and self._probing.get(path) != (size, int(mtime)):
+                    self._pending[path] = (size, int(mtime))
+            if self._pending:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                self._pending_cond.notify_all()
+            return decodable
+
+    def _run(self):
+        """Probe thread: probe the pending files in batches, store the
+        results and report new quarantined files.
+        """
+        lower_thread_priority()
+        with ThreadPoolExecutor(max_workers=self._workers, initializer=lower_thread_priority) as executor:
+            while True:
+                with self._lock:
+                    while not self._pending:
+                        self._pending_cond.wait()
+                    batch = list(self._pending.items())
+                    self._probing = dict(self._pending)
+                    self._pending.clear()
+                results = executor.map(lambda item: self._probe(item[0]), batch)
+                rows = []
+                for (path, (size, mtime)), result in zip(batch, results):
+                    if result is None:
+                        # No ffprobe, everything plays.
+                        self._has_ffprobe = False
+                    else:
+                        rows.append((path, size, mtime) + result)
+                with self._lock:
+                    self._db.executemany('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                    self._db.commit()
+                    self._probing = {}
+                    if not self._has_ffprobe:
+                        self._pending.clear()
+                if self._on_quarantined is not None and any(not row[-1] for row in rows):
+                    self._on_quarantined()
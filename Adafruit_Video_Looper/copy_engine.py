@@ -0,0 +1,291 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""File copy engine used by the copy mode reader.
+
+Data is moved by the kernel with copy_file_range or sendfile in large chunks
+and never passes through Python.  When the data has to be verified, it is
+read into a ring of buffers instead and hashed on a separate thread while the
+next chunk is read and written.  Progress is only counted while copying, a
+ProgressReporter thread hands it to a (slow) rendering callback at a fixed
+rate, so drawing doesn't slow the copy down.
+"""
+import errno
+import hashlib
+import os
+import queue
+import threading
+import time
+
+from . import metrics
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# An interrupted copy resumes this many bytes before the end of the partial
+# file, in case its last written data didn't make it to the disk.
+RESUME_OVERLAP = 1024 * 1024
+
+# FAT filesystems store modification times with 2 second resolution.
+MTIME_TOLERANCE = 2
+
+# Errors telling that a kernel copy method is not usable for these files.
+_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+# The throughput is the rate of the bytes over the rate of the seconds.
+_copy_bytes = metrics.counter('video_looper_copy_bytes_total', 'Bytes copied by the copy mode.')
+_copy_seconds = metrics.counter('video_looper_copy_seconds_total', 'Time spent copying files in the copy mode.')
+_copy_checksum_errors = metrics.counter('video_looper_copy_checksum_errors_total',
+                                        'Copies that did not match their expected checksum.')
+
+
+def _copy_file_range(infd, outfd, count):
+    return os.copy_file_range(infd, outfd, count)
+
+
+def _sendfile(infd, outfd, count):
+    return os.sendfile(outfd, infd, None, count)
+
+
+def _read_write(infd, outfd, count):
+    data = os.read(infd, count)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(outfd, view):]
+    return len(data)
+
+
+def copy_fd(infd, outfd, size, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy size bytes from the current position of infd to outfd, calling
+    progress(n) after each chunk of n bytes.  Uses the fastest method that
+    works for the two files.  Returns the number of bytes copied.
+    """
+    methods = [_read_write]
+    if hasattr(os, 'sendfile'):
+        methods.insert(0, _sendfile)
+    if hasattr(os, 'copy_file_range'):
+        methods.insert(0, _copy_file_range)
+    copied = 0
+    while copied < size:
+        try:
+            n = methods[0](infd, outfd, min(chunk_size, size - copied))
+        except OSError as err:
+            # Only give up on a method if it failed before copying anything,
+            # later errors are real I/O errors.
+            if err.errno in _UNSUPPORTED and copied == 0 and len(methods) > 1:
+                methods.pop(0)
+                continue
+            raise
+        if n == 0:
+            break
+        copied += n
+        if progress is not None:
+            progress(n)
+    return copied
+
+
+class ChecksumError(Exception):
+    """Raised when copied data doesn't match its expected checksum."""
+
+
+def copy_fd_hashed(infd, outfd, size, digest, progress=None, chunk_size=DEFAULT_CHUNK_SIZE, buffers=3):
+    """Copy like copy_fd, but through user space buffers that are fed to the
+    hashlib object digest on a separate thread (hashlib releases the GIL for
+    large buffers), so hashing overlaps with reading and writing.  Returns the
+    number of bytes copied.
+    """
+    free = queue.Queue()
+    for _ in range(buffers):
+        free.put(bytearray(chunk_size))
+    filled = queue.Queue()
+
+    def hasher():
+        while True:
+            item = filled.get()
+            if item is None:
+                return
+            buf, n = item
+            digest.update(memoryview(buf)[:n])
+            free.put(buf)
+
+    thread = threading.Thread(target=hasher, daemon=True)
+    thread.start()
+    copied = 0
+    try:
+        while copied < size:
+            buf = free.get()
+            n = os.readv(infd, [memoryview(buf)[:min(chunk_size, size - copied)]])
+            if n == 0:
+                free.put(buf)
+                break
+            view = memoryview(buf)[:n]
+            while view:
+                view = view[os.write(outfd, view):]
+            filled.put((buf, n))
+            copied += n
+            if progress is not None:
+                progress(n)
+    finally:
+        filled.put(None)
+        thread.join()
+    return copied
+
+
+def copy_file(src, dst, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copy the contents of file src to dst, see copy_fd."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        return copy_fd(fsrc.fileno(), fdst.fileno(), size, progress, chunk_size)
+
+
+def partial_path(dst, st):
+    """Return the hidden file a copy of a source with stat result st to dst
+    is written to.  Size and mtime of the source are part of the name so an
+    interrupted copy is only resumed from the same version of the source.
+    """
+    directory, name = os.path.split(dst)
+    return os.path.join(directory, '.{0}.{1}-{2}.partial'.format(name, st.st_size, int(st.st_mtime)))
+
+
+def copy_file_atomic(src, dst, progress=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     verify=False, expected_sha256=None):
+    """Copy src to a partial file next to dst and rename it to dst once it is
+    complete, so dst never appears half written.  The modification time of
+    src is kept.  A partial file left by an interrupted copy of the same
+    source is resumed instead of starting over.  With verify (or if an
+    expected_sha256 is given) the data is hashed while it is copied and a
+    ChecksumError is raised, and dst left untouched, if it doesn't match.
+    Returns the hex sha256 of the data if it was hashed, otherwise None.
+    """
+    started = time.monotonic()
+    st = os.stat(src)
+    partial = partial_path(dst, st)
+    # Drop partial files of other versions of the source.
+    directory, name = os.path.split(dst)
+    for other in os.listdir(directory or '.'):
+        if other.startswith('.' + name + '.') and other.endswith('.partial') \
+                and os.path.join(directory, other) != partial:
+            os.remove(os.path.join(directory, other))
+    with open(src, 'rb') as fsrc:
+        with open(partial, 'r+b' if os.path.exists(partial) else 'wb') as fdst:
+            offset = max(0, min(os.fstat(fdst.fileno()).st_size, st.st_size) - RESUME_OVERLAP)
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            fdst.truncate()
+            if offset and progress is not None:
+                progress(offset)
+            if verify or expected_sha256:
+                # The resumed part is hashed from what is already on disk.
+                digest = hashlib.sha256()
+                with open(partial, 'rb') as fdone:
+                    _hash_fd(fdone.fileno(), offset, digest, chunk_size)
+                copy_fd_hashed(fsrc.fileno(), fdst.fileno(), st.st_size - offset, digest, progress, chunk_size)
+                sha256 = digest.hexdigest()
+            else:
+                copy_fd(fsrc.fileno(), fdst.fileno(), st.st_size - offset, progress, chunk_size)
+                sha256 = None
+            os.fsync(fdst.fileno())
+    _copy_bytes.inc(st.st_size - offset)
+    _copy_seconds.inc(time.monotonic() - started)
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        _copy_checksum_errors.inc()
+        os.remove(partial)
+        raise ChecksumError('{0}: checksum {1} does not match expected {2}'.format(src, sha256, expected_sha256))
+    os.utime(partial, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(partial, dst)
+    return sha256
+
+
+def same_file_stat(src_st, dst_st):
+    """Return true if two stat results look like the same file content,
+    i.e. same size and (within FAT resolution) same modification time.
+    """
+    return src_st.st_size == dst_st.st_size \
+        and abs(src_st.st_mtime - dst_st.st_mtime) <= MTIME_TOLERANCE
+
+
+def _hash_fd(fd, size, digest, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Feed size bytes (or until the end) read from fd to digest."""
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    done = 0
+    while size is None or done < size:
+        n = os.readv(fd, [view if size is None else view[:min(chunk_size, size - done)]])
+        if not n:
+            break
+        digest.update(view[:n])
+        done += n
+
+
+def file_sha256(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return the hex sha256 digest of the contents of path."""
+    digest = hashlib.sha256()
+    with open(path, 'rb', buffering=0) as f:
+        _hash_fd(f.fileno(), None, digest, chunk_size)
+    return digest.hexdigest()
+
+
+class CopyProgress:
+    """Byte counters of a copy job, advanced by the copying threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.copied = 0
+        self._started = time.monotonic()
+
+    def start(self, total):
+        with self._lock:
+            self.total = total
+            self.copied = 0
+            self._started = time.monotonic()
+
+    def advance(self, n):
+        with self._lock:
+            self.copied += n
+
+    def eta(self):
+        """Return the estimated number of seconds until the job is done, or
+        None while there is not enough data for an estimate.
+        """
+        elapsed = time.monotonic() - self._started
+        if self.copied <= 0 or elapsed < 1:
+            return None
+        return (self.total - self.copied) * elapsed / self.copied
+
+
+class ProgressReporter:
+    """Thread calling render(copied, total) at most rate times per second
+    while a copy is running, and only when the progress changed.
+    """
+
+    def __init__(self, progress, render, rate=10):
+        self._progress = progress
+        self._render = render
+        self._interval = 1.0 / rate
+        self._stop = threading.Event()
+        self._last = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _report(self):
+        state = (self._progress.copied, self._progress.total)
+        if state != self._last and state[1] > 0:
+            self._last = state
+            self._render(*state)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._report()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and render the final state."""
+        self._stop.set()
+        self._thread.join()
+        self._report()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
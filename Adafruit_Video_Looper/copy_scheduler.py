@@ -0,0 +1,163 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Planning and running a copy job over several source drives.
+
+The whole job is planned before anything is copied, so the total number of
+bytes is known for the progress bar and the free space on the target can be
+checked up front.  Every source drive gets its own worker thread, so reads
+from several drives run at the same time.  Each worker copies with the
+kernel copy of copy_engine: written data goes to the page cache and is
+flushed to the target while the worker reads the next chunk, which overlaps
+reads and writes without passing the data through Python.
+
+A job running in the background while videos play can lower the CPU and I/O
+priority of its worker threads, so the player reading from the same SD card
+is served first.
+"""
+import ctypes
+import ctypes.util
+import os
+import platform
+import threading
+from collections import OrderedDict, namedtuple
+
+# ioprio_set syscall numbers, there is no wrapper in Python or glibc.
+_NR_IOPRIO_SET = {'x86_64': 251, 'i686': 289, 'aarch64': 30, 'armv7l': 314, 'armv6l': 314}
+# gettid syscall numbers, threading.get_native_id needs Python 3.8.
+_NR_GETTID = {'x86_64': 186, 'i686': 224, 'aarch64': 178, 'armv7l': 224, 'armv6l': 224}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+def lower_thread_priority():
+    """Move the calling thread to the idle I/O scheduling class (only honored
+    by the BFQ scheduler) and to the lowest CPU priority.  Failures are
+    ignored, the thread then just runs at normal priority.
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if hasattr(threading, 'get_native_id'):
+        tid = threading.get_native_id()
+    elif platform.machine() in _NR_GETTID:
+        tid = libc.syscall(_NR_GETTID[platform.machine()])
+    else:
+        return
+    nr = _NR_IOPRIO_SET.get(platform.machine())
+    if nr is not None:
+        libc.syscall(nr, _IOPRIO_WHO_PROCESS, tid, _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT)
+    try:
+        # On Linux the nice value is per thread.
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except OSError:
+        pass
+
+
+# A file to copy.  Drive is the mount path of the source drive, tasks of the
+# same drive are copied one after another.
+CopyTask = namedtuple('CopyTask', 'src dst name size drive expected_sha256')
+
+
+class CopyPlan:
+    """The files to copy into the target directory and the files to delete
+    from it before copying.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.delete = set()
+        self._tasks = OrderedDict()
+
+    def add(self, task):
+        """Add a task, replacing the task of an earlier drive for a file with
+        the same name (like copying the drives one after another would).
+        """
+        self._tasks.pop(task.name, None)
+        self._tasks[task.name] = task
+
+    def discard(self, name):
+        """Drop the task for a file that a later drive has up to date."""
+        self._tasks.pop(name, None)
+
+    def tasks(self):
+        """Return the tasks, smallest files of each drive first so the first
+        copied files are available soon.
+        """
+        return sorted(self._tasks.values(), key=lambda task: task.size)
+
+    def drives(self):
+        return list(OrderedDict.fromkeys(task.drive for task in self._tasks.values()))
+
+    def total_bytes(self):
+        return sum(task.size for task in self._tasks.values())
+
+    def required_space(self, count_deleted=True):
+        """Return the number of bytes the target needs to have free for the
+        job, taking into account the space of the files that get replaced
+        and, unless count_deleted is false because they are only deleted
+        after copying, of the files that get deleted.  A replaced file is
+        only freed when its copy is complete, so the largest replaced file of
+        each drive (they are copied at the same time) is needed on top.
+        """
+        required = 0
+        # Largest replaced file by drive.
+        replaced = {}
+        names = set(self._tasks) | self.delete if count_deleted else set(self._tasks)
+        for name in names:
+            try:
+                existing = os.stat(os.path.join(self.target, name)).st_size
+            except OSError:
+                existing = 0
+            task = self._tasks.get(name)
+            required += (task.size if task is not None else 0) - existing
+            if task is not None:
+                replaced[task.drive] = max(replaced.get(task.drive, 0), existing)
+        return required + sum(replaced.values())
+
+    def free_space(self):
+        st = os.statvfs(self.target)
+        return st.f_bavail * st.f_frsize
+
+
+class CopyScheduler:
+    """Run the tasks of a plan with one worker thread per source drive.
+
+    For every task copy(task) is called on a worker thread, then
+    done(task, result, error) with its return value or the exception it
+    raised.  Calls of done are serialized, so it can update shared state.
+    With parallel false the drives are copied one after another.  With
+    idle the workers run at the lowest CPU and I/O priority.
+    """
+
+    def __init__(self, plan, copy, done, parallel=True, idle=False):
+        self._plan = plan
+        self._copy = copy
+        self._done = done
+        self._parallel = parallel
+        self._idle = idle
+        self._done_lock = threading.Lock()
+
+    def _worker(self, tasks):
+        if self._idle:
+            lower_thread_priority()
+        for task in tasks:
+            try:
+                result, error = self._copy(task), None
+            except Exception as err:
+                result, error = None, err
+            with self._done_lock:
+                self._done(task, result, error)
+
+    def run(self):
+        """Copy everything and return once all workers are finished."""
+        queues = OrderedDict((drive, []) for drive in self._plan.drives())
+        for task in self._plan.tasks():
+            queues[task.drive].append(task)
+        if not self._parallel or len(queues) <= 1:
+            for tasks in queues.values():
+                self._worker(tasks)
+            return
+        threads = [threading.Thread(target=self._worker, args=(tasks,), daemon=True)
+                   for tasks in queues.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
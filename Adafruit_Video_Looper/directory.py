@@ -3,6 +3,8 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 
+from .inotify import DirectoryWatcher
+
 class DirectoryReader:
 
     def __init__(self, config):
@@ -11,16 +13,29 @@ class DirectoryReader:
         """
         self._load_config(config)
         self._filecount = self.count_files()
+        # Get notified about changes by inotify, fall back to counting the
+        # files if the directory can't be watched.
+        try:
+            self._watcher = DirectoryWatcher(self._path, self._settle_time, self._recursive)
+        except OSError:
+            self._watcher = None
 
     def _load_config(self, config):
         self._path = config.get('directory', 'path')
+        self._settle_time = config.getfloat('directory', 'settle_time', fallback=1.0)
+        # Sub folders are scanned, so they are watched too.
+        self._recursive = config.getboolean('playlist', 'recursive', fallback=False)
 
     def search_paths(self):
         """Return a list of paths to search for files."""
         return [self._path]
 
     def is_changed(self):
-        """Return true if the number of files in the paths have changed."""
+        """Return true if files in the path were added, removed, renamed or
+        rewritten.  Without inotify only a changed number of files is noticed.
+        """
+        if self._watcher is not None:
+            return self._watcher.poll_changed()
         current_count = self.count_files()
         if current_count != self._filecount:
             self._filecount = current_count
@@ -28,12 +43,35 @@ class DirectoryReader:
         else:
             return False
 
+    def can_scan_in_background(self):
+        """Return true if search_paths can be called while a movie plays (to
+        scan for the warm start), it doesn't draw on the screen.
+        """
+        return True
+
+    def live_update(self):
+        """Return true if the playlist should be updated without interrupting
+        playback, never the case for this reader.
+        """
+        return False
+
+    def event_source(self):
+        """Return an object with a fileno() that becomes readable when
+        is_changed should be checked again, None if it has to be polled.
+        """
+        if self._watcher is not None:
+            return self._watcher.event_source()
+        return None
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'No files found in {0}'.format(self._path)
 
     def count_files(self):
-        return len(os.listdir(self._path))
+        try:
+            return len(os.listdir(self._path))
+        except OSError:
+            return 0
 
 
 def create_file_reader(config, screen):
@@ -3,8 +3,11 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 import subprocess
+import threading
 import time
 
+from .reactor import Notifier
+
 
 class HelloVideoPlayer:
 
@@ -13,6 +16,7 @@ class HelloVideoPlayer:
         background.
         """
         self._process = None
+        self._notifier = Notifier()
         self._load_config(config)
 
     def _load_config(self, config):
@@ -24,6 +28,10 @@ class HelloVideoPlayer:
         """Return list of supported file extensions."""
         return self._extensions
 
+    def warm_up(self):
+        """Nothing to start, hello_video runs a process per movie."""
+        pass
+
     def play(self, movie, loop=None, **kwargs):
         """Play the provided movied file, optionally looping it repeatedly."""
         self.stop(3)  # Up to 3 second delay to let the old player stop.
@@ -42,6 +50,28 @@ class HelloVideoPlayer:
         self._process = subprocess.Popen(args,
                                          stdout=open(os.devnull, 'wb'),
                                          close_fds=True)
+        # Wait for the process in the background to wake up the main loop
+        # as soon as it exits.
+        threading.Thread(target=self._wait_process, args=(self._process,), daemon=True).start()
+
+    def _wait_process(self, process):
+        process.wait()
+        self._notifier.notify()
+
+    def event_source(self):
+        """Return an object with a fileno() that becomes readable when the
+        player process exited, for the main loop to wait on.
+        """
+        return self._notifier
+
+    def prefetch(self, movies):
+        """Not supported, hello_video opens each movie when it is played."""
+        pass
+
+    def position(self):
+        """Not known, resuming starts the movie from the beginning."""
+        return None
+
     def pause(self):
         #todo add pause to HelloVideoPlayer
         print("pausing is not supported in HelloVideoPlayer")
@@ -71,6 +101,7 @@ class HelloVideoPlayer:
         while self._process is not None and self._process.returncode is None:
             if (time.time() - start) >= block_timeout_sec:
                 break
+            self._process.poll()
             time.sleep(0)
         # Let the process be garbage collected.
         self._process = None
@@ -79,6 +110,10 @@ class HelloVideoPlayer:
     def can_loop_count():
         return True
 
+    @staticmethod
+    def can_preload():
+        return False
+
 
 def create_player(config, **kwargs):
     """Create new video player based on hello_video."""
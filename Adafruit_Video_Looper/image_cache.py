@@ -0,0 +1,300 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Loading images scaled to the screen, and a cache of loaded images.
+
+Decoding a large JPEG and scaling it takes hundreds of milliseconds on a Pi.
+The ImageCache decodes the upcoming images on a worker thread, converts them
+to the pixel format of the display (so blitting them needs no conversion)
+and keeps the most recently used ones within a memory budget.  When an image
+is due it only has to be blitted.
+
+Scaled images are also kept in a DiskImageCache as uncompressed pixels, so
+after a reboot or in a long slideshow an image is only decoded and scaled
+once for a given screen size and fit mode.
+"""
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import pygame
+
+# Header of the cached image files: magic, width, height, x, y, format.
+_HEADER = struct.Struct('<4sIIii4s')
+_MAGIC = b'VLIC'
+_tobytes = getattr(pygame.image, 'tobytes', None) or pygame.image.tostring
+_frombuffer = pygame.image.frombuffer
+
+
+def fit_image(image_size, screen_size, scale=True, center=True):
+    """Return the size an image is shown with and its position on the screen.
+    With scale the image is scaled to fill the screen keeping its aspect
+    ratio, with center it is centered along the side that is not filled.
+    """
+    screen_w, screen_h = screen_size
+    image_w, image_h = image_size
+    new_image_w, new_image_h = image_size
+    image_x = 0
+    image_y = 0
+    screen_aspect_ratio = screen_w / screen_h
+    photo_aspect_ratio = image_w / image_h
+
+    if scale:
+        if screen_aspect_ratio < photo_aspect_ratio:  # Width is binding
+            new_image_w = screen_w
+            new_image_h = int(new_image_w / photo_aspect_ratio)
+        elif screen_aspect_ratio > photo_aspect_ratio:  # Height is binding
+            new_image_h = screen_h
+            new_image_w = int(new_image_h * photo_aspect_ratio)
+        else:  # Images have the same aspect ratio
+            new_image_w, new_image_h = screen_w, screen_h
+
+    if center:
+        if screen_aspect_ratio < photo_aspect_ratio:
+            image_y = (screen_h - new_image_h) // 2
+        elif screen_aspect_ratio > photo_aspect_ratio:
+            image_x = (screen_w - new_image_w) // 2
+
+    return (new_image_w, new_image_h), (image_x, image_y)
+
+
+def convert_surface(surface):
+    """Convert a surface to the pixel format of the display, keeping per pixel
+    alpha.  Returns the surface unchanged if there is no display.
+    """
+    try:
+        if surface.get_flags() & pygame.SRCALPHA:
+            return surface.convert_alpha()
+        return surface.convert()
+    except pygame.error:
+        return surface
+
+
+class DiskImageCache:
+    """Directory of scaled images stored as raw pixels, keyed by the source
+    path and modification time, the screen size and the fit mode.  The least
+    recently used files are deleted when the directory grows over max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, console_output=False):
+        self._directory = directory
+        self._console_output = console_output
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(entry.stat().st_size for entry in os.scandir(directory)
+                          if entry.name.endswith('.raw'))
+
+    def _path(self, path, screen_size, scale, center):
+        st = os.stat(path)
+        key = '\0'.join(map(str, (os.path.abspath(path), st.st_mtime_ns, st.st_size,
+                                   screen_size[0], screen_size[1], scale, center)))
+        return os.path.join(self._directory, hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest() + '.raw')
+
+    def load(self, path, screen_size, scale, center):
+        """Return the cached (surface, x, y) tuple or None."""
+        try:
+            cache_path = self._path(path, screen_size, scale, center)
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            # Mark as recently used for the eviction.
+            os.utime(cache_path)
+        except OSError:
+            return None
+        if len(data) < _HEADER.size:
+            return None
+        magic, width, height, image_x, image_y, fmt = _HEADER.unpack_from(data)
+        fmt = fmt.rstrip(b'\0').decode('ascii')
+        if magic != _MAGIC or len(data) - _HEADER.size != width * height * len(fmt):
+            return None
+        image = _frombuffer(memoryview(data)[_HEADER.size:], (width, height), fmt)
+        return (convert_surface(image), image_x, image_y)
+
+    def store(self, path, screen_size, scale, center, entry):
+        """Write an entry (surface, x, y) to the cache."""
+        image, image_x, image_y = entry
+        fmt = 'RGBA' if image.get_flags() & pygame.SRCALPHA else 'RGB'
+        width, height = image.get_size()
+        try:
+            cache_path = self._path(path, screen_size, scale, center)
+            tmp_path = cache_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, width, height, image_x, image_y, fmt.encode('ascii')))
+                f.write(_tobytes(image, fmt))
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, cache_path)
+        except OSError as err:
+            if self._console_output:
+                print('Failed to cache {0}: {1}'.format(path, err))
+            return
+        with self._lock:
+            self._bytes += size
+            if self._bytes > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files until the cache is below 90%
+        of its size, must be called with the lock held.
+        """
+        entries = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith('.raw'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        self._bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if self._bytes <= self._max_bytes * 0.9:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            self._bytes -= size
+
+
+# Disk caches by directory, shared by the looper (background image) and the
+# image player.
+_disk_caches = {}
+
+
+def create_disk_cache(config):
+    """Return the disk cache configured in the image_cache section, or None
+    if it is disabled.
+    """
+    directory = config.get('image_cache', 'path', fallback='')
+    if not directory:
+        return None
+    if directory not in _disk_caches:
+        max_bytes = int(config.getfloat('image_cache', 'size', fallback=512) * 1024 * 1024)
+        console_output = config.getboolean('video_looper', 'console_output', fallback=False)
+        try:
+            _disk_caches[directory] = DiskImageCache(directory, max_bytes, console_output)
+        except OSError as err:
+            if console_output:
+                print('Image cache {0} not usable: {1}'.format(directory, err))
+            _disk_caches[directory] = None
+    return _disk_caches[directory]
+
+
+def load_image(path, screen_size, scale=True, center=True, disk_cache=None):
+    """Load the image at path, scale it for the screen (see fit_image) and
+    convert it for the display.  Returns a (surface, x, y) tuple.  With a
+    disk_cache the scaled image is taken from or stored in it.
+    """
+    if disk_cache is not None:
+        entry = disk_cache.load(path, screen_size, scale, center)
+        if entry is not None:
+            return entry
+    image = pygame.image.load(path)
+    size, (image_x, image_y) = fit_image(image.get_size(), screen_size, scale, center)
+    if size != image.get_size():
+        image = pygame.transform.scale(image, size)
+    if disk_cache is not None:
+        disk_cache.store(path, screen_size, scale, center, (image, image_x, image_y))
+    return (convert_surface(image), image_x, image_y)
+
+
+class ImageCache:
+    """LRU cache of loaded images (see load_image) limited to max_bytes of
+    pixel data, with a worker thread loading images before they are needed.
+    """
+
+    def __init__(self, screen_size, scale=True, center=True, max_bytes=64 * 1024 * 1024,
+                 disk_cache=None, console_output=False):
+        self._screen_size = screen_size
+        self._console_output = console_output
+        self._scale = scale
+        self._center = center
+        self._disk_cache = disk_cache
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        # (path, mtime) -> (surface, x, y), least recently used first
+        self._images = OrderedDict()
+        self._loading = None
+        self._wanted = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _key(path):
+        try:
+            return (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return None
+
+    @staticmethod
+    def _surface_bytes(entry):
+        surface = entry[0]
+        return surface.get_pitch() * surface.get_height()
+
+    def _insert(self, key, entry):
+        """Add an entry and evict the least recently used ones over budget,
+        must be called with the lock held.
+        """
+        self._images[key] = entry
+        self._bytes += self._surface_bytes(entry)
+        while self._bytes > self._max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= self._surface_bytes(evicted)
+
+    def get(self, path):
+        """Return the (surface, x, y) tuple of the image at path, from the
+        cache if possible, otherwise it is loaded now.
+        """
+        key = self._key(path)
+        with self._cond:
+            # Wait for the worker if it is loading this image right now.
+            while key is not None and self._loading == key:
+                self._cond.wait()
+            entry = self._images.get(key)
+            if entry is not None:
+                self._images.move_to_end(key)
+                return entry
+        entry = load_image(path, self._screen_size, self._scale, self._center, self._disk_cache)
+        if key is not None:
+            with self._cond:
+                if key not in self._images:
+                    self._insert(key, entry)
+        return entry
+
+    def prefetch(self, paths):
+        """Load the images at paths in the background, in the given order.
+        Replaces the list of a previous call.
+        """
+        with self._cond:
+            self._wanted = list(paths)
+            # Keep them from being evicted by the images loaded next.
+            for path in reversed(self._wanted):
+                key = self._key(path)
+                if key in self._images:
+                    self._images.move_to_end(key)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._wanted:
+                    self._cond.wait()
+                path = self._wanted.pop(0)
+                key = self._key(path)
+                if key is None or key in self._images:
+                    continue
+                self._loading = key
+            # The loading key is always cleared, get waits as long as it is set.
+            entry = None
+            try:
+                entry = load_image(path, self._screen_size, self._scale, self._center, self._disk_cache)
+            except Exception as err:
+                if self._console_output:
+                    print('Failed to preload {0}: {1}'.format(path, err))
+            finally:
+                with self._cond:
+                    if entry is not None:
+                        self._insert(key, entry)
+                    self._loading = None
+                    self._cond.notify_all()
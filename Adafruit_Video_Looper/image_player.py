@@ -2,6 +2,16 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os, pygame
 from time import monotonic
+from . import metrics
+from .image_cache import ImageCache, create_disk_cache
+from .transitions import TransitionRenderer
+
+_transition_fps = metrics.gauge('video_looper_image_transition_fps',
+                                'Frames per second achieved by the image transitions.')
+_frame_p95_seconds = metrics.gauge('video_looper_image_frame_p95_seconds',
+                                   '95th percentile of the frame time of the recent transition frames.')
+_dropped_frames = metrics.gauge('video_looper_image_dropped_frames',
+                                'Frames of the image transitions dropped since the start.')
 
 class ImagePlayer:
 
@@ -14,6 +24,16 @@ class ImagePlayer:
         self._startTime = 0
         self._bgimage = bgimage
         self._isPaused = False
+        self._cache = ImageCache(self._size, self._scale, self._center,
+                                 max_bytes=self._cache_size,
+                                 disk_cache=create_disk_cache(config),
+                                 console_output=self._console_output)
+        self._renderer = TransitionRenderer(screen, self._fps, self._console_output)
+        # Two screen sized frames for the crossfade, allocated when needed.
+        self._frames = None
+        # Rect of the image on the screen if nothing else was drawn since.
+        self._shown_rect = None
+        metrics.on_collect(self._collect_metrics)
 
     def _load_config(self, config):
         self._extensions = config.get('image_player', 'extensions') \
@@ -27,11 +47,21 @@ class ImagePlayer:
         self._scale = config.getboolean('image_player', 'scale') 
         self._center = config.getboolean('image_player', 'center') 
         self._wait_time = config.getint('video_looper', 'wait_time')
+        self._cache_size = int(config.getfloat('image_player', 'cache_size', fallback=64) * 1024 * 1024)
+        self._transition = config.get('image_player', 'transition', fallback='none')
+        self._transition_time = config.getfloat('image_player', 'transition_time', fallback=1.0)
+        self._ken_burns = config.getboolean('image_player', 'ken_burns', fallback=False)
+        self._fps = config.getfloat('image_player', 'fps', fallback=30)
+        self._console_output = config.getboolean('video_looper', 'console_output', fallback=False)
 
     def supported_extensions(self):
         """Return list of supported file extensions."""
         return self._extensions
 
+    def warm_up(self):
+        """Nothing to start, images are shown by pygame itself."""
+        pass
+
     def play(self, image, loop=None, **kwargs):
         """Display the provided image file."""
         if loop is None:
@@ -44,41 +74,64 @@ class ImagePlayer:
         imagepath = image.target
 
         if imagepath != "" and os.path.isfile(imagepath):
-            self._blank_screen(False)
-            pyimage = pygame.image.load(imagepath)
-            image_x = 0
-            image_y = 0
-            screen_w, screen_h = self._size
-            image_w, image_h = pyimage.get_size()
-            new_image_w, new_image_h = pyimage.get_size()
-            screen_aspect_ratio = screen_w / screen_h
-            photo_aspect_ratio = image_w / image_h
-
-            if self._scale:
-                if screen_aspect_ratio < photo_aspect_ratio:  # Width is binding
-                    new_image_w = screen_w
-                    new_image_h = int(new_image_w / photo_aspect_ratio)
-                    pyimage = pygame.transform.scale(pyimage, (new_image_w, new_image_h))
-                elif screen_aspect_ratio > photo_aspect_ratio:  # Height is binding
-                    new_image_h = screen_h
-                    new_image_w = int(new_image_h * photo_aspect_ratio)
-                    pyimage = pygame.transform.scale(pyimage, (new_image_w, new_image_h))
-                else:  # Images have the same aspect ratio
-                    pyimage = pygame.transform.scale(pyimage, (screen_w, screen_h))
-
-            if self._center:
-                if screen_aspect_ratio < photo_aspect_ratio:
-                    image_y = (screen_h - new_image_h) // 2
-                elif screen_aspect_ratio > photo_aspect_ratio:
-                    image_x = (screen_w - new_image_w) // 2
-
-            self._screen.blit(pyimage, (image_x, image_y))
-            pygame.display.flip()
-            #future todo: crossfade, ken burns possbile?
-            #future todo: maybe preload images and/or create pygame image dict
+            # Usually preloaded (scaled and converted) by prefetch already.
+            pyimage, image_x, image_y = self._cache.get(imagepath)
+            self._renderer.stop()
+            image_rect = pyimage.get_rect(topleft=(image_x, image_y))
+            crossfade = None
+            if self._transition == 'crossfade':
+                crossfade = self._prepare_crossfade(pyimage, image_rect)
+            else:
+                self._blank_screen(False)
+                self._screen.blit(pyimage, image_rect)
+                pygame.display.flip()
+            kenburns = (pyimage, image_rect.topleft) if self._ken_burns else None
+            if crossfade is not None or kenburns is not None:
+                duration = self._duration * self._loop if self._loop > 0 else self._duration
+                self._renderer.start(crossfade, kenburns, self._transition_time,
+                                     max(0, duration - self._transition_time))
+            self._shown_rect = image_rect
 
         self._startTime = monotonic()
 
+    def _prepare_crossfade(self, pyimage, image_rect):
+        """Compose the new frame and keep a copy of the screen to fade from.
+        Returns the arguments of the crossfade.
+        """
+        if self._frames is None:
+            self._frames = [self._screen.copy(), self._screen.copy()]
+        old, new = self._frames
+        old.blit(self._screen, (0, 0))
+        new.fill(self._bgcolor)
+        if self._bgimage[0] is not None:
+            new.blit(self._bgimage[0], (self._bgimage[1], self._bgimage[2]))
+        new.blit(pyimage, image_rect)
+        # Only the old and the new image differ, unless something else was
+        # drawn on the screen in between.
+        if self._shown_rect is not None:
+            rect = self._shown_rect.union(image_rect)
+        else:
+            rect = self._screen.get_rect()
+        return (old, new, rect)
+
+    def frame_stats(self):
+        """Return the frame statistics of the transitions, see FrameStats."""
+        return self._renderer.stats.summary()
+
+    def _collect_metrics(self):
+        stats = self.frame_stats()
+        _transition_fps.set(stats['fps'])
+        _frame_p95_seconds.set(stats['p95_ms'] / 1000)
+        _dropped_frames.set(stats['dropped'])
+
+    def prefetch(self, movies):
+        """Load the images of the given upcoming movies in the background."""
+        self._cache.prefetch([movie.target for movie in movies])
+
+    def position(self):
+        """Not tracked, a resumed image is shown for its full duration."""
+        return None
+
     def pause(self):
         self._isPaused = not self._isPaused
     
@@ -93,12 +146,18 @@ class ImagePlayer:
         playing = (monotonic() - self._startTime) < self._duration*self._loop
         
         if not playing and self._wait_time > 0: #only refresh background if we wait between images
+            self._renderer.stop()
             self._blank_screen()
         
         return playing
 
+    def event_source(self):
+        """Images have no event source, the main loop polls is_playing."""
+        return None
+
     def stop(self, block_timeout_sec=0):
         """Stop the image display."""
+        self._renderer.stop()
         self._blank_screen()
         self._startTime = self._startTime-self._duration*self._loop
 
@@ -109,11 +168,17 @@ class ImagePlayer:
             self._screen.blit(self._bgimage[0], (self._bgimage[1], self._bgimage[2]))
         if(flip):
             pygame.display.flip()
+        # Others may draw on the blank screen before the next image.
+        self._shown_rect = None
 
     @staticmethod
     def can_loop_count():
         return True
 
+    @staticmethod
+    def can_preload():
+        return False
+
 
 def create_player(config, **kwargs):
     """Create new image player."""
@@ -0,0 +1,182 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Directory change notifications with Linux inotify, through ctypes."""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from .reactor import Notifier
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')
+
+_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF
+# Seconds between attempts to watch the directory again after it was gone.
+RETRY_INTERVAL = 1.0
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class DirectoryWatcher:
+    """Watch a directory for files that were added (once completely written),
+    deleted, renamed or replaced.  Bursts of events, like an rsync of many
+    files, are collapsed into a single change once no event arrived for
+    settle_time seconds and no file is still being written.  With recursive
+    the sub directories are watched too.  If the directory is deleted, moved
+    away or unmounted that is a change, and it is watched again once it is
+    back.  Raises OSError if the directory can't be watched.
+    """
+
+    def __init__(self, path, settle_time=1.0, recursive=False):
+        self._path = path
+        self._settle_time = settle_time
+        self._recursive = recursive
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # Watch descriptors of the watched directories, the first one is the
+        # directory itself.  Empty while it is gone.
+        self._watches = []
+        if not self._add_watches():
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), path)
+        self._changed = False
+        self._lock = threading.Lock()
+        self._notifier = Notifier()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def event_source(self):
+        """Return an object with a fileno() that becomes readable when a
+        settled change is available.
+        """
+        return self._notifier
+
+    def poll_changed(self):
+        """Return true once if the directory changed since the last call."""
+        with self._lock:
+            changed = self._changed
+            self._changed = False
+        return changed
+
+    def _add_watches(self):
+        """Watch the directory and with recursive its sub directories, those
+        that are watched already keep their watch.  Returns false if the
+        directory can't be watched.
+        """
+        if not self._watch(self._path) and not self._watches:
+            return False
+        if self._recursive:
+            for root, dirs, _ in os.walk(self._path):
+                # Hidden folders are not scanned either.
+                dirs[:] = [name for name in dirs if not name.startswith('.')]
+                for name in dirs:
+                    self._watch(os.path.join(root, name))
+        return True
+
+    def _watch(self, path):
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), _MASK)
+        if wd < 0:
+            return False
+        if wd not in self._watches:
+            self._watches.append(wd)
+        return True
+
+    def _remove_watches(self):
+        for wd in self._watches:
+            # Fails for watches the kernel removed already.
+            _libc.inotify_rm_watch(self._fd, wd)
+        self._watches = []
+
+    def _read_events(self, writing):
+        """Read pending events, returns (changed, resync): whether a relevant
+        change was seen and whether new directories have to be watched.  Keeps
+        track of files that were created but not yet closed.  If the
+        directory is gone all watches are removed.
+        """
+        changed = False
+        resync = False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False, False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if wd not in self._watches:
+                # Left over of a removed watch.
+                continue
+            if wd == self._watches[0] and mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED):
+                # The directory is gone, or its watch would follow it elsewhere.
+                self._remove_watches()
+                writing.clear()
+                return True, False
+            if mask & (IN_IGNORED | IN_MOVE_SELF):
+                # A sub directory is gone or moved (its new place is watched
+                # by the resync).
+                if mask & IN_MOVE_SELF:
+                    _libc.inotify_rm_watch(self._fd, wd)
+                self._watches.remove(wd)
+                writing.difference_update([entry for entry in writing if entry[0] == wd])
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self._recursive:
+                resync = True
+            if mask & IN_CREATE and not mask & IN_ISDIR:
+                # Reported once the writer closed the file.
+                writing.add((wd, name))
+                continue
+            writing.discard((wd, name))
+            changed = True
+        return changed, resync
+
+    def _run(self):
+        writing = set()
+        pending = False
+        last_event = 0
+        while True:
+            # Wait for the burst to settle, files still being written are
+            # reported only after they were closed.
+            timeout = None
+            if pending and not writing:
+                timeout = max(0, last_event + self._settle_time - time.monotonic())
+            if not self._watches:
+                # Gone, look for it to come back.
+                timeout = RETRY_INTERVAL if timeout is None else min(timeout, RETRY_INTERVAL)
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+            if readable:
+                changed, resync = self._read_events(writing)
+                if resync:
+                    self._add_watches()
+                if changed:
+                    pending = True
+                last_event = time.monotonic()
+                continue
+            if not self._watches and self._add_watches():
+                # Back (like a remounted drive), its files may differ.
+                pending = True
+                last_event = time.monotonic()
+            elif pending and not writing and time.monotonic() >= last_event + self._settle_time:
+                pending = False
+                with self._lock:
+                    self._changed = True
+                self._notifier.notify()
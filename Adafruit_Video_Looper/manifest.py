@@ -0,0 +1,96 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Checksum manifests of copied media files.
+
+A drive can carry a manifest in the format of sha256sum ("<hex>  <name>" per
+line) that copied files are verified against.  The copy mode reader keeps a
+local manifest of the target directory that records the checksum of each
+copied file together with its size and modification time, so the content of
+a file can later be checked without reading it again as long as its size and
+modification time didn't change.
+"""
+import json
+import os
+
+from .copy_engine import MTIME_TOLERANCE
+
+
+def read_sha256sums(path):
+    """Read a sha256sum style manifest and return a dict of file name to hex
+    digest.  Returns an empty dict if the file doesn't exist.
+    """
+    sums = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if not line or line.startswith('#'):
+                    continue
+                digest, _, name = line.partition(' ')
+                # Binary mode entries are marked with a * before the name.
+                name = name.lstrip(' ').lstrip('*')
+                if len(digest) == 64 and name:
+                    sums[os.path.basename(name)] = digest.lower()
+    except FileNotFoundError:
+        pass
+    return sums
+
+
+class LocalManifest:
+    """Checksums of the files in a directory, stored as hidden JSON file."""
+
+    def __init__(self, directory, name='.video_looper_manifest.json'):
+        self._directory = directory
+        self._path = os.path.join(directory, name)
+        try:
+            with open(self._path, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def save(self):
+        """Write the manifest atomically."""
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path)
+
+    def set(self, name, sha256):
+        """Record the checksum of the file name as it is now on disk."""
+        st = os.stat(os.path.join(self._directory, name))
+        self._entries[name] = {'sha256': sha256, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    def remove(self, name):
+        self._entries.pop(name, None)
+
+    def sha256(self, name):
+        """Return the recorded checksum of the file name if the file still has
+        the recorded size and modification time, otherwise None.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(os.path.join(self._directory, name))
+        except OSError:
+            return None
+        if st.st_size != entry['size'] or abs(st.st_mtime - entry['mtime']) > MTIME_TOLERANCE:
+            return None
+        return entry['sha256']
+
+    def check(self):
+        """Cheap check of the directory against the manifest, without reading
+        any file.  Returns the names of recorded files that are missing or
+        whose size changed, and forgets them.
+        """
+        damaged = []
+        for name, entry in list(self._entries.items()):
+            try:
+                st = os.stat(os.path.join(self._directory, name))
+            except OSError:
+                st = None
+            if st is None or st.st_size != entry['size']:
+                damaged.append(name)
+                del self._entries[name]
+        return damaged
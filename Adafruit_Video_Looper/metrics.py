@@ -0,0 +1,266 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Playback metrics in the Prometheus text format.
+
+Modules create their metrics at import time with counter, gauge and
+histogram of the module and update them as things happen, which only takes
+a lock and an addition.  Values that are only worth reading when they are
+scraped (like the frame statistics of the image player) are set by
+collect callbacks registered with on_collect.
+
+The MetricsExporter serves the metrics over HTTP on a local TCP port or a
+UNIX socket (curl --unix-socket ... http://localhost/metrics), or writes
+them to a file for the textfile collector of the node exporter when no
+socket is configured or it can't be opened.
+"""
+import bisect
+import math
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .resume import write_atomically
+
+# Buckets (in seconds) for latencies like loading a movie or mounting a drive.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets for the gap between movies, anything above a frame is visible.
+GAP_BUCKETS = (0.001, 0.005, 0.010, 0.017, 0.034, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Buckets for one pass of the main loop.
+LOOP_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Value that only goes up, like the number of played movies."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, '', self._value)]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, like the length of the playlist."""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    """Distribution of observed values, like transition gaps."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self._bounds = sorted(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + [math.inf], counts):
+            cumulative += count
+            samples.append((self.name + '_bucket', '{{le="{0}"}}'.format(_format(bound)), cumulative))
+        samples.append((self.name + '_sum', '', total))
+        samples.append((self.name + '_count', '', cumulative))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            elif type(metric) is not cls:
+                raise ValueError('Metric {0} is a {1}'.format(name, metric.kind))
+            return metric
+
+    def on_collect(self, callback):
+        """Call callback before the metrics are rendered, to set the gauges
+        that are only read when needed.
+        """
+        with self._lock:
+            self._collectors.append(callback)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for callback in collectors:
+            try:
+                callback()
+            except Exception as err:
+                print('Failed to collect metrics: {0}'.format(err))
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, labels, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation):
+    """Return the counter name of the registry, created if needed."""
+    return REGISTRY._get(Counter, name, documentation)
+
+
+def gauge(name, documentation):
+    """Return the gauge name of the registry, created if needed."""
+    return REGISTRY._get(Gauge, name, documentation)
+
+
+def histogram(name, documentation, buckets=LATENCY_BUCKETS):
+    """Return the histogram name of the registry, created if needed."""
+    return REGISTRY._get(Histogram, name, documentation, buckets)
+
+
+def on_collect(callback):
+    REGISTRY.on_collect(callback)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # UNIX sockets have no client address.
+        return str(self.client_address or 'local')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        os.chmod(self.server_address, 0o660)
+
+
+class MetricsExporter:
+
+    def __init__(self, listen='', textfile='', interval=15.0):
+        """Export the metrics on listen, 'host:port' or 'unix:path'.  If that
+        is empty or can't be opened they are written to the file textfile
+        every interval seconds (if set).
+        """
+        self._server = None
+        self._server_thread = None
+        self._textfile = None
+        self._interval = interval
+        self._closing = threading.Event()
+        self._writer = None
+        if listen:
+            try:
+                self._server = self._open(listen)
+            except (OSError, ValueError) as err:
+                print('Failed to serve metrics on {0}: {1}'.format(listen, err))
+        if self._server is not None:
+            self._server_thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._server_thread.start()
+        elif textfile:
+            self._textfile = textfile
+            self._writer = threading.Thread(target=self._write_textfile, daemon=True)
+            self._writer.start()
+
+    @staticmethod
+    def _open(listen):
+        if listen.startswith('unix:'):
+            return _UnixHTTPServer(listen[len('unix:'):], _MetricsHandler)
+        host, _, port = listen.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), _MetricsHandler)
+        server.daemon_threads = True
+        return server
+
+    def _write(self):
+        try:
+            write_atomically(self._textfile, REGISTRY.render(), fsync=False)
+        except OSError as err:
+            print('Failed to write metrics to {0}: {1}'.format(self._textfile, err))
+
+    def _write_textfile(self):
+        while True:
+            self._write()
+            if self._closing.wait(self._interval):
+                return
+
+    def close(self):
+        """Stop serving, a textfile is written a last time."""
+        self._closing.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if isinstance(self._server, _UnixHTTPServer):
+                try:
+                    os.remove(self._server.server_address)
+                except OSError:
+                    pass
+        if self._writer is not None:
+            self._writer.join()
+            self._write()
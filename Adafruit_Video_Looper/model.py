@@ -1,7 +1,9 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
+import itertools
 import random
+from collections import deque
 from os.path import basename
 from typing import Optional, Union
 
@@ -10,13 +12,22 @@ random.seed()
 class Movie:
     """Representation of a movie"""
 
-    def __init__(self, target:str , title: Optional[str] = None, repeats: int = 1):
+    # Playlists can hold tens of thousands of movies, keep them small.
+    __slots__ = ('target', 'filename', 'title', 'repeats', 'playcount', 'weight', 'start', 'stop')
+
+    def __init__(self, target:str , title: Optional[str] = None, repeats: int = 1, weight: float = 1.0,
+                 start: Optional[float] = None, stop: Optional[float] = None):
         """Create a playlist from the provided list of movies."""
         self.target = target
         self.filename = basename(target)
         self.title = title
         self.repeats = int(repeats)
         self.playcount = 0
+        # Relative chance to be picked in weighted random order.
+        self.weight = max(0.0, float(weight))
+        # Part of the movie to play in seconds (like #EXTVLCOPT:start-time).
+        self.start = start
+        self.stop = stop
 
     def was_played(self):
         if self.repeats > 1:
@@ -41,24 +52,191 @@ class Movie:
             return self.target == other.target
         return False
 
+    def __hash__(self):
+        return hash(self.target)
+
     def __str__(self):
         return "{0} ({1})".format(self.filename, self.title) if self.title else self.filename
 
     def __repr__(self):
         return repr((self.target, self.filename, self.title, self.repeats, self.playcount))
 
+class RandomOrder:
+    """Upcoming movies (as indexes into the playlist) in uniform random order.
+    The queue is filled as far ahead as it is looked at, so the upcoming
+    movies are known before they are played.
+    """
+
+    def __init__(self, movies, rng):
+        self._count = len(movies)
+        self._rng = rng
+        self._queue = deque()
+
+    def _fill(self):
+        """Append at least one index to the queue."""
+        self._queue.append(self._sample())
+
+    def _sample(self):
+        return self._rng.randrange(self._count)
+
+    def peek(self, count):
+        """Return the next count indexes."""
+        while len(self._queue) < count:
+            self._fill()
+        return list(itertools.islice(self._queue, count))
+
+    def pop(self, current=None):
+        """Return the next index, current is the index playing now."""
+        if not self._queue:
+            self._fill()
+        return self._queue.popleft()
+
+    def push(self, index):
+        """Put an index returned by pop back, it is the next again."""
+        self._queue.appendleft(index)
+
+
+class ShuffleOrder(RandomOrder):
+    """Shuffle bag: every movie plays once in random order, then the bag is
+    shuffled again.  The first movie of a bag is never the last of the bag
+    before, so no movie plays twice in a row.
+    """
+
+    def __init__(self, movies, rng):
+        super().__init__(movies, rng)
+        self._last = None
+
+    def _fill(self):
+        bag = list(range(self._count))
+        self._rng.shuffle(bag)
+        if bag[0] == self._last and self._count > 1:
+            swap = self._rng.randrange(1, self._count)
+            bag[0], bag[swap] = bag[swap], bag[0]
+        self._last = bag[-1]
+        self._queue.extend(bag)
+
+    def pop(self, current=None):
+        index = super().pop()
+        if index == current and self._count > 1:
+            # The movie was jumped to out of order, it had its turn.
+            index = super().pop()
+        return index
+
+
+class WeightedOrder(RandomOrder):
+    """Random order with the chance of a movie proportional to its weight,
+    sampled in constant time with the alias method.
+    """
+
+    def __init__(self, movies, rng):
+        super().__init__(movies, rng)
+        # Lazily read movies can list their weights without being read.
+        if hasattr(movies, 'weights'):
+            weights = list(movies.weights())
+        else:
+            weights = [movie.weight for movie in movies]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1.0] * self._count
+            total = float(self._count)
+        scaled = [weight * self._count / total for weight in weights]
+        self._prob = [1.0] * self._count
+        self._alias = list(range(self._count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self._prob[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+
+    def _sample(self):
+        index = self._rng.randrange(self._count)
+        return index if self._rng.random() < self._prob[index] else self._alias[index]
+
+
+# Random orders by name of the random_mode setting.
+RANDOM_ORDERS = {
+    'uniform': RandomOrder,
+    'shuffle': ShuffleOrder,
+    'weighted': WeightedOrder,
+}
+
+
 class Playlist:
-    """Representation of a playlist of movies."""
+    """Representation of a playlist of movies.
+
+    Movies are looked up by target and by file name through hash indexes, so
+    moving through and jumping around in large playlists takes constant time.
+    Movies can be any sequence (like the lazily read entries of a large M3U
+    file), the indexes are only built when a movie is looked up.
+    """
 
     def __init__(self, movies):
         """Create a playlist from the provided list of movies."""
         self._movies = movies
+        # Index of the first movie with a target / file name.
+        self._by_target = None
+        self._by_filename = None
         self._index = None
+        # Index of the movie set by set_next.
         self._next = None
+        self._peeked = None
+        # Random order the peeked index was taken from, if it was.
+        self._peeked_order = None
+        self._random_mode = 'shuffle'
+        self._order = None
+        self._rng = random.Random()
+
+    def set_random_mode(self, mode: str):
+        """Set how movies are picked in random order, one of RANDOM_ORDERS."""
+        if mode not in RANDOM_ORDERS:
+            raise ValueError('Unknown random mode {0}'.format(mode))
+        if mode != self._random_mode:
+            self._random_mode = mode
+            self._order = None
+
+    def _random_order(self) -> RandomOrder:
+        if self._order is None:
+            self._order = RANDOM_ORDERS[self._random_mode](self._movies, self._rng)
+        return self._order
+
+    def movies(self):
+        """Return an iterator over the movies, in playlist order."""
+        return iter(self._movies)
+
+    def index_of(self, thing: Union[Movie, str]) -> Optional[int]:
+        """Return the index of a movie (by target) or a file name in the
+        playlist, None if it is not in it.
+        """
+        if self._by_target is None:
+            self._build_indexes()
+        if isinstance(thing, Movie):
+            return self._by_target.get(thing.target)
+        return self._by_filename.get(thing)
+
+    def _build_indexes(self):
+        self._by_target = {}
+        self._by_filename = {}
+        # Lazily read movies can list their targets without being read.
+        if hasattr(self._movies, 'targets'):
+            targets = self._movies.targets()
+        else:
+            targets = [movie.target for movie in self._movies]
+        for index, target in enumerate(targets):
+            self._by_target.setdefault(target, index)
+            self._by_filename.setdefault(basename(target), index)
+
+    def current_index(self) -> Optional[int]:
+        """Return the index of the movie last returned by get_next."""
+        return self._index
 
-    def get_next(self, is_random, resume = False) -> Movie:
+    def get_next(self, is_random) -> Movie:
         """Get the next movie in the playlist. Will loop to start of playlist
-        after reaching end.
+        after reaching end.  Resuming after a restart is done with set_next
+        (see the ResumeJournal).
         """
         # Check if no movies are in the playlist and return nothing.
         if len(self._movies) == 0:
@@ -66,25 +244,22 @@ class Playlist:
         
         # Check if next movie is set and jump directly there:
         if self._next is not None:
-            next=self._next
+            self._index = self._next
             self._next = None # reset next
-            self._index=self._movies.index(next)
-            return next
-        
+            return self._movies[self._index]
+
+        # Use the movie that was already handed out by peek_next:
+        if self._peeked is not None:
+            self._index = self._peeked
+            self._peeked = None
+            self._peeked_order = None
         # Start Random movie
-        if is_random:
-            self._index = random.randrange(0, self.length())
+        elif is_random:
+            self._index = self._random_order().pop(self._index)
         else:
-            # Start at the first movie or resume and increment through them in order.
+            # Start at the first movie and increment through them in order.
             if self._index is None:
-                if resume:
-                    try:
-                        with open('playlist_index.txt', 'r') as f:
-                            self._index = int(f.read())
-                    except FileNotFoundError:
-                        self._index = 0
-                else:
-                    self._index = 0
+                self._index = 0
             else:
                 self._index += 1
                 
@@ -92,33 +267,95 @@ class Playlist:
             if self._index >= self.length():
                 self._index = 0
 
-        if resume:
-            with open('playlist_index.txt','w') as f:
-                f.write(str(self._index))
-
         return self._movies[self._index]
+
+    def peek_next(self, is_random) -> Movie:
+        """Return the movie the next call to get_next will return, without
+        advancing the playlist.  Returns None if nothing was played yet.
+        """
+        if len(self._movies) == 0 or self._index is None:
+            return None
+        if self._next is not None:
+            return self._movies[self._next]
+        if self._peeked is None:
+            if is_random:
+                self._peeked_order = self._random_order()
+                self._peeked = self._peeked_order.pop(self._index)
+            else:
+                self._peeked = (self._index + 1) % self.length()
+        return self._movies[self._peeked]
     
+    def continue_from(self, movie, queued=None) -> Movie:
+        """Position the playlist on movie, a movie of another playlist, so
+        get_next continues after it (or with queued, the movie that was
+        peeked in the other playlist).  Returns the matching movie of this
+        playlist with the play count taken over, or None if it is not in it.
+        """
+        self._drop_peeked()
+        index = self.index_of(movie)
+        if index is None:
+            return None
+        self._index = index
+        current = self._movies[index]
+        current.playcount = movie.playcount
+        if queued is not None:
+            self._peeked = self.index_of(queued)
+        return current
+
+    def _drop_peeked(self):
+        """Forget the peeked movie, a randomly picked one goes back to the
+        random order so it still gets its turn.
+        """
+        if self._peeked is not None and self._peeked_order is not None \
+                and self._peeked_order is self._order:
+            self._order.push(self._peeked)
+        self._peeked = None
+        self._peeked_order = None
+
+    def upcoming(self, is_random, count) -> list:
+        """Return up to count movies that the next calls to get_next will
+        return, without advancing the playlist.
+        """
+        first = self.peek_next(is_random)
+        if first is None:
+            return []
+        if is_random:
+            return [first] + [self._movies[index] for index in self._random_order().peek(max(0, count - 1))]
+        start = self._peeked if self._next is None else self._next
+        return [self._movies[(start + i) % self.length()] for i in range(min(count, self.length()))]
+
     # sets next by filename or Movie object or index
     def set_next(self, thing: Union[Movie, str, int]):
+        if self.length() == 0:
+            return
+        current = self._index if self._index is not None else 0
         if isinstance(thing, Movie):
-            if (thing in self._movies):
-                self._next(thing)
+            self._next = self.index_of(thing)
         elif isinstance(thing, str):
-            if thing in self._movies:
-                self._next = self._movies[self._movies.index(thing)]
+            index = self.index_of(thing)
+            if index is not None:
+                self._next = index
             elif thing[0:1] in ("+","-"):
-                self._next = self._movies[(self._index+int(thing))%self.length()]
+                try:
+                    self._next = (current+int(thing))%self.length()
+                except ValueError:
+                    self._next = None
         elif isinstance(thing, int):
-            if thing >= 0 and thing <= self.length():
-                self._next = self._movies[thing]
+            if thing >= 0 and thing < self.length():
+                self._next = thing
         else:
             self._next = None
-        self.clear_all_playcounts()
-        self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
+        self._drop_peeked()
+        # Only the current movie has been counted, start the next one fresh.
+        if self._next is not None:
+            self._movies[self._next].clear_playcount()
+        if self._index is not None:
+            self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
        
     # sets next relative to current index
     def seek(self, amount:int):
-        self.set_next((self._index+amount)%self.length())
+        current = self._index if self._index is not None else 0
+        self.set_next((current+amount)%self.length() if self.length() else 0)
 
     def length(self):
         """Return the number of movies in the playlist."""
@@ -126,4 +363,38 @@ class Playlist:
 
     def clear_all_playcounts(self):
         for movie in self._movies:
-            movie.clear_playcount()
\ No newline at end of file
+            movie.clear_playcount()
+
+
+if __name__ == '__main__':
+    # Micro benchmark of the playlist operations with a large playlist.
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    movies = [Movie('/media/clips/{0:03d}/clip{1:06d}.mp4'.format(i % 100, i), repeats=1)
+              for i in range(count)]
+    start = time.perf_counter()
+    playlist = Playlist(movies)
+    print('build:            {0:8.1f} ms for {1} movies'.format((time.perf_counter() - start) * 1000, count))
+
+    def bench(name, operation, rounds=10000):
+        start = time.perf_counter()
+        for i in range(rounds):
+            operation(i)
+        print('{0:17s} {1:8.2f} us/op'.format(name + ':', (time.perf_counter() - start) / rounds * 1e6))
+
+    playlist.get_next(False)
+    bench('get_next', lambda i: playlist.get_next(False), count)
+    bench('peek_next', lambda i: playlist.peek_next(False))
+    bench('set_next movie', lambda i: playlist.set_next(movies[(i * 7919) % count]))
+    bench('set_next name', lambda i: playlist.set_next(movies[(i * 7919) % count].filename))
+    bench('set_next index', lambda i: playlist.set_next((i * 7919) % count))
+    bench('seek', lambda i: playlist.seek(-1 if i % 2 else 1))
+    bench('jump+get_next', lambda i: (playlist.set_next('+5'), playlist.get_next(False)))
+    for mode in RANDOM_ORDERS:
+        playlist.set_random_mode(mode)
+        bench('random ' + mode, lambda i: playlist.get_next(True), count)
+    bench('upcoming 5', lambda i: (playlist.upcoming(True, 5), playlist.get_next(True)))
+    # What a lookup by list position used to cost.
+    bench('list.index', lambda i: movies.index(movies[(i * 7919) % count]), 100)
@@ -1,72 +1,433 @@
-"""Implementation of MPV video player."""
+"""Implementation of MPV video player.
+
+A single mpv process is started in idle mode and kept running for the whole
+lifetime of the looper.  Files are handed to it over mpv's JSON IPC protocol
+(see https://mpv.io/manual/stable/#json-ipc) so that switching between movies
+does not pay for process startup and video output initialization each time.
+"""
+import atexit
+import json
 import os
+import socket
 import subprocess
+import threading
 import time
 
+from . import metrics
+from .reactor import Notifier
+
+_start_seconds = metrics.histogram('video_looper_mpv_start_seconds',
+                                   'Time to start mpv until its IPC socket answers.')
+_starts = metrics.counter('video_looper_mpv_starts_total', 'Number of times mpv was (re)started.')
+_load_seconds = metrics.histogram('video_looper_player_load_seconds',
+                                  'Time from handing a movie to the player to its first frame.')
+# mpv counts per file, the counters add up the increases.
+_dropped_frames = {
+    'frame-drop-count': metrics.counter('video_looper_mpv_dropped_frames_total',
+                                        'Frames dropped by the video output of mpv.'),
+    'decoder-frame-drop-count': metrics.counter('video_looper_mpv_decoder_dropped_frames_total',
+                                                'Frames dropped by the decoder of mpv.'),
+}
+
+
 class MPVPlayer:
-    """Class to handle video playback using the mpv video player."""
+    """Class to handle video playback using a persistent mpv process."""
 
     def __init__(self, config):
         """Create an instance of a video player that runs mpv in the background."""
         self._process = None
+        self._socket = None
+        self._reader_thread = None
+        self._send_lock = threading.Lock()
+        self._replies = {}
+        self._replies_cond = threading.Condition()
+        self._request_id = 0
+        # Playback state, updated from mpv events by the reader thread.
+        self._loading = False
+        self._playing = False
+        self._idle = threading.Event()
+        # Movie handed to play() or preload() and the one currently shown.
+        self._pending = None
+        self._preloaded = None
+        # Transition gap measurement, from end of one file to the first frame
+        # of the next one.
+        self._last_end = None
+        self._transition = None
+        # Values of the start and end properties, set for movies that only
+        # play a part (clip) or are resumed in the middle.
+        self._time_props = {'start': 'none', 'end': 'none'}
+        # Start of the clip, restored after a resumed movie started.
+        self._reset_start = None
+        # When play() handed over the movie, for the load time.
+        self._load_started = None
+        # Last drop counts of the playing file.
+        self._drop_counts = {}
+        # Signalled by the reader thread whenever the playback state changed.
+        self._notifier = Notifier()
         # Get list of supported file extensions.
         self._extensions = config.get('mpv', 'extensions') \
                                .translate(str.maketrans('', '', ' \t\r\n.')) \
                                .split(',')
         # Get extra arguments from config.
         self._extra_args = config.get('mpv', 'extra_args').split()
+        self._ipc_socket = config.get('mpv', 'ipc_socket', fallback='/tmp/video_looper_mpv.sock')
+        atexit.register(self._shutdown)
 
     def supported_extensions(self):
         """Return list of supported file extensions."""
         return self._extensions
 
-    def play(self, movie, **kwargs):
+    def _start(self):
+        """Start the mpv process in idle mode and connect to its IPC socket."""
+        self._shutdown()
+        if os.path.exists(self._ipc_socket):
+            os.remove(self._ipc_socket)
+        args = ['mpv', '--idle=yes', '--no-terminal', '--prefetch-playlist=yes',
+                '--input-ipc-server={0}'.format(self._ipc_socket)]
+        args.extend(self._extra_args)
+        _starts.inc()
+        # Run mpv process and direct standard output to /dev/null.
+        self._process = subprocess.Popen(args,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        # Wait for mpv to create the socket, it usually takes a few ms.
+        start = time.monotonic()
+        while True:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self._ipc_socket)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if self._process.poll() is not None or time.monotonic() - start > 5:
+                    raise RuntimeError('mpv did not open its IPC socket at {0}'.format(self._ipc_socket))
+                time.sleep(0.01)
+        self._socket = sock
+        self._idle.set()
+        self._reader_thread = threading.Thread(target=self._read_events, daemon=True)
+        self._reader_thread.start()
+        self._command('observe_property', 1, 'idle-active')
+        _start_seconds.observe(time.monotonic() - start)
+        self._drop_counts = {}
+        for observe_id, name in enumerate(_dropped_frames, 2):
+            self._command('observe_property', observe_id, name)
+
+    def _shutdown(self):
+        """Terminate the mpv process and close the IPC connection."""
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+        self._loading = False
+        self._load_started = None
+        self._playing = False
+        self._preloaded = None
+        self._time_props = {'start': 'none', 'end': 'none'}
+        self._reset_start = None
+
+    def warm_up(self):
+        """Start mpv at startup, so the first movie doesn't wait for it and
+        its video output.  Failures are reported and retried by play.
+        """
+        try:
+            self._ensure_running()
+        except (OSError, RuntimeError) as err:
+            print('Failed to start mpv: {0}'.format(err))
+
+    def _ensure_running(self):
+        if self._process is None or self._process.poll() is not None or self._socket is None:
+            self._start()
+
+    def _command(self, *args, timeout=2, wait=True):
+        """Send a command over IPC and wait for its reply.  Returns the data
+        field of the reply or None, raises RuntimeError if mpv reports an error.
+        With wait=False the command is only sent, which is what the reader
+        thread has to use as it is the one delivering replies.
+        """
+        with self._send_lock:
+            self._request_id += 1
+            request_id = self._request_id if wait else 0
+            message = json.dumps({'command': list(args), 'request_id': request_id}) + '\n'
+            try:
+                self._socket.sendall(message.encode('utf-8'))
+            except (OSError, AttributeError):
+                raise RuntimeError('mpv IPC connection lost')
+        if not wait:
+            return None
+        with self._replies_cond:
+            if not self._replies_cond.wait_for(lambda: request_id in self._replies, timeout):
+                raise RuntimeError('mpv did not answer {0}'.format(args[0]))
+            reply = self._replies.pop(request_id)
+        if reply.get('error', 'success') != 'success':
+            raise RuntimeError('mpv {0} failed: {1}'.format(args[0], reply['error']))
+        return reply.get('data')
+
+    def _read_events(self):
+        """Reader thread: dispatch replies and track playback state from events."""
+        sock = self._socket
+        buffer = b''
+        while True:
+            try:
+                data = sock.recv(4096)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                if 'event' in message:
+                    self._handle_event(message)
+                elif message.get('request_id'):
+                    with self._replies_cond:
+                        self._replies[message['request_id']] = message
+                        self._replies_cond.notify_all()
+        # Connection closed, mpv most likely exited.
+        self._loading = False
+        self._playing = False
+        self._idle.set()
+        self._notifier.notify()
+
+    def _handle_event(self, event):
+        name = event['event']
+        if name == 'start-file':
+            if not self._loading and self._preloaded is not None:
+                # mpv moved on to the queued entry by itself, apply its loop
+                # setting before it reaches its end.
+                self._pending, loop_file = self._preloaded
+                self._preloaded = None
+                self._command('set_property', 'loop-file', loop_file, wait=False)
+                # Remove the finished entry, the playlist of mpv would grow
+                # by one entry per movie otherwise.
+                self._command('playlist-remove', 0, wait=False)
+            self._loading = False
+            self._playing = True
+            self._idle.clear()
+        elif name == 'end-file':
+            if event.get('reason') == 'eof':
+                self._last_end = time.monotonic()
+        elif name == 'playback-restart':
+            # Also sent after seeks and loops, only the first one after a new
+            # file started counts as a transition.
+            if self._reset_start is not None:
+                # The resume position only applies to the first start, loops
+                # start at the beginning of the clip.
+                self._time_props['start'] = self._reset_start
+                self._reset_start = None
+                self._command('set_property', 'start', self._time_props['start'], wait=False)
+            if self._load_started is not None:
+                _load_seconds.observe(time.monotonic() - self._load_started)
+                self._load_started = None
+            if self._pending is not None:
+                gap = None
+                if self._last_end is not None:
+                    gap = (time.monotonic() - self._last_end) * 1000
+                self._transition = (self._pending, gap)
+                self._pending = None
+                self._last_end = None
+        elif name == 'property-change' and event.get('name') in _dropped_frames:
+            self._count_drops(event['name'], event.get('data'))
+            return
+        elif name == 'property-change' and event.get('name') == 'idle-active':
+            if event.get('data'):
+                self._idle.set()
+                if not self._loading:
+                    self._playing = False
+            else:
+                self._idle.clear()
+        else:
+            return
+        self._notifier.notify()
+
+    def _count_drops(self, name, count):
+        """Add the increase of a drop count to its metric, the counts start
+        over for each file.
+        """
+        if not isinstance(count, int):
+            return
+        last = self._drop_counts.get(name, 0)
+        if count > last:
+            _dropped_frames[name].inc(count - last)
+        self._drop_counts[name] = count
+
+    def event_source(self):
+        """Return an object with a fileno() that becomes readable when the
+        playback state changed, for the main loop to wait on.
+        """
+        return self._notifier
+
+    def play(self, movie, loop=None, start=None, **kwargs):
         """Play the provided movie file, returning True if file was found/played.
-        If a duration is specified it will attempt to play the movie for that
-        number of seconds.
+        Loop is the number of times the movie is played, -1 loops forever and
+        None uses the repeat count of the movie.  Start is the position in
+        seconds to start at (loops start at the beginning again), otherwise
+        the start and stop time of the movie are used.
         """
         # Check if the file exists and is accessible.
-        if not os.path.exists(movie):
+        if not os.path.exists(movie.target):
+            return False
+        self._ensure_running()
+        if self.is_playing():
+            # Replacing a running movie, the gap starts now.
+            self._last_end = time.monotonic()
+        else:
+            # The looper left the player idle (wait_time, one shot playback or
+            # a countdown), that is no gap between movies.
+            self._last_end = None
+        self._loading = True
+        self._preloaded = None
+        self._pending = movie
+        self._load_started = time.monotonic()
+        try:
+            self._command('set_property', 'loop-file', self._loop_file(movie, loop))
+            self._command('set_property', 'pause', False)
+            clip_start = self._time_value(movie.start)
+            self._reset_start = clip_start if start else None
+            self._set_time('start', self._time_value(start) if start else clip_start)
+            self._set_time('end', self._time_value(movie.stop))
+            self._command('loadfile', movie.target, 'replace')
+        except RuntimeError:
+            self._loading = False
+            self._load_started = None
             return False
+        return True
 
-        # Build up the mpv command line arguments.
-        args = ['mpv']
-        args.extend(self._extra_args)
-        args.append(movie)
+    @staticmethod
+    def _time_value(seconds):
+        return '{0:.3f}'.format(seconds) if seconds else 'none'
 
-        # Run mpv process and direct standard output to /dev/null.
-        self._process = subprocess.Popen(args,
-                                       stdout=open(os.devnull, 'wb'),
-                                       stderr=open(os.devnull, 'wb'))
+    def _set_time(self, name, value):
+        """Set the start or end property, if it changed."""
+        if self._time_props[name] != value:
+            self._command('set_property', name, value)
+            self._time_props[name] = value
 
-        # Wait for the process to start
-        time.sleep(0.5)
+    def prefetch(self, movies):
+        """Nothing to do, mpv prefetches the movie queued by preload."""
+        pass
+
+    def preload(self, movie, loop=None):
+        """Queue the provided movie to start right after the current one ends,
+        so mpv can open and prefetch it while the current one still plays.
+        Returns True if the movie was queued.
+        """
+        if not self.is_playing() or not os.path.exists(movie.target):
+            return False
+        # The start and end apply to all files, movies with them are played
+        # on their own.
+        if movie.start or movie.stop or set(self._time_props.values()) != {'none'}:
+            return False
+        try:
+            self._command('loadfile', movie.target, 'append')
+        except RuntimeError:
+            return False
+        self._preloaded = (movie, self._loop_file(movie, loop))
+        return True
 
-        # Return True to indicate success
+    def cancel_preload(self):
+        """Remove the movie queued by preload, returns False if it started
+        already (or nothing was queued).
+        """
+        if self._preloaded is None:
+            return False
+        try:
+            self._command('playlist-clear')
+        except RuntimeError:
+            return False
+        self._preloaded = None
         return True
 
+    def poll_transition(self):
+        """Return a (movie, gap) tuple once the first frame of a new movie was
+        shown, gap is the time in milliseconds since the previous movie ended
+        or None if the player was idle before.  Returns None otherwise.
+        """
+        transition = self._transition
+        self._transition = None
+        return transition
+
+    @staticmethod
+    def _loop_file(movie, loop):
+        """Convert a loop count (None uses the movie repeats, -1 is endless)
+        to mpv's loop-file value.  mpv counts additional loops, so a movie
+        repeated twice loops once.
+        """
+        if loop is None:
+            loop = movie.repeats
+        if loop <= -1:
+            return 'inf'
+        elif loop > 1:
+            return str(loop - 1)
+        return 'no'
+
+    def position(self):
+        """Return the playback position in seconds or None."""
+        if not self.is_playing():
+            return None
+        try:
+            return self._command('get_property', 'time-pos')
+        except RuntimeError:
+            return None
+
+    def pause(self):
+        """Toggle pause of the current movie."""
+        if self.is_playing():
+            self._command('cycle', 'pause')
+
+    def sendKey(self, key: str):
+        """Send a key press to mpv, e.g. to use its chapter bindings."""
+        if self.is_playing():
+            self._command('keypress', key)
+
     def is_playing(self):
         """Return True if the video is still playing."""
-        if self._process is None:
+        if self._process is None or self._process.poll() is not None:
             return False
-        return self._process.poll() is None
+        return self._loading or self._playing
 
     def stop(self, block_timeout_sec=0):
-        """Stop the current video playing."""
-        # Stop the mpv process if it's running.
-        if self._process is not None and self._process.poll() is None:
-            # First try sending a quit command through a SIGTERM signal.
-            self._process.terminate()
-            # If a blocking timeout was specified, wait up to that amount of time
-            # for the process to stop.
-            if block_timeout_sec > 0:
-                self._process.wait(timeout=block_timeout_sec)
-            # Kill the process if it's still running.
-            if self._process.poll() is None:
-                self._process.kill()
-            self._process = None
+        """Stop the current video playing, mpv itself keeps running idle."""
+        if not self.is_playing():
+            return
+        self._loading = False
+        self._load_started = None
+        self._preloaded = None
+        self._pending = None
+        self._last_end = None
+        try:
+            self._command('stop')
+        except RuntimeError:
+            # mpv does not respond anymore, restart it on the next play.
+            self._shutdown()
+            return
+        # If a blocking timeout was specified, wait up to that amount of time
+        # for mpv to report that it is idle.
+        if block_timeout_sec > 0:
+            self._idle.wait(block_timeout_sec)
+        self._playing = False
+
+    @staticmethod
+    def can_loop_count():
+        return True
 
     @staticmethod
-    def create_player(config):
-        """Create an instance of the video player."""
-        return MPVPlayer(config) 
\ No newline at end of file
+    def can_preload():
+        return True
+
+
+def create_player(config, **kwargs):
+    """Create new video player based on mpv."""
+    return MPVPlayer(config)
@@ -0,0 +1,102 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""On screen display layer for the messages of the video looper.
+
+Rendered labels are cached by text, font and colors, and numbers (countdown,
+clock) are put together from cached glyphs of their characters.  Text is
+drawn into named slots that remember what they show, so when a slot gets new
+text only the rectangles that actually changed are redrawn and sent to the
+display, instead of filling and updating the whole screen every second.
+"""
+from collections import OrderedDict
+
+import pygame
+
+# Texts made of these characters are drawn glyph by glyph.
+GLYPH_CHARS = frozenset('0123456789:. ')
+
+
+class OSDLayer:
+
+    def __init__(self, screen, bgcolor, fgcolor, cache_size=256):
+        self._screen = screen
+        self._bgcolor = bgcolor
+        self._fgcolor = fgcolor
+        self._cache_size = cache_size
+        self._labels = OrderedDict()
+        # slot name -> (text, font, rect, glyph rects or None)
+        self._slots = {}
+        self._dirty = []
+
+    def label(self, text, font):
+        """Return the rendered text, from the cache if possible."""
+        key = (text, font, tuple(self._fgcolor), tuple(self._bgcolor))
+        surface = self._labels.get(key)
+        if surface is None:
+            surface = font.render(text, True, self._fgcolor, self._bgcolor)
+            self._labels[key] = surface
+            if len(self._labels) > self._cache_size:
+                self._labels.popitem(last=False)
+        else:
+            self._labels.move_to_end(key)
+        return surface
+
+    def clear(self):
+        """Fill the whole screen with the background color (updated with the
+        next flush) and forget the content of all slots.
+        """
+        self._screen.fill(self._bgcolor)
+        self._slots.clear()
+        self._dirty = [self._screen.get_rect()]
+
+    def text(self, slot, text, font, **anchor):
+        """Show text in the named slot, positioned by a pygame Rect attribute
+        like center=(x, y) or midtop=(x, y).  Nothing is drawn if the slot
+        already shows this text.
+        """
+        old = self._slots.get(slot)
+        if old is not None and old[0] == text and old[1] is font:
+            return
+        if text and set(text) <= GLYPH_CHARS:
+            self._glyph_text(slot, text, font, old, anchor)
+            return
+        surface = self.label(text, font)
+        rect = surface.get_rect(**anchor)
+        self._erase(old, rect)
+        self._screen.blit(surface, rect)
+        self._dirty.append(rect if old is None else rect.union(old[2]))
+        self._slots[slot] = (text, font, rect, None)
+
+    def _glyph_text(self, slot, text, font, old, anchor):
+        glyphs = [self.label(char, font) for char in text]
+        width = sum(glyph.get_width() for glyph in glyphs)
+        height = max(glyph.get_height() for glyph in glyphs)
+        rect = pygame.Rect(0, 0, width, height)
+        setattr(rect, *next(iter(anchor.items())))
+        rects = []
+        x = rect.x
+        for glyph in glyphs:
+            rects.append(pygame.Rect(x, rect.y, glyph.get_width(), glyph.get_height()))
+            x += glyph.get_width()
+        if old is not None and old[1] is font and old[3] == rects:
+            # Same layout, only redraw the characters that changed.
+            for char, old_char, glyph, glyph_rect in zip(text, old[0], glyphs, rects):
+                if char != old_char:
+                    self._screen.blit(glyph, glyph_rect)
+                    self._dirty.append(glyph_rect)
+        else:
+            self._erase(old, rect)
+            for glyph, glyph_rect in zip(glyphs, rects):
+                self._screen.blit(glyph, glyph_rect)
+            self._dirty.append(rect if old is None else rect.union(old[2]))
+        self._slots[slot] = (text, font, rect, rects)
+
+    def _erase(self, old, rect):
+        """Clear the part of the old content of a slot outside of rect."""
+        if old is not None and not rect.contains(old[2]):
+            self._screen.fill(self._bgcolor, old[2])
+
+    def flush(self):
+        """Send the changed rectangles to the display."""
+        if self._dirty:
+            pygame.display.update(self._dirty)
+            self._dirty = []
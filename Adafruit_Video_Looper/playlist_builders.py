@@ -1,28 +1,321 @@
+import codecs
 import os
 import re
 import urllib.parse
+from array import array
+from collections import OrderedDict
 
 from .model import Playlist, Movie
 
+_extinf_re = re.compile(r'^#EXTINF:-?[0-9.]+((?:\s*[\w-]+\=\".*?\")*)\s*,(.*)$')
+_attribute_re = re.compile(r'([\w-]+)\=\"(.*?)\"')
+_vlcopt_re = re.compile(r'^#EXTVLCOPT:(start-time|stop-time)=([0-9.]+)\s*$')
+_pls_re = re.compile(r'^(file|title)([0-9]+)=(.*)$', re.IGNORECASE)
 
-def build_playlist_m3u(playlist_path: str):
-    playlist_dirname = os.path.dirname(playlist_path)
-    movies = []
+_XSPF_NS = '{http://xspf.org/ns/0/}'
+_VLC_NS = '{http://www.videolan.org/vlc/playlist/ns/0/}'
 
+M3U_EXTENSIONS = ('.m3u', '.m3u8')
+# Limit of nested M3U includes.
+MAX_INCLUDE_DEPTH = 8
+
+# Parsed playlist files by path: (files, parsed), files is the list of
+# (path, mtime_ns, size) of the playlist and the playlists it includes.
+_parse_cache = {}
+
+
+def _unchanged(files):
+    for path, mtime_ns, size in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_mtime_ns != mtime_ns or st.st_size != size:
+            return False
+    return True
+
+
+def _cached_parse(playlist_path, parse):
+    """Return parse(playlist_path), from the cache if none of the files it
+    read changed since.  Parse returns (files, parsed).
+    """
+    playlist_path = os.path.abspath(playlist_path)
+    cached = _parse_cache.get(playlist_path)
+    if cached is not None and _unchanged(cached[0]):
+        return cached[1]
+    files, parsed = parse(playlist_path)
+    _parse_cache[playlist_path] = (files, parsed)
+    return parsed
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _resolve(location, base_dir):
+    """Return the path of a playlist entry, relative to the playlist."""
+    if location.startswith('file://'):
+        location = urllib.parse.urlparse(location).path
+    path = urllib.parse.unquote(location)
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return path
+
+
+def _seconds(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class M3UIndex:
+    """Offsets of the entries of a M3U playlist and the playlists it
+    includes, found in one pass over the files without creating the movies.
+    The block of an entry are its lines from the end of the previous entry,
+    so it has the #EXTINF and #EXTVLCOPT lines of the entry.
+    """
+
+    def __init__(self, playlist_path, report=None):
+        """Index the playlist at playlist_path, report is called with a
+        message for each include that is skipped.
+        """
+        self._path = os.path.abspath(playlist_path)
+        self.files = []
+        self._file = array('H')
+        self._offset = array('Q')
+        self._size = array('I')
+        self._weight = array('d')
+        for file_id, offset, size, _, weight in self._entries(self._path, (), self.files, report):
+            self._file.append(file_id)
+            self._offset.append(offset)
+            self._size.append(size)
+            self._weight.append(weight)
+
+    def _entries(self, path, parents, files, report=None):
+        """Yield (file id, offset, size, target, weight) of the entries of the file at
+        path, the stamps of the files read are added to files.  Report is
+        called with skipped includes.  Parents are the real paths of the
+        files including this one.
+        """
+        real_path = os.path.realpath(path)
+        if real_path in parents or len(parents) >= MAX_INCLUDE_DEPTH:
+            if report is not None:
+                report('Skipping playlist include {0}: {1}'.format(
+                    path, 'it includes itself' if real_path in parents else 'nested too deep'))
+            return
+        file_id = len(files)
+        files.append(_file_stamp(path))
+        base_dir = os.path.dirname(path)
+        with open(path, 'rb') as f:
+            offset = 0
+            block = 0
+            weight = 1.0
+            for line in f:
+                end = offset + len(line)
+                if offset == 0 and line.startswith(codecs.BOM_UTF8):
+                    line = line[len(codecs.BOM_UTF8):]
+                offset = end
+                line = line.strip()
+                if line.startswith(b'#EXTINF'):
+                    extinf = _extinf(line.decode('utf-8', 'surrogateescape'))
+                    if extinf is not None:
+                        weight = extinf[1]
+                if not line or line.startswith(b'#'):
+                    continue
+                target = _resolve(line.decode('utf-8', 'surrogateescape'), base_dir)
+                if target.lower().endswith(M3U_EXTENSIONS):
+                    try:
+                        yield from self._entries(target, parents + (real_path,), files, report)
+                    except OSError as err:
+                        if report is not None:
+                            report('Skipping playlist include {0}: {1}'.format(target, err))
+                else:
+                    yield (file_id, block, end - block, target, weight)
+                block = end
+                weight = 1.0
+
+    def targets(self):
+        """Return the targets of all entries, without creating the movies."""
+        return [target for _, _, _, target, _ in self._entries(self._path, (), [])]
+
+    def weights(self):
+        """Return the weights of all entries, without creating the movies."""
+        return self._weight
+
+    def __len__(self):
+        return len(self._offset)
+
+    def movie(self, index):
+        """Read and return the movie of the entry at index."""
+        path = self.files[self._file[index]][0]
+        with open(path, 'rb') as f:
+            return self._read(f, index)
+
+    def movies(self):
+        """Read all movies, in order."""
+        handles = {}
+        try:
+            for index in range(len(self._offset)):
+                file_id = self._file[index]
+                if file_id not in handles:
+                    handles[file_id] = open(self.files[file_id][0], 'rb')
+                yield self._read(handles[file_id], index)
+        finally:
+            for f in handles.values():
+                f.close()
+
+    def _read(self, f, index):
+        f.seek(self._offset[index])
+        block = f.read(self._size[index])
+        return _parse_m3u_entry(block.decode('utf-8', 'surrogateescape').splitlines(),
+                                os.path.dirname(self.files[self._file[index]][0]))
+
+
+def _extinf(line):
+    """Return the (title, weight) of an #EXTINF line, None if it can't be
+    parsed.
+    """
+    matches = _extinf_re.match(line)
+    if not matches:
+        return None
+    # Attributes like weight="3" (chance in weighted random order).
+    attributes = dict(_attribute_re.findall(matches[1]))
+    weight = _seconds(attributes.get('weight', 1.0))
+    return matches[2], (weight if weight is not None else 1.0)
+
+
+def _parse_m3u_entry(lines, base_dir):
     title = None
+    weight = 1.0
+    options = {}
+    target = None
+    for line in lines:
+        line = line.strip().lstrip('\ufeff')
+        if line.startswith('#EXTINF'):
+            extinf = _extinf(line)
+            if extinf is not None:
+                title, weight = extinf
+        elif line.startswith('#EXTVLCOPT'):
+            matches = _vlcopt_re.match(line)
+            if matches:
+                options[matches[1]] = _seconds(matches[2])
+        elif line and not line.startswith('#'):
+            target = _resolve(line, base_dir)
+    return Movie(target, title, weight=weight,
+                 start=options.get('start-time'), stop=options.get('stop-time'))
+
+
+class M3UMovies:
+    """The movies of a M3UIndex as sequence for a Playlist, read from the
+    file when they are accessed.  The recently used movies are kept, so the
+    playlist gets the same movie (with its play count) each time.
+    """
+
+    def __init__(self, index, cache_size=256):
+        self._index = index
+        self._cache_size = cache_size
+        self._movies = OrderedDict()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._index)
+        if not 0 <= index < len(self._index):
+            raise IndexError('playlist index out of range')
+        movie = self._movies.get(index)
+        if movie is None:
+            movie = self._index.movie(index)
+            self._movies[index] = movie
+            if len(self._movies) > self._cache_size:
+                self._movies.popitem(last=False)
+        else:
+            self._movies.move_to_end(index)
+        return movie
+
+    def targets(self):
+        return self._index.targets()
+
+    def weights(self):
+        return self._index.weights()
+
+    def __iter__(self):
+        # Going through all movies (to build lookup indexes) must not push
+        # the playing ones out of the cache.
+        for index, movie in enumerate(self._index.movies()):
+            yield self._movies.get(index, movie)
+
+
+def _parse_m3u(playlist_path, report=None):
+    index = M3UIndex(playlist_path, report)
+    return index.files, index
 
-    with open(playlist_path) as f:
+
+def build_playlist_m3u(playlist_path: str, report=None):
+    """Build a playlist from a M3U/M3U8 file.  Entries that are M3U files are
+    replaced by their entries, report is called with the includes that are
+    skipped.
+    """
+    return Playlist(M3UMovies(_cached_parse(playlist_path, lambda path: _parse_m3u(path, report))))
+
+
+def _parse_pls(playlist_path):
+    files = [_file_stamp(playlist_path)]
+    entries = {}
+    with open(playlist_path, encoding='utf-8', errors='surrogateescape') as f:
         for line in f:
-            if line.startswith('#'):
-                if line.startswith('#EXTINF'):
-                    matches = re.match(r'^#\w+:\d+(?:\s*\w+\=\".*\")*,(.*)$', line)
-                    if matches:
-                        title = matches[1]
-            else:
-                path = urllib.parse.unquote(line.rstrip())
-                if not os.path.isabs(path):
-                    path = os.path.join(playlist_dirname, path)
-                movies.append(Movie(path, title))
-                title = None
-
-    return Playlist(movies)
+            matches = _pls_re.match(line.strip().lstrip('\ufeff'))
+            if matches:
+                entries.setdefault(int(matches[2]), {})[matches[1].lower()] = matches[3].strip()
+    base_dir = os.path.dirname(playlist_path)
+    return files, [(_resolve(entry['file'], base_dir), entry.get('title'), None, None)
+                   for _, entry in sorted(entries.items()) if 'file' in entry]
+
+
+def _parse_xspf(playlist_path):
+    # Imported here, most setups don't use XSPF playlists.
+    import xml.etree.ElementTree as ET
+    files = [_file_stamp(playlist_path)]
+    try:
+        root = ET.parse(playlist_path).getroot()
+    except ET.ParseError as err:
+        raise ValueError('Invalid XSPF playlist {0}: {1}'.format(playlist_path, err))
+    base_dir = os.path.dirname(playlist_path)
+    entries = []
+    for track in root.iter(_XSPF_NS + 'track'):
+        location = track.findtext(_XSPF_NS + 'location')
+        if not location:
+            continue
+        # VLC keeps the start and stop time in its extension.
+        options = {}
+        for option in track.iter(_VLC_NS + 'option'):
+            name, _, value = (option.text or '').partition('=')
+            options[name.strip()] = _seconds(value)
+        entries.append((_resolve(location.strip(), base_dir), track.findtext(_XSPF_NS + 'title'),
+                        options.get('start-time'), options.get('stop-time')))
+    return files, entries
+
+
+def build_playlist_pls(playlist_path: str, report=None):
+    """Build a playlist from a PLS file."""
+    return Playlist([Movie(target, title, start=start, stop=stop)
+                     for target, title, start, stop in _cached_parse(playlist_path, _parse_pls)])
+
+
+def build_playlist_xspf(playlist_path: str, report=None):
+    """Build a playlist from a XSPF file."""
+    return Playlist([Movie(target, title, start=start, stop=stop)
+                     for target, title, start, stop in _cached_parse(playlist_path, _parse_xspf)])
+
+
+# Playlist builders by file extension, called with the path and a function
+# for messages about the playlist.
+PLAYLIST_FORMATS = {
+    '.m3u': build_playlist_m3u,
+    '.m3u8': build_playlist_m3u,
+    '.pls': build_playlist_pls,
+    '.xspf': build_playlist_xspf,
+}
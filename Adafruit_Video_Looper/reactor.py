@@ -0,0 +1,136 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Event waiting for the main loop.
+
+Instead of waking up every few milliseconds to poll the player and the file
+reader, the main loop sleeps in select() on the file descriptors of its event
+sources: the udev monitor of the USB readers, and notifiers that background
+threads (mpv's IPC reader, keyboard and GPIO handlers, ...) signal when
+something happened.  A source is anything with a fileno() method.
+"""
+import os
+import selectors
+
+
+class Notifier:
+    """Self-pipe that a thread can signal to wake up the main loop.  Signals
+    coalesce, the reactor clears the notifier when it wakes up.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def notify(self):
+        """Wake up the reactor waiting on this notifier, safe to call from any
+        thread and from signal handlers.
+        """
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # Pipe is full, a wakeup is pending anyway.
+            pass
+
+    def clear(self):
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class Reactor:
+    """Wait until one of the registered event sources becomes readable."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = Notifier()
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._sources = set()
+
+    def wake(self):
+        """Make the current or next wait() return immediately."""
+        self._wakeup.notify()
+
+    def set_sources(self, sources):
+        """Register the given event sources and drop the ones not listed
+        anymore.  Entries that are None are ignored.
+        """
+        sources = set(source for source in sources if source is not None)
+        for source in self._sources - sources:
+            self._selector.unregister(source)
+        for source in sources - self._sources:
+            self._selector.register(source, selectors.EVENT_READ)
+        self._sources = sources
+
+    def wait(self, timeout=None):
+        """Sleep until a source is readable or timeout seconds passed (None
+        waits forever).  Returns the list of ready sources.  Notifiers are
+        cleared, other sources are left for their owner to consume.
+        """
+        ready = []
+        for key, _ in self._selector.select(timeout):
+            if isinstance(key.fileobj, Notifier):
+                key.fileobj.clear()
+            if key.fileobj is not self._wakeup:
+                ready.append(key.fileobj)
+        return ready
+
+
+if __name__ == '__main__':
+    # Benchmark: compare the former 2 ms busy poll with waiting in the reactor.
+    # Reports CPU time used while idle and the latency from an event being
+    # signalled by another thread until the main loop reacts to it.
+    import threading
+    import time
+
+    def measure(wait_for_event, signal_event, rounds=50, interval=0.05):
+        latencies = []
+        stamp = [0.0]
+
+        def producer():
+            for _ in range(rounds):
+                time.sleep(interval)
+                stamp[0] = time.perf_counter()
+                signal_event()
+
+        thread = threading.Thread(target=producer)
+        cpu = time.process_time()
+        thread.start()
+        for _ in range(rounds):
+            wait_for_event()
+            latencies.append((time.perf_counter() - stamp[0]) * 1000)
+        thread.join()
+        cpu = time.process_time() - cpu
+        latencies.sort()
+        return (cpu / (rounds * interval) * 100,
+                latencies[len(latencies) // 2], latencies[-1])
+
+    flag = threading.Event()
+
+    def busy_wait():
+        while not flag.is_set():
+            time.sleep(0.002)
+        flag.clear()
+
+    reactor = Reactor()
+    notifier = Notifier()
+    reactor.set_sources([notifier])
+
+    def reactor_wait():
+        while not flag.is_set():
+            reactor.wait()
+        flag.clear()
+
+    def reactor_signal():
+        flag.set()
+        notifier.notify()
+
+    for name, wait_for_event, signal_event in (('busy poll 2ms', busy_wait, flag.set),
+                                               ('reactor', reactor_wait, reactor_signal)):
+        cpu, median, worst = measure(wait_for_event, signal_event)
+        print('{0:<14} idle cpu {1:5.2f}%  latency median {2:6.3f} ms  max {3:6.3f} ms'
+              .format(name, cpu, median, worst))
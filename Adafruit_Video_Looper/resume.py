@@ -0,0 +1,112 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Resume journal: where playback was, to continue there after a restart.
+
+The state (the playing movie, its index in the playlist and the position in
+it) is kept in memory and written by a background thread at most once per
+interval, so frequent updates don't wear out the SD card.  Each write goes to
+a temporary file that is renamed over the journal, so a power cut leaves
+either the old or the new state but never a broken file.  With fsync the
+data and the rename are flushed to the storage before the next write.
+"""
+import json
+import os
+import threading
+import time
+
+# Written by older versions into the working directory, holds the index only.
+LEGACY_INDEX_FILE = 'playlist_index.txt'
+
+
+def write_atomically(path, text, fsync=True):
+    """Replace the file at path with text, through a temporary file so it is
+    never left half written.  With fsync the data and the rename are flushed
+    to the storage.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        # Make the rename itself durable.
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class ResumeJournal:
+
+    def __init__(self, path, interval=10.0, fsync=True):
+        self._path = path
+        self._interval = interval
+        self._fsync = fsync
+        self._state = None
+        self._dirty = False
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """Return the saved state as dict with target, index and position
+        (seconds) or None if there is none.
+        """
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+            if isinstance(state, dict):
+                return state
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(LEGACY_INDEX_FILE) as f:
+                return {'index': int(f.read())}
+        except (OSError, ValueError):
+            return None
+
+    def record(self, movie, index, position=0.0):
+        """Remember that movie (at index in the playlist) plays at position,
+        it is written with the next write of the journal.
+        """
+        with self._cond:
+            self._state = {'target': movie.target, 'index': index,
+                           'position': round(position or 0.0, 1), 'time': time.time()}
+            self._dirty = True
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closing:
+                    self._cond.wait()
+                if self._closing:
+                    return
+                # Collect the updates of the interval into one write.
+                self._cond.wait_for(lambda: self._closing, self._interval)
+                if self._closing:
+                    return
+                state = self._state
+                self._dirty = False
+            self._write(state)
+
+    def _write(self, state):
+        try:
+            write_atomically(self._path, json.dumps(state), self._fsync)
+        except OSError as err:
+            print('Failed to write resume journal {0}: {1}'.format(self._path, err))
+
+    def close(self):
+        """Stop the writer thread and write a pending update now."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            state = self._state if self._dirty else None
+            self._dirty = False
+        if state is not None:
+            self._write(state)
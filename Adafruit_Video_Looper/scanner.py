@@ -0,0 +1,90 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Scanner finding the media files in the file reader paths."""
+import os
+import re
+from collections import namedtuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+# A found media file.  Folder is the directory relative to the searched path
+# ('' for files directly in it), size and mtime come from the directory scan.
+ScanEntry = namedtuple('ScanEntry', 'path folder name size mtime repeats weight')
+
+_scan_seconds = metrics.histogram('video_looper_scan_seconds', 'Time to scan the file reader paths.')
+_scan_files = metrics.gauge('video_looper_scan_files', 'Number of media files found by the last scan.')
+
+
+class MediaScanner:
+
+    def __init__(self, extensions, recursive=False, max_workers=4):
+        """Create a scanner for files with the given list of extensions.  With
+        recursive, sub folders are searched too.
+        """
+        self._recursive = recursive
+        self._max_workers = max_workers
+        self._extension_re = re.compile(r'\.({0})$'.format('|'.join(map(re.escape, extensions))),
+                                        flags=re.IGNORECASE)
+        self._repeat_re = re.compile(r'_repeat_([0-9]+)x', flags=re.IGNORECASE)
+        self._weight_re = re.compile(r'_weight_([0-9]+(?:\.[0-9]+)?)x', flags=re.IGNORECASE)
+
+    def _scan_path(self, root):
+        entries = []
+        folders = ['']
+        # Directories already found (by device and inode), so symlinks back
+        # up the tree don't make the scan go round in circles.
+        try:
+            st = os.stat(root)
+            visited = {(st.st_dev, st.st_ino)}
+        except OSError:
+            return entries
+        while folders:
+            folder = folders.pop()
+            try:
+                iterator = os.scandir(os.path.join(root, folder))
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    # Ignore hidden files (useful when file loaded on usb key from an OSX computer
+                    if entry.name[0] == '.':
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if self._recursive:
+                                st = entry.stat()
+                                if (st.st_dev, st.st_ino) not in visited:
+                                    visited.add((st.st_dev, st.st_ino))
+                                    folders.append(os.path.join(folder, entry.name))
+                            continue
+                        if not self._extension_re.search(entry.name):
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    repeatsetting = self._repeat_re.search(entry.name)
+                    repeats = int(repeatsetting.group(1)) if repeatsetting is not None else 1
+                    weightsetting = self._weight_re.search(entry.name)
+                    weight = float(weightsetting.group(1)) if weightsetting is not None else 1.0
+                    entries.append(ScanEntry(entry.path, folder, entry.name,
+                                             st.st_size, st.st_mtime, repeats, weight))
+        return entries
+
+    def scan(self, paths):
+        """Scan all the given paths in parallel (one thread per path, so
+        several USB drives are read at the same time) and return the list of
+        found media files sorted by path.
+        """
+        start = time.monotonic()
+        paths = [path for path in paths if os.path.isdir(path)]
+        if len(paths) <= 1:
+            results = [self._scan_path(path) for path in paths]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(paths), self._max_workers)) as executor:
+                results = list(executor.map(self._scan_path, paths))
+        entries = [entry for result in results for entry in result]
+        entries.sort(key=lambda entry: entry.path)
+        _scan_seconds.observe(time.monotonic() - start)
+        _scan_files.set(len(entries))
+        return entries
@@ -0,0 +1,140 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Time of day schedule of playlists (dayparting).
+
+The schedule file is an ini file with one section per rule:
+
+    [morning]
+    days = mon-fri
+    start = 06:00
+    end = 11:30
+    playlist = morning.m3u
+
+A rule plays a playlist file (resolved like the path of the playlist
+section) or a folder of the file reader paths.  Where rules overlap the one
+further down in the file wins, outside of all rules the playlist configured
+in video_looper.ini plays.
+
+The rules are compiled into a timeline of the week: the sorted minutes at
+which the active rule changes.  Finding the rule for a time and the time of
+the next change is a binary search, so the looper can sleep until the next
+change instead of checking the clock.
+"""
+import bisect
+import configparser
+from collections import namedtuple
+from datetime import timedelta
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY = 24 * 60
+WEEK = 7 * DAY
+
+# A rule of the schedule, playlist and folder are None if not set.
+ScheduleRule = namedtuple('ScheduleRule', 'name playlist folder')
+
+
+def parse_days(text):
+    """Return the set of week days (0 is monday) of a list like 'mon-fri,
+    sun'.  Empty, 'daily' or '*' are all days.
+    """
+    text = text.strip().lower()
+    if text in ('', 'daily', '*'):
+        return set(range(7))
+    days = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            first = DAYS.index(first.strip()[:3])
+            last = DAYS.index(last.strip()[:3]) if last else first
+        except ValueError:
+            raise ValueError('Invalid days {0!r}'.format(text))
+        # Ranges like fri-mon wrap around the week.
+        day = first
+        days.add(day)
+        while day != last:
+            day = (day + 1) % 7
+            days.add(day)
+    return days
+
+
+def parse_time(text):
+    """Return the minute of the day of a time like '06:30' ('24:00' is the
+    end of the day).
+    """
+    try:
+        hours, minutes = text.strip().split(':')
+        minute = int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise ValueError('Invalid time {0!r}'.format(text))
+    if not 0 <= minute <= DAY or not 0 <= int(minutes) < 60:
+        raise ValueError('Invalid time {0!r}'.format(text))
+    return minute
+
+
+def _minute_of_week(when):
+    return when.weekday() * DAY + when.hour * 60 + when.minute
+
+
+class Schedule:
+
+    def __init__(self, rules):
+        """Compile the rules, a list of (ScheduleRule, days, start, end)
+        tuples with start and end in minutes of the day.  An end before the
+        start is on the next day.
+        """
+        self.rules = [rule for rule, _, _, _ in rules]
+        active = [None] * WEEK
+        for rule, days, start, end in rules:
+            if end <= start:
+                end += DAY
+            for day in days:
+                for minute in range(day * DAY + start, day * DAY + end):
+                    active[minute % WEEK] = rule
+        # Minutes at which the active rule changes and the rule from then on.
+        self._times = [minute for minute in range(WEEK) if active[minute] is not active[minute - 1]]
+        self._active = [active[minute] for minute in self._times]
+        self._always = active[0]
+
+    def transitions(self):
+        """Return the number of changes per week."""
+        return len(self._times)
+
+    def rule_at(self, when):
+        """Return the rule active at the datetime when, or None if the
+        default playlist plays.
+        """
+        if not self._times:
+            return self._always
+        # Before the first change the last one of the week still holds.
+        return self._active[bisect.bisect_right(self._times, _minute_of_week(when)) - 1]
+
+    def next_change(self, when):
+        """Return the datetime of the next change after when, None if the
+        active rule never changes.
+        """
+        if not self._times:
+            return None
+        minute = _minute_of_week(when)
+        index = bisect.bisect_right(self._times, minute)
+        change = self._times[index] if index < len(self._times) else self._times[0] + WEEK
+        return when.replace(second=0, microsecond=0) + timedelta(minutes=change - minute)
+
+
+def load_schedule(path):
+    """Read and compile the schedule file at path.  Raises ValueError for
+    invalid rules.
+    """
+    parser = configparser.ConfigParser()
+    try:
+        if not parser.read(path):
+            raise ValueError('Failed to read schedule {0}'.format(path))
+    except configparser.Error as err:
+        raise ValueError('Invalid schedule {0}: {1}'.format(path, err))
+    rules = []
+    for name in parser.sections():
+        section = parser[name]
+        if 'playlist' not in section and 'folder' not in section:
+            raise ValueError('Schedule rule {0} has neither playlist nor folder'.format(name))
+        rule = ScheduleRule(name, section.get('playlist'), section.get('folder'))
+        rules.append((rule, parse_days(section.get('days', 'daily')),
+                      parse_time(section.get('start', '00:00')), parse_time(section.get('end', '24:00'))))
+    return Schedule(rules)
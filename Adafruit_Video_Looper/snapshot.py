@@ -0,0 +1,116 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Snapshot of the last good playlist, for a warm start.
+
+After each playlist build the movies are written to the snapshot with the
+size and modification time of their files.  On the next start the looper
+plays from the snapshot right away (where the resume journal says playback
+was) while the file reader scans in the background, and swaps in the
+scanned playlist when it is ready.
+
+The snapshot belongs to a key (the file reader and the playlist settings),
+a snapshot of other settings is not used.  Writing it stats every file, so
+it is done by a background thread.  Very large playlists (like big M3U
+files, which are read fast anyway) are not written.
+"""
+import json
+import os
+import threading
+
+from .model import Movie
+from .resume import write_atomically
+
+VERSION = 1
+MAX_MOVIES = 20000
+
+
+class PlaylistSnapshot:
+
+    def __init__(self, path, fsync=True):
+        self._path = path
+        self._fsync = fsync
+        # (size, mtime_ns) of the movies of the loaded snapshot by target.
+        self._stamps = {}
+        self._pending = None
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self, key):
+        """Return the movies of the snapshot if it was written for key,
+        otherwise None.
+        """
+        try:
+            with open(self._path) as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != VERSION or snapshot.get('key') != key:
+                return None
+            movies = []
+            stamps = {}
+            for target, title, repeats, weight, start, stop, size, mtime_ns in snapshot['movies']:
+                movies.append(Movie(target, title, repeats, weight, start, stop))
+                stamps[target] = (size, mtime_ns)
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            return None
+        self._stamps = stamps
+        return movies
+
+    def is_unchanged(self, movie):
+        """Return True if the file of a movie of the loaded snapshot still has
+        the size and modification time it had when the snapshot was written.
+        """
+        stamp = self._stamps.get(movie.target)
+        if stamp is None:
+            return False
+        try:
+            st = os.stat(movie.target)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == tuple(stamp)
+
+    def update(self, key, playlist):
+        """Write playlist as the snapshot of key with the next write.  The
+        movies are taken here, the playlist can change while it is written.
+        """
+        if playlist.length() == 0 or playlist.length() > MAX_MOVIES:
+            return
+        movies = [(movie.target, movie.title, movie.repeats, movie.weight, movie.start, movie.stop)
+                  for movie in playlist.movies()]
+        with self._cond:
+            self._pending = (key, movies)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closing:
+                    self._cond.wait()
+                if self._closing:
+                    return
+                key, movies = self._pending
+                self._pending = None
+            self._write(key, movies)
+
+    def _write(self, key, fields):
+        """Write the snapshot of key with the fields of the movies, as taken
+        by update, and the size and mtime of their files.
+        """
+        movies = []
+        for movie in fields:
+            try:
+                st = os.stat(movie[0])
+            except OSError:
+                continue
+            movies.append(movie + (st.st_size, st.st_mtime_ns))
+        try:
+            write_atomically(self._path, json.dumps({'version': VERSION, 'key': key, 'movies': movies},
+                                                    separators=(',', ':')), self._fsync)
+        except OSError as err:
+            print('Failed to write playlist snapshot {0}: {1}'.format(self._path, err))
+
+    def close(self):
+        """Stop the writer thread, a pending update is dropped."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -0,0 +1,124 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Timing of the startup phases of the looper.
+
+Phases are timed with the phase context manager, also when they run on
+other threads at the same time.  The report lists each phase with its start
+(relative to the creation of the profile) and its duration, and how long
+the process and the system were running when the first frame was shown.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+def _seconds_since_boot():
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _process_age():
+    """Seconds since the process was started (before the interpreter loaded
+    the looper), None if unknown.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # The command may contain spaces, the fields follow its ')'.
+            fields = f.read().rsplit(')', 1)[1].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+    uptime = _seconds_since_boot()
+    return uptime - started if uptime is not None else None
+
+
+class StartupProfile:
+
+    def __init__(self):
+        self._start = time.monotonic()
+        self._process_age = _process_age()
+        self._lock = threading.Lock()
+        # (name, start, duration, thread name)
+        self._phases = []
+        self._marks = []
+
+    @contextmanager
+    def phase(self, name):
+        """Time the code in the with block as phase name."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases.append((name, start - self._start, time.monotonic() - start,
+                                     threading.current_thread().name))
+
+    @contextmanager
+    def concurrently(self):
+        """Return steps whose submit(name, function, *args) runs function
+        as phase name in a thread while the with block goes on, and returns
+        its future.  The with block ends when all steps ended, exceptions of
+        the steps are raised then.
+        """
+        steps = _Steps(self)
+        try:
+            yield steps
+        finally:
+            steps.executor.shutdown()
+        for future in steps.futures:
+            future.result()
+
+    def elapsed(self):
+        """Return the seconds since the profile was created."""
+        return time.monotonic() - self._start
+
+    def mark(self, name):
+        """Note that the point name (like the first frame) was reached.
+        Returns False if it was reached before.
+        """
+        with self._lock:
+            if any(mark == name for mark, _ in self._marks):
+                return False
+            self._marks.append((name, time.monotonic() - self._start))
+            return True
+
+    def report(self):
+        """Return the report as list of lines."""
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase[1])
+            marks = list(self._marks)
+        lines = ['Startup profile (start, duration in ms):']
+        for name, start, duration, thread in phases:
+            lines.append('  {0:7.1f} {1:7.1f}  {2}{3}'.format(
+                start * 1000, duration * 1000, name,
+                '' if thread == 'MainThread' else ' [{0}]'.format(thread)))
+        for name, at in marks:
+            line = '  {0:7.1f}          {1}'.format(at * 1000, name)
+            if self._process_age is not None:
+                line += ', {0:.2f} s after process start'.format(self._process_age + at)
+            lines.append(line)
+        uptime = _seconds_since_boot()
+        if uptime is not None:
+            lines.append('  system up for {0:.1f} s'.format(uptime))
+        return lines
+
+
+class _Steps:
+
+    def __init__(self, profile):
+        self._profile = profile
+        self.executor = ThreadPoolExecutor(thread_name_prefix='startup')
+        self.futures = []
+
+    def submit(self, name, function, *args):
+        future = self.executor.submit(self._run, name, function, args)
+        self.futures.append(future)
+        return future
+
+    def _run(self, name, function, args):
+        with self._profile.phase(name):
+            return function(*args)
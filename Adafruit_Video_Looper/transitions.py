@@ -0,0 +1,220 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Animated transitions for the image player: crossfade and Ken Burns.
+
+Frames are paced by the wall clock: every frame shows the state the
+animation should have at that moment, so when a frame takes longer than its
+budget the following frames are skipped (and counted as dropped) instead of
+the transition taking longer.  When frames keep running over budget the
+scaling of the Ken Burns effect falls back to the faster, lower quality
+scale.  The pixel buffers are allocated when a transition starts and reused
+for every frame (the Ken Burns effect only takes a subsurface of its crop per
+frame, a view sharing the pixels of the image), only the changed part of the
+screen is updated.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+import pygame
+
+
+class FrameStats:
+    """Frame times and dropped frames of the transitions."""
+
+    def __init__(self, history=1000):
+        self._times = deque(maxlen=history)
+        self.frames = 0
+        self.dropped = 0
+        self._started = None
+        self._elapsed = 0.0
+
+    def start(self):
+        self._started = time.monotonic()
+
+    def stop(self):
+        if self._started is not None:
+            self._elapsed += time.monotonic() - self._started
+            self._started = None
+
+    def add(self, frame_time):
+        self._times.append(frame_time)
+        self.frames += 1
+
+    def summary(self):
+        """Return a dict with the achieved frames per second, the average, 95th
+        percentile and maximum frame time in ms of the recent frames, and the
+        number of dropped frames.
+        """
+        times = sorted(self._times)
+        if not times:
+            return {'fps': 0.0, 'avg_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0, 'dropped': self.dropped}
+        elapsed = self._elapsed
+        if self._started is not None:
+            elapsed += time.monotonic() - self._started
+        return {'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+                'avg_ms': 1000 * sum(times) / len(times),
+                'p95_ms': 1000 * times[min(len(times) - 1, int(len(times) * 0.95))],
+                'max_ms': 1000 * times[-1],
+                'dropped': self.dropped}
+
+
+class FramePacer:
+    """Calls a draw function at a target frame rate."""
+
+    def __init__(self, fps, stats):
+        self._budget = 1.0 / fps
+        self._stats = stats
+
+    def run(self, duration, draw, stop_event):
+        """Call draw(t, smooth) with t going from 0 to 1 over duration seconds
+        until t reached 1.  Smooth turns false while frames take longer than
+        their budget.  Returns False if stop_event was set before the end.
+        """
+        start = time.monotonic()
+        next_frame = start
+        slow = 0
+        smooth = True
+        self._stats.start()
+        try:
+            while True:
+                now = time.monotonic()
+                t = min(1.0, (now - start) / duration) if duration > 0 else 1.0
+                draw(t, smooth)
+                done = time.monotonic()
+                frame_time = done - now
+                self._stats.add(frame_time)
+                # Lower the quality while frames don't fit their budget.
+                slow = slow + 1 if frame_time > self._budget else 0
+                smooth = slow < 3
+                if t >= 1.0:
+                    return True
+                next_frame += self._budget
+                if next_frame < done:
+                    # Behind schedule, skip the late frames.
+                    missed = int((done - next_frame) / self._budget) + 1
+                    self._stats.dropped += missed
+                    next_frame += missed * self._budget
+                if stop_event.wait(next_frame - done):
+                    return False
+        finally:
+            self._stats.stop()
+
+
+class Crossfade:
+    """Blend from the frame on the screen to a new frame.  Old and new are
+    screen sized surfaces, only rect differs between them.
+    """
+
+    def __init__(self, screen, old, new, rect):
+        self._screen = screen
+        self._old = old
+        self._new = new
+        self._rect = rect
+
+    def draw(self, t, smooth):
+        self._screen.blit(self._old, self._rect, self._rect)
+        self._new.set_alpha(int(255 * t))
+        self._screen.blit(self._new, self._rect, self._rect)
+        pygame.display.update(self._rect)
+
+    def finish(self):
+        self._new.set_alpha(None)
+
+
+class KenBurns:
+    """Slow zoom into an image while panning towards a random corner.  The
+    image is shown at pos, dest is a reusable surface of the image size.
+    """
+
+    def __init__(self, screen, image, pos, dest, zoom=0.1):
+        self._screen = screen
+        self._image = image
+        self._pos = pos
+        self._dest = dest
+        w, h = image.get_size()
+        self._size = (w, h)
+        self._end_w = w / (1 + zoom)
+        self._end_h = h / (1 + zoom)
+        # Fraction of the free space left of and above the final crop.
+        self._fx = random.choice((0.0, 1.0))
+        self._fy = random.choice((0.0, 1.0))
+        self._crop = pygame.Rect(0, 0, w, h)
+
+    def draw(self, t, smooth):
+        w, h = self._size
+        crop_w = w + (self._end_w - w) * t
+        crop_h = h + (self._end_h - h) * t
+        crop = self._crop
+        crop.x = int((w - crop_w) * self._fx)
+        crop.y = int((h - crop_h) * self._fy)
+        crop.w = int(crop_w)
+        crop.h = int(crop_h)
+        area = self._image.subsurface(crop)
+        try:
+            if smooth:
+                pygame.transform.smoothscale(area, self._size, self._dest)
+            else:
+                pygame.transform.scale(area, self._size, self._dest)
+        except ValueError:
+            # smoothscale needs 24 or 32 bit surfaces.
+            pygame.transform.scale(area, self._size, self._dest)
+        rect = self._screen.blit(self._dest, self._pos)
+        pygame.display.update(rect)
+
+
+class TransitionRenderer:
+    """Runs the animations of an image on a thread, so the main loop keeps
+    running.  Must be stopped before anything else draws on the screen.
+    """
+
+    def __init__(self, screen, fps=30, console_output=False):
+        """Create a renderer drawing at fps on screen.  With console_output
+        the frame statistics are printed after each crossfade.
+        """
+        self._screen = screen
+        self._fps = fps
+        self._console_output = console_output
+        self.stats = FrameStats()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dest = None
+
+    def start(self, crossfade=None, kenburns=None, fade_time=1.0, kenburns_time=5.0):
+        """Run a crossfade, given as (old, new, rect) tuple, followed by a Ken
+        Burns effect, given as (image, pos) tuple.  Either can be None.
+        """
+        self.stop()
+        effects = []
+        if crossfade is not None:
+            effects.append((Crossfade(self._screen, *crossfade), fade_time))
+        if kenburns is not None:
+            image, pos = kenburns
+            if self._dest is None or self._dest.get_size() != image.get_size():
+                self._dest = image.copy()
+            effects.append((KenBurns(self._screen, image, pos, self._dest), kenburns_time))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(effects,), daemon=True)
+        self._thread.start()
+
+    def _run(self, effects):
+        pacer = FramePacer(self._fps, self.stats)
+        for effect, duration in effects:
+            dropped = self.stats.dropped
+            completed = pacer.run(duration, effect.draw, self._stop)
+            if hasattr(effect, 'finish'):
+                effect.finish()
+            if not completed:
+                return
+            if isinstance(effect, Crossfade) and self._console_output:
+                summary = self.stats.summary()
+                print('Crossfade: {0:.1f} fps, frame time {1:.1f} ms avg, {2:.1f} ms p95, '
+                      '{3} frames dropped'.format(summary['fps'], summary['avg_ms'],
+                                                  summary['p95_ms'], self.stats.dropped - dropped))
+
+    def stop(self):
+        """Stop the running animation, the screen keeps its last frame."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
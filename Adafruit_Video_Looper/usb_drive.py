@@ -1,8 +1,6 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
-import glob
-
 from .usb_drive_mounter import USBDriveMounter
 
 
@@ -15,20 +13,22 @@ class USBDriveReader:
         """
         self._load_config(config)
         self._mounter = USBDriveMounter(root=self._mount_path,
-                                        readonly=self._readonly)
+                                        readonly=self._readonly,
+                                        by_uuid=self._mount_by_uuid)
         self._mounter.start_monitor()
 
 
     def _load_config(self, config):
         self._mount_path = config.get('usb_drive', 'mount_path')
         self._readonly = config.getboolean('usb_drive', 'readonly')
+        self._mount_by_uuid = config.getboolean('usb_drive', 'mount_by_uuid', fallback=False)
 
     def search_paths(self):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
         self._mounter.mount_all()
-        return glob.glob(self._mount_path + '*')
+        return self._mounter.mounted_paths()
 
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
@@ -36,6 +36,24 @@ class USBDriveReader:
         """
         return self._mounter.poll_changes()
 
+    def can_scan_in_background(self):
+        """Return true if search_paths can be called while a movie plays (to
+        scan for the warm start), it doesn't draw on the screen.
+        """
+        return True
+
+    def live_update(self):
+        """Return true if the playlist should be updated without interrupting
+        playback, never the case for this reader.
+        """
+        return False
+
+    def event_source(self):
+        """Return an object with a fileno() that becomes readable when
+        is_changed should be checked again, here the udev monitor.
+        """
+        return self._mounter
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'Insert USB drive with compatible movies.'
@@ -6,7 +6,12 @@ import os
 import shutil
 import re
 import pygame
+import threading
 import time
+from .copy_engine import ChecksumError, CopyProgress, ProgressReporter, copy_file_atomic, file_sha256, same_file_stat
+from .copy_scheduler import CopyPlan, CopyScheduler, CopyTask
+from .manifest import LocalManifest, read_sha256sums
+from .reactor import Notifier
 from .usb_drive_mounter import USBDriveMounter
 
 
@@ -19,16 +24,37 @@ class USBDriveReaderCopy(object):
         """
         self._config = config
         self._screen = screen
+        self._screen_lock = threading.Lock()
+        self._progress = CopyProgress()
+        # Background import: worker thread, whether another run was requested
+        # while it copies and whether files were published since live_update.
+        self._import_lock = threading.Lock()
+        self._import_thread = None
+        self._import_requested = False
+        self._published = False
+        self._notifier = Notifier()
         self._load_config(config)
         self._pygame_init(config)
         self._mounter = USBDriveMounter(root=self._mount_path,
-                                        readonly=self._readonly)
+                                        readonly=self._readonly,
+                                        by_uuid=self._mount_by_uuid)
         self._mounter.start_monitor()
 
         if not os.path.exists(self._target_path):
             os.makedirs(self._target_path)
         #subprocess.call(['mkdir', self._target_path])
 
+        # Checksums of the copied files, check that none got lost or truncated
+        # since they were copied (only compares sizes, no file is read).
+        self._manifest = LocalManifest(self._target_path)
+        damaged = self._manifest.check()
+        if damaged:
+            self._print('Files changed since they were copied: {0}'.format(', '.join(damaged)))
+            self._manifest.save()
+
+        # The first search_paths call imports the drives already inserted.
+        self._startup_import = self._background
+
     def _pygame_init(self, config):
         self._bgcolor = (52,52,52)
         self._fgcolor = (149,193,26)
@@ -53,20 +79,79 @@ class USBDriveReaderCopy(object):
     def _load_config(self, config):
         self._mount_path = config.get('usb_drive', 'mount_path')
         self._readonly = config.getboolean('usb_drive', 'readonly')
+        self._mount_by_uuid = config.getboolean('usb_drive', 'mount_by_uuid', fallback=False)
         self._target_path = config.get('directory', 'path')
         self._copy_mode = config.get('copymode', 'mode')
         self._copyloader = config.getboolean('copymode', 'copyloader')
         self._password = config.get('copymode', 'password')
+        self._chunk_size = int(config.getfloat('copymode', 'chunk_size', fallback=8) * 1024 * 1024)
+        self._progress_rate = config.getfloat('copymode', 'progress_rate', fallback=10)
+        self._parallel_drives = config.getboolean('copymode', 'parallel_drives', fallback=True)
+        self._background = config.getboolean('copymode', 'background', fallback=False)
+        self._console_output = config.getboolean('video_looper', 'console_output', fallback=False)
+
+        self._sync_hash = config.getboolean('copymode', 'sync_hash', fallback=False)
+        self._verify = config.getboolean('copymode', 'verify', fallback=False)
+        self._manifest_name = config.get('copymode', 'manifest', fallback='SHA256SUMS')
 
         self._extensions = '|'.join(config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
                                  .translate(str.maketrans('','', ' \t\r\n.')) \
                                  .split(','))
+        self._extensions_re = re.compile(r'\.({0})$'.format(self._extensions), flags=re.IGNORECASE)
 
     def _copy_files(self, paths):
         self._clear_screen()
+        self._copy_files_from(paths)
+        self._manifest.save()
 
-        copy_mode = self._copy_mode
-        copy_mode_info = "(from config)"
+    def _get_copy_mode(self, path):
+        """Return the copy mode for a drive and where it came from.  The mode
+        from the config can be overridden by placing a file named like the
+        mode on the drive (only if there is exactly one of them).
+        """
+        overrides = [mode for mode in ("replace", "add", "sync")
+                     if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), mode))]
+        if len(overrides) == 1:
+            return overrides[0], "(overridden)"
+        return self._copy_mode, "(from config)"
+
+    def _media_files(self, path):
+        """Return the names of the media files in path."""
+        return [x for x in os.listdir(path)
+                if x[0] != '.' and self._extensions_re.search(x)]
+
+    def _is_synced(self, src, dst, expected_sha256=None):
+        """Return true if dst already has the contents of src.  If the drive's
+        manifest has a checksum for src it is compared with the checksum
+        recorded for dst in the local manifest, otherwise the files are
+        judged by size and modification time or, if enabled, by comparing
+        their checksums.
+        """
+        try:
+            src_st = os.stat(src)
+            dst_st = os.stat(dst)
+        except OSError:
+            return False
+        dst_sha256 = self._manifest.sha256(os.path.basename(dst))
+        if expected_sha256 and dst_sha256:
+            return expected_sha256 == dst_sha256
+        if same_file_stat(src_st, dst_st):
+            return True
+        if self._sync_hash and src_st.st_size == dst_st.st_size \
+                and (expected_sha256 or file_sha256(src)) == (dst_sha256 or file_sha256(dst)):
+            # Same content, only take over the time so the next sync is cheap.
+            os.utime(dst, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+            return True
+        return False
+
+    def _copy_files_from(self, paths):
+        # The whole job is planned first, then all drives are copied at once.
+        plan = CopyPlan(self._target_path)
+        # Names of the media files on the drives, if one of them is in sync
+        # mode, files in the target that are on none of them are deleted.
+        on_drives = set()
+        sync = False
+        loaders = []
         for path in paths:
             if not os.path.exists(path) or not os.path.isdir(path):
                 continue
@@ -77,43 +162,123 @@ class USBDriveReaderCopy(object):
                     continue
 
             #override copymode?
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')):
-                copy_mode = "replace"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = "add"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')) \
-                    and self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = self._copy_mode
-                copy_mode_info = "(from config)"
+            copy_mode, copy_mode_info = self._get_copy_mode(path)
 
             #inform about copymode
             self._draw_info_text("Mode: " + copy_mode + " " + copy_mode_info)
 
             if copy_mode == "replace":
-                # iterate over target path for deleting:
-                for x in os.listdir(self._target_path):
-                    if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                        os.remove('{0}/{1}'.format(self._target_path.rstrip('/'), x))
-
-            # iterate over source path for copying:
-            for x in os.listdir(path):
-                if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    #copy file
-                    self._copy_with_progress('{0}/{1}'.format(path.rstrip('/'), x), '{0}/{1}'.format(self._target_path.rstrip('/'), x))
+                # delete the files in the target path (not on the drives),
+                # in the background only once the new files are there
+                plan.delete.update(self._media_files(self._target_path))
+            sync = sync or copy_mode == "sync"
+
+            # checksums from the manifest on the drive, if any
+            sums = read_sha256sums('{0}/{1}'.format(path.rstrip('/'), self._manifest_name))
+
+            # plan copying the files of the source path:
+            sources = self._media_files(path)
+            on_drives.update(sources)
+            for x in sources:
+                src = '{0}/{1}'.format(path.rstrip('/'), x)
+                dst = '{0}/{1}'.format(self._target_path.rstrip('/'), x)
+                if copy_mode == "sync" and self._is_synced(src, dst, sums.get(x)):
+                    plan.discard(x)
+                    continue
+                plan.add(CopyTask(src, dst, x, os.path.getsize(src), path, sums.get(x)))
 
             #copy loader image
             if self._copyloader:
                 loader_file_path = '{0}/{1}'.format(path.rstrip('/'), 'loader.png')
                 if os.path.exists(loader_file_path):
-                    self._clear_screen()
-                    self._draw_info_text("Copying splashscreen file...")
-                    time.sleep(2)
-                    self._copy_with_progress(loader_file_path,'/home/pi/loader.png')
-                    
+                    loaders.append(loader_file_path)
+
+        plan.delete -= on_drives
+        required = plan.required_space(count_deleted=not self._background)
+        free = plan.free_space()
+        if required > free:
+            message = "Not enough space to copy: {0} MB needed, {1} MB free".format(
+                required // 2**20, free // 2**20)
+            self._draw_info_text(message)
+            time.sleep(2)
+            return
+
+        if not self._background:
+            self._delete_files(plan.delete)
+
+        tasks = plan.tasks()
+        if tasks:
+            self._clear_screen()
+            self._draw_info_text("Copying {0} files ({1} MB) from {2} drive(s)".format(
+                len(tasks), plan.total_bytes() // 2**20, len(plan.drives())))
+            # One progress over all files, drawn by a reporter thread at a
+            # fixed rate while the drives are copied.
+            self._progress.start(plan.total_bytes())
+            scheduler = CopyScheduler(plan, self._copy_task, self._copy_task_done,
+                                      parallel=self._parallel_drives, idle=self._background)
+            with ProgressReporter(self._progress, self._draw_copy_progress,
+                                  self._progress_rate if not self._background else 0.2):
+                scheduler.run()
+
+        if self._background:
+            self._delete_files(plan.delete)
+
+        # sync: delete what is gone from the drives
+        if sync:
+            self._delete_files([x for x in self._media_files(self._target_path) if x not in on_drives])
+
+        for loader_file_path in loaders:
+            self._clear_screen()
+            self._draw_info_text("Copying splashscreen file...")
+            if not self._background:
+                time.sleep(2)
+            self._progress.start(os.path.getsize(loader_file_path))
+            with ProgressReporter(self._progress, self._draw_copy_progress, self._progress_rate):
+                self._copy_with_progress(loader_file_path,'/home/pi/loader.png')
+
+    def _delete_files(self, names):
+        for x in names:
+            os.remove('{0}/{1}'.format(self._target_path.rstrip('/'), x))
+            self._manifest.remove(x)
+        if names:
+            self._publish()
+
+    def _publish(self):
+        """Tell the looper that the files in the target path changed."""
+        self._published = True
+        self._notifier.notify()
+
+    def _copy_task(self, task):
+        """Copy the file of a planned task, runs on a scheduler thread."""
+        return self._copyfile(task.src, task.dst, expected_sha256=task.expected_sha256)
+
+    def _copy_task_done(self, task, sha256, error):
+        if isinstance(error, ChecksumError):
+            self._print(str(error))
+            self._draw_info_text("Checksum mismatch, skipped " + task.name)
+        elif error is not None:
+            self._print('Copying {0} failed: {1}'.format(task.src, error))
+            self._draw_info_text("Copying failed, skipped " + task.name)
+        elif sha256 is not None:
+            self._manifest.set(task.name, sha256)
+        else:
+            self._manifest.remove(task.name)
+        if error is None:
+            # The file was renamed into place, it can be played right away.
+            self._publish()
+
     def _draw_copy_progress(self, copied, total):
-        perc = 100 * copied / total
+        if self._background:
+            # The looper owns the screen while importing in the background.
+            eta = self._progress.eta()
+            self._print('Importing: {0}%{1}'.format(int(100 * copied / total),
+                        '' if eta is None else ', {0:.0f} s left'.format(eta)))
+            return
+        with self._screen_lock:
+            self._draw_progress_bar(copied, total)
+
+    def _draw_progress_bar(self, copied, total):
+        perc = min(100 * copied / total, 100.)
         assert (isinstance(perc, float))
         assert (0. <= perc <= 100.)
 
@@ -123,16 +288,36 @@ class USBDriveReaderCopy(object):
                                                                 self.pheight - (2*self.borderthickness))
 
 
+        #clear (the text can get shorter)
+        self._screen.fill(self._bgcolor, self.borderrect)
         #border
         pygame.draw.rect(self._screen, self._bordercolor, self.borderrect, self.borderthickness)
         #progress
         pygame.draw.rect(self._screen, self._fgcolor, progressrect)
         #progress_text
-        self.draw_progress_text(str(int(round(perc)))+"%")
+        text = str(int(round(perc)))+"%"
+        eta = self._progress.eta()
+        if eta is not None and copied < total:
+            text += " - {0}:{1:02d} left".format(int(eta) // 60, int(eta) % 60)
+        self.draw_progress_text(text)
 
         pygame.display.update(self.borderrect)
 
     def _draw_info_text(self, message):
+        if self._background:
+            self._print(message)
+            return
+        with self._screen_lock:
+            self._draw_text(message)
+
+    def _print(self, message):
+        """Print message if console output is enabled, the screen belongs to
+        the looper while importing in the background.
+        """
+        if self._console_output:
+            print(message)
+
+    def _draw_text(self, message):
         label1 = self._font.render(message, True, self._fontcolor, self._bgcolor)
         l1w, l1h = label1.get_size()
         self._screen.blit(label1, (self.screenwidth / 2 - l1w / 2, self.screenheight / 2 - l1h - self.pheight/2 - 3*self.borderthickness))
@@ -144,23 +329,28 @@ class USBDriveReaderCopy(object):
         self._screen.blit(label1, (self.screenwidth / 2 - l1w / 2, self.screenheight / 2 - l1h / 2 + self.borderthickness))
 
     def _clear_screen(self, full=True):
-        if full:
-            self._screen.fill(self._bgcolor)
-            pygame.display.update()
-        else:
-            self._screen.fill(self._bgcolor,self.borderrect)
-            pygame.display.update(self.borderrect)
+        if self._background:
+            return
+        with self._screen_lock:
+            if full:
+                self._screen.fill(self._bgcolor)
+                pygame.display.update()
+            else:
+                self._screen.fill(self._bgcolor,self.borderrect)
+                pygame.display.update(self.borderrect)
 
     #checks for file without and with any extension
     def check_file_exists(self,file):
         return (glob.glob(file + ".*") + glob.glob(file)) != []
 
-    def _copyfile(self, src, dst, *, follow_symlinks=True):
+    def _copyfile(self, src, dst, *, follow_symlinks=True, expected_sha256=None):
         """Copy data from src to dst.
 
         If follow_symlinks is not set and src is a symbolic link, a new
         symlink will be created instead of copying the file it points to.
 
+        Returns the sha256 of the copied data if it was verified (see
+        copy_file_atomic), otherwise None.
         """
         if shutil._samefile(src, dst):
             raise shutil.SameFileError("{!r} and {!r} are the same file".format(src, dst))
@@ -178,53 +368,102 @@ class USBDriveReaderCopy(object):
 
         if not follow_symlinks and os.path.islink(src):
             os.symlink(os.readlink(src), dst)
-        else:
-            size = os.stat(src).st_size
-            with open(src, 'rb') as fsrc:
-                with open(dst, 'wb') as fdst:
-                    self._copyfileobj(fsrc, fdst, callback=self._draw_copy_progress, total=size)
-        return dst
-
-    def _copyfileobj(self, fsrc, fdst, callback, total, length=16 * 1024):
-        copied = 0
-        while True:
-            buf = fsrc.read(length)
-            if not buf:
-                break
-            fdst.write(buf)
-            copied += len(buf)
-            callback(copied, total=total)
-
-    def _copy_with_progress(self, src, dst, *, follow_symlinks=True):
+            return None
+        return copy_file_atomic(src, dst, progress=self._progress.advance, chunk_size=self._chunk_size,
+                                verify=self._verify, expected_sha256=expected_sha256)
+
+    def _copy_with_progress(self, src, dst, *, follow_symlinks=True, expected_sha256=None):
         if os.path.isdir(dst):
             dst = os.path.join(dst, os.path.basename(src))
 
         # clear screen before copying
         self._clear_screen(False)
 
-        self._copyfile(src, dst, follow_symlinks=follow_symlinks)
-        # shutil.copymode(src, dst)
-        return dst
+        return self._copyfile(src, dst, follow_symlinks=follow_symlinks, expected_sha256=expected_sha256)
 
     def search_paths(self):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
-        if(self._mounter.has_nodes()):
+        if self._background:
+            # Only start the import of the drives found at startup here, later
+            # drives are imported by is_changed.
+            if self._startup_import and self._mounter.has_nodes():
+                self._start_import()
+            self._startup_import = False
+        elif(self._mounter.has_nodes()):
             self._mounter.mount_all()
-            self._copy_files(glob.glob(self._mount_path + '*'))
+            self._copy_files(self._mounter.mounted_paths())
 
         return [self._target_path]
 
+    def _start_import(self):
+        """Mount the drives and copy them on the import thread.  If it is
+        already running, it runs once more when done.
+        """
+        self._mounter.mount_all()
+        with self._import_lock:
+            self._import_requested = True
+            if self._import_thread is None:
+                self._import_thread = threading.Thread(target=self._import_worker, daemon=True)
+                self._import_thread.start()
+
+    def _import_worker(self):
+        try:
+            while True:
+                with self._import_lock:
+                    if not self._import_requested:
+                        self._import_thread = None
+                        return
+                    self._import_requested = False
+                try:
+                    self._copy_files(self._mounter.mounted_paths())
+                except Exception as err:
+                    # Like a drive pulled while it is imported, the next
+                    # drive change starts a new import.
+                    self._print('Importing failed: {0}'.format(err))
+        finally:
+            # Also when the thread ends otherwise, so imports can start again.
+            with self._import_lock:
+                if self._import_thread is threading.current_thread():
+                    self._import_thread = None
+
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
-        USB drive is inserted.
+        USB drive is inserted.  When importing in the background, a new drive
+        is imported while the looper keeps playing, see live_update.
         """
         if self._mounter.poll_changes() and self._mounter.has_nodes():
+            if self._background:
+                self._start_import()
+                return False
             return True
         else:
             return False
 
+    def can_scan_in_background(self):
+        """Return true if search_paths can be called while a movie plays (to
+        scan for the warm start).  Without the background import it copies
+        the drives first, showing the progress on the whole screen.
+        """
+        return self._background
+
+    def live_update(self):
+        """Return true once if files were added to or removed from the search
+        paths by the background import since the last call, the playlist can
+        be updated without interrupting playback.
+        """
+        published = self._published
+        self._published = False
+        return published
+
+    def event_source(self):
+        """Return the objects with a fileno() that become readable when
+        is_changed or live_update should be checked again, here the udev
+        monitor and the notifier of the background import.
+        """
+        return [self._mounter, self._notifier]
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'Insert USB drive with compatible movies. Copy Mode: files will be copied to RPi.'
@@ -1,57 +1,187 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
+import ctypes
+import ctypes.util
 import glob
+import os
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pyudev
 
+from . import metrics
+
+# Flags of the mount(2) and umount2(2) syscalls.
+MS_RDONLY = 1
+MNT_DETACH = 2
+
+_mount_seconds = metrics.histogram('video_looper_mount_seconds', 'Time to mount a USB drive.')
+_mount_failures = metrics.counter('video_looper_mount_failures_total', 'USB drives that could not be mounted.')
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def _mount(node, path, fstype, readonly):
+    """Mount node at path with the mount syscall.  Filesystems the kernel
+    can't mount by itself (like FUSE based ntfs-3g) fall back to the mount
+    command.
+    """
+    flags = MS_RDONLY if readonly else 0
+    if fstype and _libc.mount(node.encode(), path.encode(), fstype.encode(), flags, None) == 0:
+        return
+    args = ['mount']
+    if readonly:
+        args.append('-r')
+    args.extend([node, path])
+    subprocess.check_call(args)
+
+
+def _umount(path):
+    """Lazily unmount path, like umount -l."""
+    if _libc.umount2(path.encode(), MNT_DETACH) != 0:
+        subprocess.call(['umount', '-l', path])
+
 
 class USBDriveMounter:
     """Service for automatically mounting attached USB drives."""
 
-    def __init__(self, root='/mnt/usbdrive', readonly=True):
+    def __init__(self, root='/mnt/usbdrive', readonly=True, by_uuid=False):
         """Create an instance of the USB drive mounter service.  Root is an
         optional parameter which specifies the location and file name prefix for
         mounted drives (a number will be appended to each mounted drive file
         name).  Readonly is a boolean that indicates if the drives should be
-        mounted as read-only or not (default false, writable).
+        mounted as read-only or not (default false, writable).  With by_uuid
+        the filesystem UUID is appended instead of a number (if the filesystem
+        has one and no other attached drive uses it, like a cloned one), so a
+        drive keeps its mount point when others come and go.
         """
         self._root = root
         self._readonly = readonly
+        self._by_uuid = by_uuid
         self._context = pyudev.Context()
+        self._monitor = None
+        # Inventory of attached USB partitions (device node -> udev device),
+        # kept up to date from monitor events, and what is mounted where.
+        self._devices = None
+        self._mounted = {}
+        # Device nodes removed since the last mount_all, the node can be back
+        # with another drive.
+        self._removed = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_usb(device):
+        return device.get('ID_BUS') == 'usb'
+
+    def _inventory(self):
+        """Return the device inventory, enumerating udev only the first time."""
+        if self._devices is None:
+            self._devices = {x.device_node: x for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
+                             if self._is_usb(x)}
+        return self._devices
+
+    def _mount_paths(self):
+        """Return the wanted mount point for each attached partition.  A
+        drive that is mounted keeps its mount point, new ones get the lowest
+        free numbers.  Of drives with the same UUID only the first gets the
+        UUID path, the others a number.
+        """
+        paths = {}
+        numbered = []
+        taken = set()
+        # The mounted drives go first, so their paths are taken.
+        nodes = sorted(sorted(self._inventory()),
+                       key=lambda node: node not in self._mounted or node in self._removed)
+        for node in nodes:
+            uuid = self._inventory()[node].get('ID_FS_UUID')
+            mounted = self._mounted.get(node) if node not in self._removed else None
+            if mounted is not None and (mounted == self._root + '-' + str(uuid)
+                                        or mounted[len(self._root):].isdigit()):
+                path = mounted
+            elif self._by_uuid and uuid and self._root + '-' + uuid not in taken:
+                path = self._root + '-' + uuid
+            else:
+                numbered.append(node)
+                continue
+            paths[node] = path
+            taken.add(path)
+        i = 0
+        for node in numbered:
+            while self._root + str(i) in taken:
+                i += 1
+            paths[node] = self._root + str(i)
+            i += 1
+        return paths
+
+    def _mount_one(self, node, path):
+        start = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+        _mount(node, path, self._inventory()[node].get('ID_FS_TYPE'), self._readonly)
+        _mount_seconds.observe(time.monotonic() - start)
+
+    def _unmount_path(self, path):
+        _umount(path)
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
 
     def remove_all(self):
         """Unmount and remove mount points for all mounted drives."""
-        for path in glob.glob(self._root + '*'):
-            subprocess.call(['umount', '-l', path])
-            subprocess.call(['rm', '-r', path])
+        with self._lock:
+            for path in glob.glob(self._root + '*'):
+                if os.path.ismount(path):
+                    _umount(path)
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+            self._mounted = {}
 
     def mount_all(self):
-        """Mount all attached USB drives.  Readonly is a boolean that specifies
-        if the drives should be mounted read only (defaults to true).
+        """Mount all attached USB drives.  Only partitions that were added or
+        removed since the last call are mounted or unmounted, new partitions
+        are mounted in parallel.  Returns the list of mounted device nodes.
         """
-        self.remove_all()
-        # Enumerate USB drive partitions by path like /dev/sda1, etc.
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        # Mount each drive under the mount root.
-        for i, node in enumerate(nodes):
-            path = self._root + str(i)
-            subprocess.call(['mkdir', path])
-            args = ['mount']
-            if self._readonly:
-                args.append('-r')
-            args.extend([node, path])
-            subprocess.check_call(args)
-
-        return nodes
+        with self._lock:
+            wanted = self._mount_paths()
+            # Unmount drives that are gone (or would move to another path).
+            for node, path in list(self._mounted.items()):
+                if wanted.get(node) != path or node in self._removed:
+                    self._unmount_path(path)
+                    del self._mounted[node]
+            self._removed.clear()
+            # Remove leftovers of earlier runs that are not wanted anymore.
+            current = set(self._mounted.values())
+            for path in glob.glob(self._root + '*'):
+                if path not in current and os.path.ismount(path):
+                    self._unmount_path(path)
+            # Mount the new ones.
+            new = {node: path for node, path in wanted.items() if node not in self._mounted}
+            if new:
+                with ThreadPoolExecutor(max_workers=len(new)) as executor:
+                    results = {node: executor.submit(self._mount_one, node, path)
+                               for node, path in new.items()}
+                for node, result in results.items():
+                    try:
+                        result.result()
+                        self._mounted[node] = new[node]
+                    except (OSError, subprocess.CalledProcessError) as err:
+                        _mount_failures.inc()
+                        print('Could not mount {0}: {1}'.format(node, err))
+            return list(self._mounted)
+
+    def mounted_paths(self):
+        """Return the sorted list of mount points of the mounted drives."""
+        with self._lock:
+            return sorted(self._mounted.values())
 
     def has_nodes(self):
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        return nodes != []
+        with self._lock:
+            return self._inventory() != {}
 
     def start_monitor(self):
         """Initialize monitoring of USB drive changes."""
@@ -59,28 +189,48 @@ class USBDriveMounter:
         self._monitor.filter_by('block', 'partition')
         self._monitor.start()
 
+    def fileno(self):
+        """Return the file descriptor of the udev monitor, it becomes readable
+        when a drive change is pending and can be waited on with select.
+        """
+        return self._monitor.fileno()
+
     def poll_changes(self):
-        """Check for changes to USB drives.  Returns true if there was a USB 
-        drive change, otherwise false.
+        """Check for changes to USB drives and update the device inventory.
+        Returns true if there was a USB drive change, otherwise false.
         """
-        # Look for a drive change.
-        device = self._monitor.poll(0)
-        # If a USB drive changed (added/remove) remount all drives.
-        if device is not None and device['ID_BUS'] == 'usb':
-            return True
-        # Else nothing changed.
-        return False
+        # Handle all pending events at once, a drive often sends several.
+        # They are read before taking the lock, mount_all can hold it while
+        # drives are mounted.
+        devices = []
+        while True:
+            device = self._monitor.poll(0)
+            if device is None:
+                break
+            if self._is_usb(device):
+                devices.append(device)
+        if not devices:
+            return False
+        with self._lock:
+            inventory = self._inventory()
+            for device in devices:
+                if device.action == 'remove':
+                    inventory.pop(device.device_node, None)
+                    self._removed.add(device.device_node)
+                else:
+                    inventory[device.device_node] = device
+        return True
 
 
 if __name__ == '__main__':
     # Run as a service that mounts all USB drives as read-only under the default
     # path of /mnt/usbdrive*.
     drive_mounter = USBDriveMounter(readonly=True)
-    drive_mounter.mount_all()
     drive_mounter.start_monitor()
+    drive_mounter.mount_all()
     print ('Listening for USB drive changes (press Ctrl-C to quit)...')
     while True:
         if drive_mounter.poll_changes():
             print ('USB drives changed!')
             drive_mounter.mount_all()
-        time.sleep(0)
+        time.sleep(0.5)
@@ -5,19 +5,45 @@
 import configparser
 import importlib
 import os
-import re
+import queue
 import subprocess
 import sys
 import signal
 import time
 import pygame
 import json
+import math
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import RPi.GPIO as GPIO
 
-from .model import Playlist, Movie
-from .playlist_builders import build_playlist_m3u
+from . import metrics
+from .alsa_config import parse_hw_device
+from .image_cache import create_disk_cache, load_image
+from .model import Playlist, Movie, RANDOM_ORDERS
+from .osd import OSDLayer
+from .playlist_builders import PLAYLIST_FORMATS
+from .reactor import Reactor
+from .resume import ResumeJournal
+from .schedule import load_schedule
+from .scanner import MediaScanner
+from .snapshot import PlaylistSnapshot
+from .startup import StartupProfile
+
+_transition_gap = metrics.histogram('video_looper_transition_gap_seconds',
+                                    'Time between the end of a movie and the first frame of the next one.',
+                                    metrics.GAP_BUCKETS)
+_loop_seconds = metrics.histogram('video_looper_loop_seconds',
+                                  'Time of one pass of the main loop, without the wait for events.',
+                                  metrics.LOOP_BUCKETS)
+_build_seconds = metrics.histogram('video_looper_playlist_build_seconds', 'Time to build the playlist.')
+_playlist_movies = metrics.gauge('video_looper_playlist_movies', 'Number of movies in the playlist.')
+_movies_played = metrics.counter('video_looper_movies_played_total', 'Number of movies started.')
+_play_failures = metrics.counter('video_looper_play_failures_total', 'Movies the player failed to start.')
+_last_play = metrics.gauge('video_looper_last_play_timestamp_seconds', 'Unix time the last movie started.')
+_playing = metrics.gauge('video_looper_playing', 'Whether the player plays (1) or not (0).')
+_startup_seconds = metrics.gauge('video_looper_startup_seconds', 'Time from the start of the looper to its first frame.')
+_start_time = metrics.gauge('video_looper_start_time_seconds', 'Unix time the looper started.')
 
 # Basic video looper architecure:
 #
@@ -48,21 +74,56 @@ class VideoLooper:
         """Create an instance of the main video looper application class. Must
         pass path to a valid video looper ini configuration file.
         """
+        # Time the startup phases, independent ones run at the same time.
+        self._startup = StartupProfile()
         # Load the configuration.
-        self._config = configparser.ConfigParser()
-        if len(self._config.read(config_path)) == 0:
-            raise RuntimeError('Failed to find configuration file at {0}, is the application properly installed?'.format(config_path))
+        with self._startup.phase('config'):
+            self._config = configparser.ConfigParser()
+            if len(self._config.read(config_path)) == 0:
+                raise RuntimeError('Failed to find configuration file at {0}, is the application properly installed?'.format(config_path))
         self._console_output = self._config.getboolean('video_looper', 'console_output')
+        self._startup_report = self._config.getboolean('video_looper', 'startup_report', fallback=False)
+        _start_time.set(time.time())
+        self._metrics_exporter = None
         # Load other configuration values.
         self._osd = self._config.getboolean('video_looper', 'osd')
         self._is_random = self._config.getboolean('video_looper', 'is_random')
+        self._random_mode = self._config.get('video_looper', 'random_mode', fallback='shuffle')
+        if self._random_mode not in RANDOM_ORDERS:
+            self._print('Unknown random_mode {0}, using shuffle.'.format(self._random_mode))
+            self._random_mode = 'shuffle'
         self._one_shot_playback = self._config.getboolean('video_looper', 'one_shot_playback')
         self._play_on_startup = self._config.getboolean('video_looper', 'play_on_startup')
         self._resume_playlist = self._config.getboolean('video_looper', 'resume_playlist')
+        # Directory for the state kept across restarts.
+        self._state_dir = self._config.get('video_looper', 'state_dir', fallback='.')
+        self._resume_interval = self._config.getfloat('video_looper', 'resume_interval', fallback=10)
+        self._journal = None
+        # Saved state to resume from once the playlist has movies.
+        self._resume_state = None
+        # (target, position) to start the first movie at.
+        self._resume_start = None
+        self._resume_due = 0
+        # Snapshot of the last playlist to start with while the file reader
+        # scans in the background (the scan, a future, while it runs).
+        self._warm_start = self._config.getboolean('video_looper', 'warm_start', fallback=False)
+        self._snapshot = None
+        self._scan = None
+        self._preload_next = self._config.getboolean('video_looper', 'preload_next', fallback=True)
+        # Number of upcoming movies the player may prepare (decode images).
+        self._prefetch_count = self._config.getint('video_looper', 'prefetch', fallback=2)
+        # Seconds between checks of players or file readers that can't signal
+        # their changes (like the image player or the directory reader).
+        self._poll_interval = self._config.getfloat('video_looper', 'poll_interval', fallback=0.1)
         self._keyboard_control = self._config.getboolean('control', 'keyboard_control')
         self._keyboard_control_disabled_while_playback = self._config.getboolean('control', 'keyboard_control_disabled_while_playback')
         self._gpio_control_disabled_while_playback = self._config.getboolean('control', 'gpio_control_disabled_while_playback')
         self._copyloader = self._config.getboolean('copymode', 'copyloader')
+        # Optional catalog of probed media files, used to keep files that
+        # can't be decoded out of the playlist.  Its probes run in the
+        # background, when they found such files the playlist is rebuilt.
+        self._catalog = None
+        self._catalog_changed = False
         # Get seconds for countdown from config
         self._countdown_time = self._config.getint('video_looper', 'countdown_time')
         # Get seconds for waittime bewteen files from config
@@ -79,28 +140,68 @@ class VideoLooper:
         self._fgcolor = list(map(int, self._config.get('video_looper', 'fgcolor')
                                              .translate(str.maketrans('','', ','))
                                              .split()))
-        # Initialize pygame and display a blank screen.
-        pygame.display.init()
-        pygame.font.init()
-        pygame.mouse.set_visible(False)
-        self._screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN | pygame.NOFRAME)
-        self._size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
-        self._bgimage = self._load_bgimage() #a tupple with pyimage, xpos, ypos
-        self._blank_screen()
-        # Load configured video player and file reader modules.
-        self._player = self._load_player()
-        self._reader = self._load_file_reader()
+        # Load ALSA hardware configuration.
+        self._alsa_hw_device = parse_hw_device(self._config.get('alsa', 'hw_device'))
+        self._alsa_hw_vol_control = self._config.get('alsa', 'hw_vol_control')
+        self._alsa_hw_vol_file = self._config.get('alsa', 'hw_vol_file')
+        # default ALSA hardware volume (volume will not be changed)
+        self._alsa_hw_vol = None
+        # Load sound volume file name value
+        self._sound_vol_file = self._config.get('omxplayer', 'sound_vol_file', fallback='')
+        # default value to 0 millibels
+        self._sound_vol = 0
+        # The main loop sleeps in the reactor until an event source is ready.
+        # Keyboard and GPIO handlers queue their commands for the main loop.
+        self._reactor = Reactor()
+        self._commands = queue.Queue()
         self._playlist = None
+        self._playlist_folder = self._config.get('playlist', 'folder', fallback='').strip('/')
+        self._playlist_path = self._config.get('playlist', 'path', fallback=None)
+        # Playlist of the playlist section, plays when no schedule rule does.
+        self._default_playlist = (self._playlist_path, self._playlist_folder)
+        # The state files and the schedule are read while the display starts.
+        with self._startup.concurrently() as steps:
+            steps.submit('resume journal', self._load_journal)
+            steps.submit('snapshot', self._open_snapshot)
+            steps.submit('catalog', self._open_catalog)
+            steps.submit('metrics', self._open_metrics_exporter)
+            steps.submit('schedule', self._load_schedule, config_path)
+            # Initialize pygame and display a blank screen.
+            with self._startup.phase('display'):
+                pygame.display.init()
+                pygame.font.init()
+                pygame.mouse.set_visible(False)
+                self._screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN | pygame.NOFRAME)
+                self._size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
+            with self._startup.phase('background image'):
+                self._bgimage = self._load_bgimage() #a tupple with pyimage, xpos, ypos
+                self._blank_screen()
+        # Load configured video player and file reader modules.  Both may use
+        # pygame, so they are created here, only the start of the player
+        # process runs while the file reader sets up its source.
+        with self._startup.phase('player'):
+            self._player = self._load_player()
+        with self._startup.concurrently() as steps:
+            steps.submit('player warm up', self._player.warm_up)
+            with self._startup.phase('file reader'):
+                self._reader = self._load_file_reader()
         # Set other static internal state.
-        self._extensions = '|'.join(self._player.supported_extensions())
-        self._small_font = pygame.font.Font(None, 50)
-        self._medium_font   = pygame.font.Font(None, 96)
-        self._big_font   = pygame.font.Font(None, 250)
+        self._scanner = MediaScanner(self._player.supported_extensions(),
+                                     recursive=self._config.getboolean('playlist', 'recursive', fallback=False))
+        # Fonts by size, see _font.
+        self._fonts = {}
+        # Cached text rendering with updates of only the changed rects.
+        self._osd_layer = OSDLayer(self._screen, self._bgcolor, self._fgcolor)
         self._running    = True
         # set the inital playback state according to the startup setting.
         self._playbackStopped = not self._play_on_startup
         #used for not waiting the first time
         self._firstStart = True
+        # Countdown or wait screen shown by the main loop ('countdown',
+        # 'datetime', 'wait' or None), when it ends and when to redraw it.
+        self._timed_screen = None
+        self._timed_end = 0
+        self._timed_tick = 0
 
         # start keyboard handler thread:
         # Event handling for key press, if keyboard control is enabled
@@ -108,12 +209,15 @@ class VideoLooper:
             self._keyboard_thread = threading.Thread(target=self._handle_keyboard_shortcuts, daemon=True)
             self._keyboard_thread.start()
         
+        # RPi.GPIO is only imported when pins are mapped.
+        self._gpio = None
         pinMapSetting = self._config.get('control', 'gpio_pin_map', raw=True)
         if pinMapSetting:
             try:
-                self._pinMap = json.loads("{"+pinMapSetting+"}")
-                self._gpio_setup()
-            except Exception as err:
+                with self._startup.phase('gpio'):
+                    self._pinMap = json.loads("{"+pinMapSetting+"}")
+                    self._gpio_setup()
+            except Exception:
                 self._pinMap = None
                 self._print("gpio_pin_map setting is not valid and/or error with GPIO setup")
         else:
@@ -135,6 +239,93 @@ class VideoLooper:
         module = self._config.get('video_looper', 'file_reader')
         return importlib.import_module('.' + module, 'Adafruit_Video_Looper').create_file_reader(self._config, self._screen)
 
+    def _load_journal(self):
+        """Open the resume journal and read the saved state."""
+        if not self._resume_playlist:
+            return
+        try:
+            os.makedirs(self._state_dir, exist_ok=True)
+            self._journal = ResumeJournal(os.path.join(self._state_dir, 'resume.json'),
+                                          self._resume_interval,
+                                          self._config.getboolean('video_looper', 'resume_fsync', fallback=True))
+            self._resume_state = self._journal.load()
+        except OSError as err:
+            self._print('State directory {0} not usable, not resuming: {1}'.format(self._state_dir, err))
+
+    def _open_snapshot(self):
+        """Open the playlist snapshot if the warm start is enabled."""
+        if not self._warm_start:
+            return
+        try:
+            os.makedirs(self._state_dir, exist_ok=True)
+            self._snapshot = PlaylistSnapshot(os.path.join(self._state_dir, 'playlist_snapshot.json'),
+                                              self._config.getboolean('video_looper', 'resume_fsync', fallback=True))
+        except OSError as err:
+            self._print('State directory {0} not usable, no warm start: {1}'.format(self._state_dir, err))
+
+    def _open_metrics_exporter(self):
+        """Serve the metrics if they are enabled."""
+        if self._config.getboolean('metrics', 'enabled', fallback=False):
+            self._metrics_exporter = metrics.MetricsExporter(
+                self._config.get('metrics', 'listen', fallback='127.0.0.1:9393'),
+                self._config.get('metrics', 'textfile', fallback=''),
+                self._config.getfloat('metrics', 'textfile_interval', fallback=15))
+
+    def _player_is_playing(self):
+        """Ask the player if it plays and keep the answer for the metrics,
+        players are only asked from the main loop (asking can redraw).
+        """
+        playing = self._player.is_playing()
+        _playing.set(1 if playing else 0)
+        return playing
+
+    def _open_catalog(self):
+        """Open the media catalog if it is enabled."""
+        if self._config.getboolean('catalog', 'enabled', fallback=False):
+            # Imported here, it pulls in sqlite3 which only the catalog needs.
+            from .catalog import MediaCatalog
+            self._catalog = MediaCatalog(self._config.get('catalog', 'path'),
+                                         workers=self._config.getint('catalog', 'workers', fallback=2),
+                                         on_quarantined=self._catalog_quarantined)
+
+    def _catalog_quarantined(self):
+        """Called by the catalog when probes found files that can't be
+        decoded, the main loop drops them from the playlist.
+        """
+        self._catalog_changed = True
+        self._reactor.wake()
+
+    def _font(self, size):
+        """Return the font of size, loaded when the first text with it is
+        shown (most of the time that is after the first movie started).
+        """
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    @property
+    def _small_font(self):
+        return self._font(50)
+
+    @property
+    def _medium_font(self):
+        return self._font(96)
+
+    @property
+    def _big_font(self):
+        return self._font(250)
+
+    def _startup_done(self, what):
+        """Once what (the first frame) happened, note the startup time in the
+        metrics and print the startup profile if the report is enabled.
+        """
+        if self._startup.mark(what):
+            _startup_seconds.set(self._startup.elapsed())
+            if self._startup_report:
+                for line in self._startup.report():
+                    print(line)
+
     def _load_bgimage(self):
         """Load the configured background image and return an instance of it."""
         image = None
@@ -145,28 +336,8 @@ class VideoLooper:
             imagepath = self._config.get('video_looper', 'bgimage')
             if imagepath != "" and os.path.isfile(imagepath):
                 self._print('Using ' + str(imagepath) + ' as a background')
-                image = pygame.image.load(imagepath)
-
-                screen_w, screen_h = self._size
-                image_w, image_h = image.get_size()
-
-                screen_aspect_ratio = screen_w / screen_h
-                photo_aspect_ratio = image_w / image_h
-
-                if screen_aspect_ratio < photo_aspect_ratio:  # Width is binding
-                    new_image_w = screen_w
-                    new_image_h = int(new_image_w / photo_aspect_ratio)
-                    image = pygame.transform.scale(image, (new_image_w, new_image_h))
-                    image_y = (screen_h - new_image_h) // 2
-
-                elif screen_aspect_ratio > photo_aspect_ratio:  # Height is binding
-                    new_image_h = screen_h
-                    new_image_w = int(new_image_h * photo_aspect_ratio)
-                    image = pygame.transform.scale(image, (new_image_w, new_image_h))
-                    image_x = (screen_w - new_image_w) // 2
-
-                else:  # Images have the same aspect ratio
-                    image = pygame.transform.scale(image, (screen_w, screen_h))
+                image, image_x, image_y = load_image(imagepath, self._size,
+                                                     disk_cache=create_disk_cache(self._config))
 
         return (image, image_x, image_y)
 
@@ -178,11 +349,77 @@ class VideoLooper:
             return False
 
     def _build_playlist(self):
+        """Build the playlist and set it up for the configured random mode."""
+        start = time.monotonic()
+        playlist = self._load_playlist()
+        playlist.set_random_mode(self._random_mode)
+        _build_seconds.observe(time.monotonic() - start)
+        _playlist_movies.set(playlist.length())
+        if self._snapshot is not None:
+            self._snapshot.update(self._snapshot_key(), playlist)
+        return playlist
+
+    def _snapshot_key(self):
+        """Return the settings the playlist snapshot is only valid for."""
+        return {'file_reader': self._config.get('video_looper', 'file_reader'),
+                'playlist': self._playlist_path, 'folder': self._playlist_folder,
+                'recursive': self._config.getboolean('playlist', 'recursive', fallback=False),
+                'extensions': sorted(self._player.supported_extensions())}
+
+    def _warm_start_playlist(self):
+        """Return the playlist of the snapshot and scan the file reader paths
+        in the background, if the movie to start with is unchanged since the
+        snapshot was written.  Returns None otherwise.
+        """
+        if self._snapshot is None or not self._reader.can_scan_in_background():
+            return None
+        movies = self._snapshot.load(self._snapshot_key())
+        if not movies:
+            return None
+        # Mount the drives, scanning them is left for the background.
+        self._reader.search_paths()
+        playlist = Playlist(movies)
+        playlist.set_random_mode(self._random_mode)
+        index = None
+        if self._resume_state is not None and self._resume_state.get('target'):
+            index = playlist.index_of(Movie(self._resume_state['target']))
+        if not self._snapshot.is_unchanged(movies[index if index is not None else 0]):
+            self._print('Playlist snapshot is outdated, scanning first')
+            return None
+        self._print('Warm start with {0} movies of the playlist snapshot'.format(len(movies)))
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan')
+        self._scan = executor.submit(self._build_playlist)
+        self._scan.add_done_callback(lambda _: self._reactor.wake())
+        executor.shutdown(wait=False)
+        return playlist
+
+    def _finish_warm_start(self, movie, queued):
+        """Swap in the playlist scanned after the warm start.  The playing
+        movie plays on if it is still in it, otherwise the scanned playlist
+        starts now.  Returns the new current and queued movie.
+        """
+        scan = self._scan
+        self._scan = None
+        try:
+            playlist = scan.result()
+        except Exception as err:
+            self._print('Scan failed, playing on from the snapshot: {0}'.format(err))
+            return movie, queued
+        if movie is not None and playlist.index_of(movie) is None:
+            self._print('{0} is gone, starting the scanned playlist'.format(movie))
+            self._player.stop(3)
+            movie = None
+            queued = None
+        movie, queued = self._swap_playlist(movie, queued, playlist)
+        self._set_hardware_volume()
+        return movie, queued
+
+    def _load_playlist(self):
         """Try to build a playlist (object) from a playlist (file).
         Falls back to an auto-generated playlist with all files.
         """
-        if self._config.has_option('playlist', 'path'):
-            playlist_path = self._config.get('playlist', 'path')
+        if self._playlist_path is not None:
+            playlist_path = self._playlist_path
             if playlist_path != "":
                 if os.path.isabs(playlist_path):
                     if not os.path.isfile(playlist_path):
@@ -207,8 +444,13 @@ class VideoLooper:
                         #raise RuntimeError('Playlist path {0} does not resolve to any file.'.format(playlist_path))
 
                 basepath, extension = os.path.splitext(playlist_path)
-                if extension == '.m3u' or extension == '.m3u8':
-                    return build_playlist_m3u(playlist_path)
+                builder = PLAYLIST_FORMATS.get(extension.lower())
+                if builder is not None:
+                    try:
+                        return builder(playlist_path, report=self._print)
+                    except (OSError, ValueError) as err:
+                        self._print('Failed to read playlist {0}: {1}'.format(playlist_path, err))
+                        return self._build_playlist_from_all_files()
                 else:
                     self._print('Unrecognized playlist format {0}.'.format(extension))
                     return self._build_playlist_from_all_files()
@@ -224,24 +466,17 @@ class VideoLooper:
         """
         # Get list of paths to search from the file reader.
         paths = self._reader.search_paths()
-        # Enumerate all movie files inside those paths.
-        movies = []
+        # Enumerate all movie files inside those paths (and their sub folders
+        # if enabled), optionally only those of the configured folder.
+        entries = self._scanner.scan(paths)
+        if self._playlist_folder:
+            entries = [entry for entry in entries
+                       if (entry.folder + '/').startswith(self._playlist_folder + '/')]
         for path in paths:
             # Skip paths that don't exist or are files.
             if not os.path.exists(path) or not os.path.isdir(path):
                 continue
 
-            for x in os.listdir(path):
-                # Ignore hidden files (useful when file loaded on usb key from an OSX computer
-                if x[0] != '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    repeatsetting = re.search('_repeat_([0-9]*)x', x, flags=re.IGNORECASE)
-                    if (repeatsetting is not None):
-                        repeat = repeatsetting.group(1)
-                    else:
-                        repeat = 1
-                    basename, extension = os.path.splitext(x)
-                    movies.append(Movie('{0}/{1}'.format(path.rstrip('/'), x), basename, repeat))
-
             # Get the ALSA hardware volume from the file in the usb key
             if self._alsa_hw_vol_file:
                 alsa_hw_vol_file_path = '{0}/{1}'.format(path.rstrip('/'), self._alsa_hw_vol_file)
@@ -258,8 +493,23 @@ class VideoLooper:
                         sound_vol_string = sound_file.readline()
                         if self._is_number(sound_vol_string):
                             self._sound_vol = int(float(sound_vol_string))
-        # Create a playlist with the sorted list of movies.
-        return Playlist(sorted(movies))
+        entries = self._filter_decodable(entries, paths)
+        # Create a playlist with the movies, sorted by path.
+        return Playlist([Movie(entry.path, os.path.splitext(entry.name)[0], entry.repeats, entry.weight)
+                         for entry in entries])
+
+    def _filter_decodable(self, entries, paths):
+        """Update the media catalog with the found files (only new or changed
+        files are probed) and drop those that can't be decoded.
+        """
+        if self._catalog is None:
+            return entries
+        decodable = self._catalog.update([(entry.path, entry.size, entry.mtime) for entry in entries],
+                                         roots=paths)
+        for entry in entries:
+            if entry.path not in decodable:
+                self._print('Quarantined {0}, it can not be decoded'.format(entry.path))
+        return [entry for entry in entries if entry.path in decodable]
 
     def _blank_screen(self):
         """Render a blank screen filled with the background color and optional the background image."""
@@ -275,7 +525,7 @@ class VideoLooper:
         # Default to small font if not provided.
         if font is None:
             font = self._small_font
-        return font.render(message, True, self._fgcolor, self._bgcolor)
+        return self._osd_layer.label(message, font)
 
     def _animate_countdown(self, playlist):
         """Print text with the number of loaded movies and a quick countdown
@@ -288,23 +538,22 @@ class VideoLooper:
         # Do nothing else if the OSD is turned off.
         if not self._osd:
             return
-        # Draw message with number of movies loaded and animate countdown.
-        # First render text that doesn't change and get static dimensions.
-        label1 = self._render_text(message + ' Starting playback in:')
-        l1w, l1h = label1.get_size()
+        # Draw message with number of movies loaded, the countdown below it
+        # is animated by the main loop.
         sw, sh = self._screen.get_size()
-        for i in range(self._countdown_time, 0, -1):
-            # Each iteration of the countdown rendering changing text.
-            label2 = self._render_text(str(i), self._big_font)
-            l2w, l2h = label2.get_size()
-            # Clear screen and draw text with line1 above line2 and all
-            # centered horizontally and vertically.
-            self._screen.fill(self._bgcolor)
-            self._screen.blit(label1, (round(sw/2-l1w/2), round(sh/2-l2h/2-l1h)))
-            self._screen.blit(label2, (round(sw/2-l2w/2), round(sh/2-l2h/2)))
-            pygame.display.update()
-            # Pause for a second between each frame.
-            time.sleep(1)
+        l2h = self._render_text('0', self._big_font).get_height()
+        self._osd_layer.clear()
+        self._osd_layer.text('line1', message + ' Starting playback in:', self._small_font,
+                             midbottom=(round(sw/2), round(sh/2-l2h/2)))
+        self._start_timed_screen('countdown', self._countdown_time)
+
+    def _draw_countdown(self, remaining):
+        """Draw the number of seconds left below the countdown message, only
+        the digits that change are redrawn.
+        """
+        sw, sh = self._screen.get_size()
+        self._osd_layer.text('countdown', str(remaining), self._big_font, center=(round(sw/2), round(sh/2)))
+        self._osd_layer.flush()
 
     def _display_datetime(self):
         # returns suffix based on the day
@@ -320,42 +569,79 @@ class VideoLooper:
             return suffix
 
         sw, sh = self._screen.get_size()
+        now = datetime.now()
 
-        for i in range(self._wait_time):
-            if self._running:
-                now = datetime.now()
+        # Get the day suffix
+        suffix = get_day_suffix(int(now.strftime('%d')))
 
-                # Get the day suffix
-                suffix = get_day_suffix(int(now.strftime('%d')))
+        # Format the time and date strings
+        top_format = self._top_datetime_display_format.replace('%d{SUFFIX}', f'%d{suffix}')
+        bottom_format = self._bottom_datetime_display_format.replace('%d{SUFFIX}', f'%d{suffix}')
 
-                # Format the time and date strings
-                top_format = self._top_datetime_display_format.replace('%d{SUFFIX}', f'%d{suffix}')
-                bottom_format = self._bottom_datetime_display_format.replace('%d{SUFFIX}', f'%d{suffix}')
+        top_str = now.strftime(top_format)
+        bottom_str = now.strftime(bottom_format)
 
-                top_str = now.strftime(top_format)
-                bottom_str = now.strftime(bottom_format)
+        # Calculate the label positions
+        l1h = self._render_text(top_str, self._big_font).get_height()
+        l2h = self._render_text(bottom_str, self._medium_font).get_height()
 
-                # Render the time and date labels
-                top_label = self._render_text(top_str, self._big_font)
-                bottom_label = self._render_text(bottom_str, self._medium_font)
+        top_y = sh // 2 - (l1h + l2h) // 2
+        bottom_y = top_y + l1h + 50
 
-                # Calculate the label positions
-                l1w, l1h = top_label.get_size()
-                l2w, l2h = bottom_label.get_size()
+        # Draw the labels, only the changed parts are updated
+        self._osd_layer.text('time', top_str, self._big_font, midtop=(sw // 2, top_y))
+        self._osd_layer.text('date', bottom_str, self._medium_font, midtop=(sw // 2, bottom_y))
+        self._osd_layer.flush()
 
-                top_x = sw // 2 - l1w // 2
-                top_y = sh // 2 - (l1h + l2h) // 2
-                bottom_x = sw // 2 - l2w // 2
-                bottom_y = top_y + l1h + 50
+    def _start_timed_screen(self, kind, duration):
+        """Show the countdown ('countdown') or the wait between movies (with
+        the date and time 'datetime', or without 'wait') for duration
+        seconds.  The screen is redrawn and ended by the main loop, which
+        keeps handling commands and reader changes meanwhile.
+        """
+        now = time.monotonic()
+        self._timed_screen = kind
+        self._timed_end = now + duration
+        self._timed_tick = now
+        if kind == 'datetime':
+            self._osd_layer.clear()
 
-                # Draw the labels to the screen
+    def _end_timed_screen(self):
+        if self._timed_screen == 'countdown':
+            self._blank_screen()
+        self._timed_screen = None
 
-                self._screen.fill(self._bgcolor)
-                self._screen.blit(top_label, (top_x, top_y))
-                self._screen.blit(bottom_label, (bottom_x, bottom_y))
-                pygame.display.update()
+    def _skip_timed_screen(self):
+        """End the countdown or wait screen early because another movie was
+        chosen, it starts right away.
+        """
+        if self._timed_screen is not None:
+            self._firstStart = True
+        self._end_timed_screen()
 
-                time.sleep(1)
+    def _update_timed_screen(self):
+        """Redraw the timed screen if its next update is due.  Returns the
+        kind of the screen once it is over, otherwise None.
+        """
+        kind = self._timed_screen
+        now = time.monotonic()
+        if now >= self._timed_end:
+            self._end_timed_screen()
+            return kind
+        if now < self._timed_tick:
+            return None
+        if kind == 'countdown':
+            remaining = math.ceil(self._timed_end - now)
+            self._draw_countdown(remaining)
+            # Next when the number of seconds left changes.
+            self._timed_tick = self._timed_end - (remaining - 1)
+        elif kind == 'datetime':
+            self._display_datetime()
+            # Next at the start of the next wall clock second.
+            self._timed_tick = now + 1 - time.time() % 1
+        else:
+            self._timed_tick = self._timed_end
+        return None
 
     def _idle_message(self):
         """Print idle message from file reader."""
@@ -366,17 +652,15 @@ class VideoLooper:
         if not self._osd:
             return
         # Display idle message in center of screen.
-        label = self._render_text(message)
-        lw, lh = label.get_size()
+        lh = self._render_text(message).get_height()
         sw, sh = self._screen.get_size()
-        self._screen.fill(self._bgcolor)
-        self._screen.blit(label, (sw/2-lw/2, sh/2-lh/2))
+        self._osd_layer.clear()
+        self._osd_layer.text('message', message, self._small_font, center=(round(sw/2), round(sh/2)))
         # If keyboard control is enabled, display message about it
         if self._keyboard_control:
-            label2 = self._render_text('press ESC to quit')
-            l2w, l2h = label2.get_size()
-            self._screen.blit(label2, (sw/2-l2w/2, sh/2-l2h/2+lh))
-        pygame.display.update()
+            self._osd_layer.text('hint', 'press ESC to quit', self._small_font,
+                                 center=(round(sw/2), round(sh/2+lh)))
+        self._osd_layer.flush()
 
     def display_message(self,message):
         self._print(message)
@@ -384,12 +668,10 @@ class VideoLooper:
         if not self._osd:
             return
         # Display idle message in center of screen.
-        label = self._render_text(message)
-        lw, lh = label.get_size()
         sw, sh = self._screen.get_size()
-        self._screen.fill(self._bgcolor)
-        self._screen.blit(label, (sw/2-lw/2, sh/2-lh/2))
-        pygame.display.update()
+        self._osd_layer.clear()
+        self._osd_layer.text('message', message, self._small_font, center=(round(sw/2), round(sh/2)))
+        self._osd_layer.flush()
 
     def _prepare_to_run_playlist(self, playlist):
         """Display messages when a new playlist is loaded."""
@@ -397,9 +679,10 @@ class VideoLooper:
         # or if no movies are available show the idle message.
         self._blank_screen()
         self._firstStart = True
+        self._timed_screen = None
         if playlist.length() > 0:
+            # Ends with a blank screen.
             self._animate_countdown(playlist)
-            self._blank_screen()
         else:
             self._idle_message()
 
@@ -416,6 +699,140 @@ class VideoLooper:
                 cmd.extend(('-c', str(self._alsa_hw_device[0])))
             cmd.extend(('set', self._alsa_hw_vol_control, '--', self._alsa_hw_vol))
             subprocess.check_call(cmd)
+
+    def _can_preload(self):
+        """Return true if the next movie can be queued in the player while the
+        current one is still playing.  Not done when the looper has to step in
+        between movies (wait time, one-shot playback) or the player loops a
+        single movie endlessly.
+        """
+        return self._preload_next and self._player.can_preload() \
+            and not self._one_shot_playback and self._wait_time == 0 \
+            and self._playlist.length() > 1 and not self._schedule_pending
+
+    def _load_schedule(self, config_path):
+        """Load the time of day schedule of playlists from the schedule file
+        next to the config file, if there is one.
+        """
+        self._schedule = None
+        self._schedule_rule = None
+        # The active rule changed, the playlist is swapped after the movie.
+        self._schedule_pending = False
+        self._schedule_due = None
+        self._schedule_immediate = self._config.get('schedule', 'switch', fallback='end_of_clip') == 'immediate'
+        schedule_file = self._config.get('schedule', 'file', fallback='video_looper_schedule.ini')
+        if not schedule_file:
+            return
+        schedule_path = os.path.join(os.path.dirname(os.path.abspath(config_path)), schedule_file)
+        if not os.path.isfile(schedule_path):
+            return
+        try:
+            self._schedule = load_schedule(schedule_path)
+        except ValueError as err:
+            self._print('Ignoring schedule: {0}'.format(err))
+            return
+        self._print('Loaded schedule {0} with {1} rules, {2} changes per week'.format(
+            schedule_path, len(self._schedule.rules), self._schedule.transitions()))
+        self._apply_schedule_rule(self._schedule.rule_at(datetime.now()))
+
+    def _apply_schedule_rule(self, rule):
+        """Use the playlist of the schedule rule (None for the default) for the
+        next playlist build, and find the time of the next change.
+        """
+        self._schedule_rule = rule
+        self._schedule_pending = False
+        if rule is None:
+            self._playlist_path, self._playlist_folder = self._default_playlist
+        else:
+            self._playlist_path = rule.playlist if rule.playlist is not None else ''
+            self._playlist_folder = (rule.folder or '').strip('/')
+        now = datetime.now()
+        change = self._schedule.next_change(now)
+        if change is None:
+            self._schedule_due = None
+        else:
+            # Wall clock (and daylight saving time) aware seconds until then.
+            delay = time.mktime(change.timetuple()) - time.mktime(now.timetuple()) - now.microsecond / 1e6
+            self._schedule_due = time.monotonic() + max(0, delay)
+
+    def _check_schedule(self, movie):
+        """At a change of the schedule, note that the playlist has to change
+        and return True if it has to be swapped right away.
+        """
+        if self._schedule_due is None or time.monotonic() < self._schedule_due:
+            return False
+        rule = self._schedule.rule_at(datetime.now())
+        if rule is self._schedule_rule:
+            # Woke up early, like after the clock was set.
+            self._apply_schedule_rule(rule)
+            return False
+        self._print('Schedule: {0} starts'.format(rule.name if rule is not None else 'default playlist'))
+        self._schedule_pending = True
+        self._schedule_due = None
+        # A single movie is looped endlessly by the player, it never ends.
+        return self._schedule_immediate or movie is None or self._playlist.length() == 1
+
+    def _switch_schedule(self):
+        """Swap in the playlist of the active schedule rule, without the
+        countdown of a new playlist.  Returns the first movie.
+        """
+        self._apply_schedule_rule(self._schedule.rule_at(datetime.now()))
+        # The scan of a warm start is for the playlist before.
+        self._scan = None
+        self._playlist = self._build_playlist()
+        self._print('Playlist switched: {0} movies'.format(self._playlist.length()))
+        if self._playlist.length() == 0:
+            self._idle_message()
+            return None
+        return self._playlist.get_next(self._is_random)
+
+    def _first_movie(self):
+        """Return the movie to start the playlist with: where playback was
+        before the restart when resuming, otherwise the first one.
+        """
+        state = self._resume_state
+        if state is not None and self._playlist.length() > 0:
+            self._resume_state = None
+            index = None
+            if state.get('target'):
+                index = self._playlist.index_of(Movie(state['target']))
+            if index is not None:
+                if state.get('position'):
+                    self._resume_start = (state['target'], state['position'])
+            elif isinstance(state.get('index'), int) and 0 <= state['index'] < self._playlist.length():
+                index = state['index']
+            if index is not None:
+                self._playlist.set_next(index)
+        return self._playlist.get_next(self._is_random)
+
+    def _record_resume(self, movie, position=0.0):
+        """Note the movie that plays (and where) in the resume journal."""
+        if self._journal is not None and movie is not None:
+            self._journal.record(movie, self._playlist.current_index(), position)
+            self._resume_due = time.monotonic() + self._resume_interval
+
+    def _sample_resume_position(self, movie):
+        """Save the position of the playing movie every resume_interval."""
+        if self._journal is None or movie is None or time.monotonic() < self._resume_due:
+            return
+        position = self._player.position() if self._player.is_playing() else None
+        if position is not None:
+            self._record_resume(movie, position)
+        else:
+            self._resume_due = time.monotonic() + self._resume_interval
+
+    def _prefetch_upcoming(self):
+        """Let the player prepare the movies that play next."""
+        if self._prefetch_count > 0:
+            self._player.prefetch(self._playlist.upcoming(self._is_random, self._prefetch_count))
+
+    def _infotext(self, movie):
+        """Return the repeat information printed along with the playing movie."""
+        if self._playlist.length()==1:
+            return '(endless loop)'
+        if self._player.can_loop_count():
+            return '{0} time{1} (player counts loops)'.format(movie.repeats, "s" if movie.repeats>1 else "")
+        return '{0}/{1}'.format(movie.playcount, movie.repeats)
             
     def _handle_keyboard_shortcuts(self):
         while self._running:
@@ -426,41 +843,68 @@ class VideoLooper:
                 continue
             
             if event.type == pygame.KEYDOWN:
-                # If pressed key is ESC quit program
-                if event.key == pygame.K_ESCAPE:
-                    self._print("ESC was pressed. quitting...")
-                    self.quit()
-                if event.key == pygame.K_k:
-                    self._print("k was pressed. skipping...")
-                    self._playlist.seek(1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
-                if event.key == pygame.K_s:
-                    if self._playbackStopped:
-                        self._print("s was pressed. starting...")
-                        self._playbackStopped = False
-                    else:
-                        self._print("s was pressed. stopping...")
-                        self._playbackStopped = True
-                        self._player.stop(3)
-                # space is pause/resume the playing video
-                if event.key == pygame.K_SPACE:
-                    self._print("Pause/Resume pressed")
-                    self._player.pause()
-                if event.key == pygame.K_p:
-                    self._print("p was pressed. shutting down...")
-                    self.quit(True)
-                if event.key == pygame.K_b:
-                    self._print("b was pressed. jumping back...")
-                    self._playlist.seek(-1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
-                if event.key == pygame.K_o:
-                    self._print("o was pressed. next chapter...")
-                    self._player.sendKey("o")
-                if event.key == pygame.K_i:
-                    self._print("i was pressed. previous chapter...")
-                    self._player.sendKey("i")
+                self._post_command('key', event.key)
+
+    def _post_command(self, command, argument=None):
+        """Queue a command for the main loop and wake it up.  Used by the
+        keyboard and GPIO handlers which run in their own threads.
+        """
+        self._commands.put((command, argument))
+        self._reactor.wake()
+
+    def _process_commands(self):
+        """Run all commands queued by the keyboard and GPIO handlers."""
+        while True:
+            try:
+                command, argument = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if command == 'key':
+                self._handle_key(argument)
+            elif command == 'jump':
+                self._skip_timed_screen()
+                self._playlist.set_next(argument)
+                self._player.stop(3)
+                self._playbackStopped = False
+
+    def _handle_key(self, key):
+        # If pressed key is ESC quit program
+        if key == pygame.K_ESCAPE:
+            self._print("ESC was pressed. quitting...")
+            self.quit()
+        if key == pygame.K_k:
+            self._print("k was pressed. skipping...")
+            self._skip_timed_screen()
+            self._playlist.seek(1)
+            self._player.stop(3)
+            self._playbackStopped = False
+        if key == pygame.K_s:
+            if self._playbackStopped:
+                self._print("s was pressed. starting...")
+                self._playbackStopped = False
+            else:
+                self._print("s was pressed. stopping...")
+                self._playbackStopped = True
+                self._player.stop(3)
+        # space is pause/resume the playing video
+        if key == pygame.K_SPACE:
+            self._print("Pause/Resume pressed")
+            self._player.pause()
+        if key == pygame.K_p:
+            self._print("p was pressed. shutting down...")
+            self.quit(True)
+        if key == pygame.K_b:
+            self._print("b was pressed. jumping back...")
+            self._skip_timed_screen()
+            self._playlist.seek(-1)
+            self._player.stop(3)
+            self._playbackStopped = False
+        if key == pygame.K_o:
+            self._print("o was pressed. next chapter...")
+            self._player.sendKey("o")
+        if key == pygame.K_i:
+            self._print("i was pressed. previous chapter...")
+            self._player.sendKey("i")
     
     def _handle_gpio_control(self, pin):
         if self._pinMap == None:
@@ -477,13 +921,13 @@ class VideoLooper:
         if action in ['K_ESCAPE', 'K_k', 'K_s', 'K_SPACE', 'K_p', 'K_b', 'K_o', 'K_i']:
             pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=getattr(pygame, action, None)))
         else:
-            self._playlist.set_next(action)
-            self._player.stop(3)
-            self._playbackStopped = False
+            self._post_command('jump', action)
     
     def _gpio_setup(self):
         if self._pinMap == None:
             return
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
         GPIO.setmode(GPIO.BOARD)
         for pin in self._pinMap:
             GPIO.setup(int(pin), GPIO.IN, pull_up_down=GPIO.PUD_UP)
@@ -491,60 +935,177 @@ class VideoLooper:
             self._print("pin {} action set to: {}".format(pin, self._pinMap[pin]))
 
         
+    def _swap_playlist(self, movie, queued, playlist=None):
+        """Replace the playlist with a rebuilt one (or playlist) without
+        stopping the player.  The new playlist continues after the playing
+        movie (and with the movie queued in the player) if they are still in
+        it.  Returns the new current and queued movie.
+        """
+        was_single = self._playlist.length() == 1
+        self._playlist = playlist if playlist is not None else self._build_playlist()
+        self._print('Playlist updated: {0} movies'.format(self._playlist.length()))
+        if self._copyloader:
+            self._bgimage = self._load_bgimage()
+        if movie is None or self._playlist.length() == 0:
+            # Nothing played yet (or nothing left), start over.
+            if self._playlist.length() == 0:
+                self._idle_message()
+            else:
+                self._blank_screen()
+            self._firstStart = True
+            return self._playlist.get_next(self._is_random), None
+        if queued is not None and self._playlist.index_of(queued) is None and self._player.cancel_preload():
+            # The queued movie is gone, the next one is queued instead.
+            queued = None
+        current = self._playlist.continue_from(movie, queued)
+        if was_single and self._playlist.length() > 1 and self._player.is_playing():
+            # A single movie is looped endlessly by the player, restart to
+            # get to the other movies.
+            self._player.stop(3)
+        return (current if current is not None else movie), queued
+
+    def _wait_for_events(self):
+        """Sleep until the player or the file reader signal a change or a
+        command was queued.  Sources that can't signal are polled.
+        """
+        sources = [self._player.event_source()]
+        # A reader can have several sources, it is left alone while the scan
+        # of the warm start runs.
+        reader_source = self._reader.event_source() if self._scan is None else []
+        sources.extend(reader_source if isinstance(reader_source, list) else [reader_source])
+        timeout = self._poll_interval if None in sources else None
+        if self._timed_screen is not None:
+            # Wake up for the next update of the countdown or wait screen.
+            due = max(0, min(self._timed_tick, self._timed_end) - time.monotonic())
+            timeout = due if timeout is None else min(timeout, due)
+        if self._schedule_due is not None:
+            # Sleep until the next change of the schedule at most.
+            due = max(0, self._schedule_due - time.monotonic())
+            timeout = due if timeout is None else min(timeout, due)
+        if self._journal is not None and self._player.is_playing():
+            # Wake up to save the playback position.
+            due = max(0, self._resume_due - time.monotonic())
+            timeout = due if timeout is None else min(timeout, due)
+        self._reactor.set_sources(sources)
+        self._reactor.wait(timeout)
+
     def run(self):
         """Main program loop.  Will never return!"""
         # Get playlist of movies to play from file reader.
-        self._playlist = self._build_playlist()
+        with self._startup.phase('playlist'):
+            self._playlist = self._warm_start_playlist()
+            if self._playlist is None:
+                self._playlist = self._build_playlist()
         self._prepare_to_run_playlist(self._playlist)
         self._set_hardware_volume()
-        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+        movie = self._first_movie()
+        # Movie queued in the player to follow the current one.
+        queued = None
         # Main loop to play videos in the playlist and listen for file changes.
         while self._running:
+            pass_start = time.monotonic()
+            # Run commands from the keyboard and GPIO handlers.
+            self._process_commands()
+            if not self._running:
+                break
+            # At a change of the schedule swap the playlist now or drop the
+            # queued movie, so the new playlist starts after this movie.
+            if self._check_schedule(movie):
+                self._player.stop(3)
+                queued = None
+                movie = self._switch_schedule()
+            elif self._schedule_pending and queued is not None and self._player.cancel_preload():
+                queued = None
+
+            # Follow the player when it moved on to a queued movie.
+            if self._player.can_preload():
+                transition = self._player.poll_transition()
+                if transition is not None:
+                    current, gap = transition
+                    self._startup_done('first frame')
+                    if queued is not None and current is queued:
+                        # The player moved on to the queued movie by itself.
+                        movie.clear_playcount()
+                        movie = self._playlist.get_next(self._is_random)
+                        movie.was_played()
+                        queued = None
+                        _movies_played.inc()
+                        _last_play.set(time.time())
+                        self._print('Playing movie: {0} {1}'.format(movie, self._infotext(movie)))
+                        self._record_resume(movie)
+                        self._prefetch_upcoming()
+                    if gap is not None:
+                        _transition_gap.observe(gap / 1000)
+                        self._print('Transition gap: {0:.1f} ms'.format(gap))
+
+            # Update the countdown or wait screen.  Once the wait is over the
+            # movie chosen before it starts.
+            ended = None
+            if self._timed_screen is not None:
+                ended = self._update_timed_screen()
+            if ended in ('wait', 'datetime'):
+                if not self._playbackStopped and movie is not None:
+                    self._play_movie(movie)
+
+            # Nothing plays while a countdown or wait screen is shown.
+            elif self._timed_screen is not None:
+                _playing.set(0)
+
             # Load and play a new movie if nothing is playing.
-            if not self._player.is_playing() and not self._playbackStopped:
+            elif not self._player_is_playing() and not self._playbackStopped:
+                queued = None
+                if movie is not None and self._schedule_pending \
+                        and (movie.playcount >= movie.repeats or (self._player.can_loop_count() and movie.playcount > 0)):
+                    # The movie ended, continue with the scheduled playlist.
+                    movie.clear_playcount()
+                    movie = self._switch_schedule()
+
                 if movie is not None: #just to avoid errors
 
                     if movie.playcount >= movie.repeats:
                         movie.clear_playcount()
-                        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+                        movie = self._playlist.get_next(self._is_random)
                     elif self._player.can_loop_count() and movie.playcount > 0:
                         movie.clear_playcount()
-                        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+                        movie = self._playlist.get_next(self._is_random)
 
                     movie.was_played()
 
                     if self._wait_time > 0 and not self._firstStart:
                         if(self._datetime_display):
-                            self._display_datetime()
+                            self._start_timed_screen('datetime', self._wait_time)
                         else:
                             self._print('Waiting for: {0} seconds'.format(self._wait_time))
-                            time.sleep(self._wait_time)
-                    self._firstStart = False
-
-                    #generating infotext
-                    if self._player.can_loop_count():
-                        infotext = '{0} time{1} (player counts loops)'.format(movie.repeats, "s" if movie.repeats>1 else "")
+                            self._start_timed_screen('wait', self._wait_time)
                     else:
-                        infotext = '{0}/{1}'.format(movie.playcount, movie.repeats)
-                    if self._playlist.length()==1:
-                        infotext = '(endless loop)'
-
-                    #player loop setting:
-                    player_loop = -1 if self._playlist.length()==1 else None
-
-                    #special one-shot playback condition
-                    if self._one_shot_playback:
-                        self._playbackStopped = True
-                        player_loop = None
-                        
-                    # Start playing the first available movie.
-                    self._print('Playing movie: {0} {1}'.format(movie, infotext))
-                    # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
-                    self._player.play(movie, loop=player_loop, vol = self._sound_vol)
+                        self._play_movie(movie)
+
+            # Look ahead: queue the next movie in the player while the current
+            # one plays, so the player can switch over without a gap.
+            elif queued is None and movie is not None and self._can_preload():
+                queued = self._playlist.peek_next(self._is_random)
+                if queued is not None and self._player.preload(queued):
+                    self._print('Preloaded movie: {0}'.format(queued))
+
+            # The scan after a warm start finished, update the playlist to
+            # the files that are there now.
+            if self._scan is not None and self._scan.done():
+                movie, queued = self._finish_warm_start(movie, queued)
+
+            # Files arrived in the background (like the import of the copy
+            # mode), update the playlist while the current movie plays on.
+            if self._scan is None and self._reader.live_update():
+                movie, queued = self._swap_playlist(movie, queued)
+
+            # The catalog found files that can't be decoded, rebuild the
+            # playlist without them while the current movie plays on.
+            if self._scan is None and self._catalog_changed:
+                self._catalog_changed = False
+                movie, queued = self._swap_playlist(movie, queued)
 
             # Check for changes in the file search path (like USB drives added)
             # and rebuild the playlist.
-            if self._reader.is_changed() and not self._playbackStopped:
+            if self._scan is None and self._reader.is_changed() and not self._playbackStopped:
                 self._print("reader changed, stopping player")
                 self._player.stop(3)  # Up to 3 second delay waiting for old 
                                       # player to stop.
@@ -556,17 +1117,56 @@ class VideoLooper:
                     self._bgimage = self._load_bgimage()
                 self._prepare_to_run_playlist(self._playlist)
                 self._set_hardware_volume()
-                movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+                movie = self._first_movie()
+
+            self._sample_resume_position(movie)
+            _loop_seconds.observe(time.monotonic() - pass_start)
 
-            # Give the CPU some time to do other tasks. low values increase "responsiveness to changes" and reduce the pause between files
-            # but increase CPU usage
-            # since keyboard commands are handled in a seperate thread this sleeptime mostly influences the pause between files
-                        
-            time.sleep(0.002)
+            # Sleep until something happens: the player changed state, the
+            # file reader saw a change or a command was queued.
+            self._wait_for_events()
 
+        if self._journal is not None:
+            self._journal.close()
+        if self._snapshot is not None:
+            self._snapshot.close()
+        if self._metrics_exporter is not None:
+            self._metrics_exporter.close()
         self._print("run ended")
         pygame.quit()
 
+    def _play_movie(self, movie):
+        """Start playing movie, which was already counted as played."""
+        self._firstStart = False
+
+        #player loop setting:
+        player_loop = -1 if self._playlist.length()==1 else None
+
+        #special one-shot playback condition
+        if self._one_shot_playback:
+            self._playbackStopped = True
+            player_loop = None
+
+        # Start playing the first available movie.
+        self._print('Playing movie: {0} {1}'.format(movie, self._infotext(movie)))
+        # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
+        start = None
+        if self._resume_start is not None:
+            if self._resume_start[0] == movie.target:
+                start = self._resume_start[1]
+                self._print('Resuming at {0:.0f} seconds'.format(start))
+            self._resume_start = None
+        if self._player.play(movie, loop=player_loop, vol = self._sound_vol, start = start) is False:
+            _play_failures.inc()
+        else:
+            _movies_played.inc()
+            _last_play.set(time.time())
+        if not self._player.can_preload():
+            # Other players show the movie right away.
+            self._startup_done('first frame')
+        self._record_resume(movie, start)
+        self._prefetch_upcoming()
+
     def quit(self, shutdown=False):
         """Shut down the program"""
         self._print("quitting Video Looper")
@@ -576,13 +1176,14 @@ class VideoLooper:
 
         self._playbackStopped = True
         self._running = False
+        self._reactor.wake()
         pygame.event.post(pygame.event.Event(pygame.QUIT))
 
         if self._player is not None:
             self._player.stop()
 
-        if self._pinMap:
-            GPIO.cleanup()
+        if self._pinMap and self._gpio is not None:
+            self._gpio.cleanup()
 
 
     def signal_quit(self, signal, frame):
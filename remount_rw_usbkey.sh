@@ -1 +1,7 @@
-sudo mount -o remount ,rw /mnt/usbdrive0
+# Remount the USB drives writable, /mnt/usbdrive0 etc. or /mnt/usbdrive-<UUID>
+# with mount_by_uuid = true.
+for path in /mnt/usbdrive*; do
+    if mountpoint -q "$path"; then
+        sudo mount -o remount,rw "$path"
+    fi
+done
@@ -0,0 +1,56 @@
+import os
+
+from Adafruit_Video_Looper.manifest import LocalManifest, read_sha256sums
+
+DIGEST = 'ab' * 32
+
+
+def test_read_sha256sums(tmp_path):
+    path = tmp_path / 'SHA256SUMS'
+    path.write_text('# comment\n'
+                    '{0}  clip one.mp4\n'
+                    '{1} *sub/binary.mp4\r\n'
+                    'short  ignored.mp4\n'
+                    '\n'.format(DIGEST, DIGEST.upper()))
+    assert read_sha256sums(str(path)) == {'clip one.mp4': DIGEST, 'binary.mp4': DIGEST}
+
+
+def test_read_sha256sums_missing(tmp_path):
+    assert read_sha256sums(str(tmp_path / 'SHA256SUMS')) == {}
+
+
+def test_local_manifest_round_trip(tmp_path):
+    (tmp_path / 'a.mp4').write_bytes(b'1234')
+    manifest = LocalManifest(str(tmp_path))
+    manifest.set('a.mp4', DIGEST)
+    manifest.save()
+    assert not os.path.exists(str(tmp_path / '.video_looper_manifest.json.tmp'))
+    assert LocalManifest(str(tmp_path)).sha256('a.mp4') == DIGEST
+
+
+def test_local_manifest_changed_file(tmp_path):
+    path = tmp_path / 'a.mp4'
+    path.write_bytes(b'1234')
+    manifest = LocalManifest(str(tmp_path))
+    manifest.set('a.mp4', DIGEST)
+    st = path.stat()
+    os.utime(str(path), (st.st_atime, st.st_mtime + 60))
+    assert manifest.sha256('a.mp4') is None
+
+
+def test_local_manifest_check(tmp_path):
+    for name in ('kept.mp4', 'truncated.mp4', 'gone.mp4'):
+        (tmp_path / name).write_bytes(b'1234')
+    manifest = LocalManifest(str(tmp_path))
+    for name in ('kept.mp4', 'truncated.mp4', 'gone.mp4'):
+        manifest.set(name, DIGEST)
+    (tmp_path / 'truncated.mp4').write_bytes(b'12')
+    (tmp_path / 'gone.mp4').unlink()
+    assert sorted(manifest.check()) == ['gone.mp4', 'truncated.mp4']
+    assert manifest.sha256('kept.mp4') == DIGEST
+    assert manifest.sha256('gone.mp4') is None
+
+
+def test_local_manifest_unreadable(tmp_path):
+    (tmp_path / '.video_looper_manifest.json').write_text('{not json')
+    assert LocalManifest(str(tmp_path)).sha256('a.mp4') is None
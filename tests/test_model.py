@@ -0,0 +1,119 @@
+import random
+from collections import Counter
+
+import pytest
+
+from Adafruit_Video_Looper.model import Movie, Playlist, RandomOrder, ShuffleOrder, WeightedOrder
+
+
+def movies(count, **kwargs):
+    return [Movie('/media/clip{0}.mp4'.format(i), **kwargs) for i in range(count)]
+
+
+def test_weighted_order_follows_weights():
+    clips = [Movie('/media/a.mp4', weight=3.0), Movie('/media/b.mp4', weight=1.0),
+             Movie('/media/c.mp4', weight=0.0)]
+    order = WeightedOrder(clips, random.Random(1))
+    counts = Counter(order.pop() for _ in range(8000))
+    assert counts[2] == 0
+    assert 2.7 < counts[0] / counts[1] < 3.3
+
+
+def test_weighted_order_without_weights_is_uniform():
+    order = WeightedOrder(movies(4, weight=0.0), random.Random(2))
+    counts = Counter(order.pop() for _ in range(8000))
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert min(counts.values()) > 1700
+
+
+def test_weighted_order_uses_lazy_weights():
+    class LazyMovies(list):
+        def __iter__(self):
+            raise AssertionError('movies read for their weights')
+
+        def weights(self):
+            return [0.0, 1.0]
+
+    order = WeightedOrder(LazyMovies(movies(2)), random.Random(3))
+    assert set(order.pop() for _ in range(100)) == {1}
+
+
+def test_playlist_weighted_mode():
+    playlist = Playlist([Movie('/media/a.mp4', weight=1.0), Movie('/media/b.mp4', weight=0.0)])
+    playlist.set_random_mode('weighted')
+    assert set(playlist.get_next(True).target for _ in range(50)) == {'/media/a.mp4'}
+
+
+def test_playlist_upcoming_matches_get_next():
+    playlist = Playlist(movies(10))
+    playlist.set_random_mode('weighted')
+    playlist.get_next(True)
+    upcoming = playlist.upcoming(True, 5)
+    assert [playlist.get_next(True) for _ in range(5)] == upcoming
+
+
+def test_unknown_random_mode():
+    with pytest.raises(ValueError):
+        Playlist(movies(2)).set_random_mode('sorted')
+
+
+def cycles(targets, count):
+    return [set(targets[i:i + count]) for i in range(0, len(targets), count)]
+
+
+def test_shuffle_order_plays_every_movie_once_per_bag():
+    order = ShuffleOrder(movies(6), random.Random(4))
+    picks = [order.pop() for _ in range(60)]
+    assert all(bag == set(range(6)) for bag in cycles(picks, 6))
+    assert all(a != b for a, b in zip(picks, picks[1:]))
+
+
+def test_shuffle_order_skips_the_current_movie():
+    order = ShuffleOrder(movies(3), random.Random(5))
+    first = order.peek(1)[0]
+    assert order.pop(current=first) != first
+
+
+def test_peek_does_not_advance():
+    order = RandomOrder(movies(5), random.Random(6))
+    peeked = order.peek(3)
+    assert [order.pop() for _ in range(3)] == peeked
+
+
+def test_push_puts_an_index_back():
+    order = ShuffleOrder(movies(4), random.Random(7))
+    index = order.pop()
+    order.push(index)
+    assert order.pop() == index
+
+
+def test_shuffle_cycle_survives_dropped_peeks():
+    # Swapping in a rebuilt playlist (continue_from) drops the peeked movie,
+    # it must still play in its cycle.
+    playlist = Playlist(movies(7))
+    movie = playlist.get_next(True)
+    played = [movie.target]
+    for _ in range(69):
+        playlist.peek_next(True)
+        playlist.continue_from(Movie(movie.target))
+        movie = playlist.get_next(True)
+        played.append(movie.target)
+    assert all(len(bag) == 7 for bag in cycles(played, 7))
+
+
+def test_set_next_keeps_the_peeked_movie():
+    playlist = Playlist(movies(5))
+    current = playlist.get_next(True)
+    peeked = playlist.peek_next(True)
+    jump = next(movie for movie in playlist.movies() if movie not in (current, peeked))
+    playlist.set_next(jump)
+    assert playlist.get_next(True) is jump
+    assert playlist.get_next(True) is peeked
+
+
+def test_sequential_peek_and_wraparound():
+    playlist = Playlist(movies(3))
+    assert playlist.peek_next(False) is None
+    assert [playlist.get_next(False).target for _ in range(4)] == [
+        '/media/clip0.mp4', '/media/clip1.mp4', '/media/clip2.mp4', '/media/clip0.mp4']
+    assert playlist.peek_next(False).target == '/media/clip1.mp4'
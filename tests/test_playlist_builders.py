@@ -0,0 +1,62 @@
+import os
+
+from Adafruit_Video_Looper.playlist_builders import M3UIndex, build_playlist_m3u
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_m3u_entries(tmp_path):
+    playlist = write(tmp_path / 'list.m3u',
+                     '﻿#EXTM3U\n'
+                     '#EXTINF:-1 weight="3",First clip\n'
+                     '#EXTVLCOPT:start-time=1.5\n'
+                     '#EXTVLCOPT:stop-time=4\n'
+                     'clips/one.mp4\n'
+                     '\n'
+                     'file:///media/two%20words.mp4\n')
+    movies = list(build_playlist_m3u(playlist).movies())
+    assert [movie.target for movie in movies] == [str(tmp_path / 'clips' / 'one.mp4'),
+                                                  '/media/two words.mp4']
+    first, second = movies
+    assert (first.title, first.weight, first.start, first.stop) == ('First clip', 3.0, 1.5, 4.0)
+    assert (second.title, second.weight, second.start, second.stop) == (None, 1.0, None, None)
+
+
+def test_m3u_index_reads_entries_lazily(tmp_path):
+    playlist = write(tmp_path / 'list.m3u',
+                     ''.join('#EXTINF:-1 weight="{0}",Clip {0}\nclip{0}.mp4\n'.format(i) for i in range(100)))
+    index = M3UIndex(playlist)
+    assert len(index) == 100
+    assert list(index.weights()) == [float(i) for i in range(100)]
+    assert index.targets()[42] == str(tmp_path / 'clip42.mp4')
+    assert index.movie(42).title == 'Clip 42'
+
+
+def test_m3u_includes(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    write(tmp_path / 'sub' / 'inner.m3u', 'inner.mp4\n')
+    write(tmp_path / 'loop.m3u', 'loop.mp4\nloop.m3u\n')
+    playlist = write(tmp_path / 'outer.m3u', 'first.mp4\nsub/inner.m3u\nmissing.m3u\nloop.m3u\nlast.mp4\n')
+    reports = []
+    movies = list(build_playlist_m3u(playlist, report=reports.append).movies())
+    assert [os.path.relpath(movie.target, str(tmp_path)) for movie in movies] == [
+        'first.mp4', os.path.join('sub', 'inner.mp4'), 'loop.mp4', 'last.mp4']
+    assert len(reports) == 2
+    assert 'missing.m3u' in reports[0] and 'includes itself' in reports[1]
+
+
+def test_m3u_playlist_is_rebuilt_when_changed(tmp_path):
+    path = tmp_path / 'list.m3u'
+    write(path, 'a.mp4\n')
+    assert build_playlist_m3u(str(path)).length() == 1
+    write(path, 'a.mp4\nb.mp4\n')
+    assert build_playlist_m3u(str(path)).length() == 2
+
+
+def test_playlist_lookup_by_file_name(tmp_path):
+    playlist = build_playlist_m3u(write(tmp_path / 'list.m3u', 'a.mp4\nsub/b.mp4\n'))
+    assert playlist.index_of('b.mp4') == 1
+    assert playlist.index_of('c.mp4') is None
@@ -0,0 +1,55 @@
+import json
+import os
+import time
+
+from Adafruit_Video_Looper.model import Movie
+from Adafruit_Video_Looper.resume import LEGACY_INDEX_FILE, ResumeJournal, write_atomically
+
+
+def test_write_atomically_replaces_the_file(tmp_path):
+    path = str(tmp_path / 'state.json')
+    write_atomically(path, 'old')
+    write_atomically(path, 'new', fsync=False)
+    with open(path) as f:
+        assert f.read() == 'new'
+    assert os.listdir(str(tmp_path)) == ['state.json']
+
+
+def test_journal_writes_the_last_state_on_close(tmp_path):
+    path = str(tmp_path / 'resume.json')
+    journal = ResumeJournal(path, interval=60, fsync=False)
+    journal.record(Movie('/media/a.mp4'), 0, 1.23)
+    journal.record(Movie('/media/b.mp4'), 1, 4.56)
+    # Collected for the interval, nothing is written yet.
+    assert not os.path.exists(path)
+    journal.close()
+    state = journal.load()
+    assert (state['target'], state['index'], state['position']) == ('/media/b.mp4', 1, 4.6)
+
+
+def test_journal_writes_after_the_interval(tmp_path):
+    path = str(tmp_path / 'resume.json')
+    journal = ResumeJournal(path, interval=0.05, fsync=False)
+    journal.record(Movie('/media/a.mp4'), 3)
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with open(path) as f:
+        assert json.load(f)['index'] == 3
+    journal.close()
+
+
+def test_close_without_updates_writes_nothing(tmp_path):
+    path = str(tmp_path / 'resume.json')
+    ResumeJournal(path, fsync=False).close()
+    assert not os.path.exists(path)
+
+
+def test_load_falls_back_to_the_legacy_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'resume.json').write_text('{broken')
+    journal = ResumeJournal(str(tmp_path / 'resume.json'), fsync=False)
+    assert journal.load() is None
+    (tmp_path / LEGACY_INDEX_FILE).write_text('7')
+    assert journal.load() == {'index': 7}
+    journal.close()
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from Adafruit_Video_Looper.schedule import Schedule, ScheduleRule, load_schedule, parse_days, parse_time
+
+# A monday.
+MONDAY = datetime(2024, 1, 1)
+
+
+def test_parse_days():
+    assert parse_days('') == set(range(7))
+    assert parse_days('Daily') == set(range(7))
+    assert parse_days('*') == set(range(7))
+    assert parse_days('mon-fri') == {0, 1, 2, 3, 4}
+    assert parse_days('monday, Sun') == {0, 6}
+    # Ranges wrap around the week.
+    assert parse_days('fri-mon') == {4, 5, 6, 0}
+    with pytest.raises(ValueError):
+        parse_days('mon-xyz')
+
+
+def test_parse_time():
+    assert parse_time('00:00') == 0
+    assert parse_time(' 06:30 ') == 6 * 60 + 30
+    assert parse_time('24:00') == 24 * 60
+    for text in ('6', '06:60', '24:01', '-1:00', 'ab:cd'):
+        with pytest.raises(ValueError):
+            parse_time(text)
+
+
+def test_rule_at_and_next_change():
+    morning = ScheduleRule('morning', 'morning.m3u', None)
+    schedule = Schedule([(morning, {0}, parse_time('06:00'), parse_time('11:30'))])
+    assert schedule.transitions() == 2
+    assert schedule.rule_at(MONDAY.replace(hour=5, minute=59)) is None
+    assert schedule.rule_at(MONDAY.replace(hour=6)) is morning
+    assert schedule.rule_at(MONDAY.replace(hour=11, minute=30)) is None
+    assert schedule.next_change(MONDAY.replace(hour=7, second=12)) == MONDAY.replace(hour=11, minute=30)
+    # After the last change of the week the next one is next monday.
+    assert schedule.next_change(MONDAY.replace(day=7, hour=23)) == MONDAY.replace(day=8, hour=6)
+
+
+def test_rule_past_midnight_wraps_around_the_week():
+    night = ScheduleRule('night', None, '/media/night')
+    schedule = Schedule([(night, {6}, parse_time('22:00'), parse_time('02:00'))])
+    # Sunday night runs into monday morning of the same week.
+    assert schedule.rule_at(MONDAY.replace(hour=1, minute=59)) is night
+    assert schedule.rule_at(MONDAY.replace(hour=2)) is None
+    assert schedule.rule_at(MONDAY.replace(day=7, hour=22)) is night
+    assert schedule.next_change(MONDAY.replace(day=7, hour=23)) == MONDAY.replace(day=8, hour=2)
+
+
+def test_later_rules_win_and_constant_schedules():
+    day = ScheduleRule('day', 'day.m3u', None)
+    lunch = ScheduleRule('lunch', 'lunch.m3u', None)
+    schedule = Schedule([(day, set(range(7)), 0, parse_time('24:00')),
+                         (lunch, {2}, parse_time('12:00'), parse_time('13:00'))])
+    assert schedule.rule_at(MONDAY.replace(day=3, hour=12, minute=30)) is lunch
+    assert schedule.rule_at(MONDAY.replace(day=3, hour=13)) is day
+    always = Schedule([(day, set(range(7)), 0, parse_time('24:00'))])
+    assert always.transitions() == 0
+    assert always.rule_at(MONDAY) is day
+    assert always.next_change(MONDAY) is None
+
+
+def test_load_schedule(tmp_path):
+    path = tmp_path / 'schedule.ini'
+    path.write_text('[morning]\ndays = mon-fri\nstart = 06:00\nend = 11:30\nplaylist = morning.m3u\n\n'
+                    '[weekend]\ndays = sat-sun\nfolder = /media/weekend\n')
+    schedule = load_schedule(str(path))
+    assert [rule.name for rule in schedule.rules] == ['morning', 'weekend']
+    assert schedule.rule_at(MONDAY.replace(day=6, hour=3)).folder == '/media/weekend'
+    path.write_text('[broken]\ndays = daily\n')
+    with pytest.raises(ValueError):
+        load_schedule(str(path))
+    with pytest.raises(ValueError):
+        load_schedule(str(tmp_path / 'missing.ini'))